@@ -2,25 +2,44 @@ import streamlit as st
 import asyncio
 import re
 import io
-import nest_asyncio
-from groq import Groq
+from groq import Groq, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 from playwright.async_api import async_playwright
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin, urldefrag
 from collections import deque
+from html.parser import HTMLParser
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 import re
 import pandas as pd
 from openpyxl import load_workbook
 from openpyxl.styles import Alignment
 from openpyxl.utils import get_column_letter
+import hashlib
+import ast
 import json
+import os
 import sys
+import threading
+import time
+import uuid
+import copy
+import zipfile
+import random
+import functools
+import types
+import traceback
+import contextlib
+import contextvars
+import shutil
+import tempfile
+from datetime import datetime
 
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-
-nest_asyncio.apply()
+    pwd = None
+else:
+    import pwd
 
 # --- 1. ORIGINAL SCRIPT CODE (UNMODIFIED) ---
 # Load config
@@ -31,10 +50,13 @@ nest_asyncio.apply()
 # DEFAULT_GROQ_MODEL = CONFIG["groq_default_model"]
 GROQ_API_KEY = st.secrets["groq_api_key"]
 DEFAULT_GROQ_MODEL = st.secrets["groq_default_model"]
+# Optional: point the client at another OpenAI-compatible endpoint (e.g. benchmarks/fake_llm_server.py)
+GROQ_BASE_URL = st.secrets.get("groq_base_url")
 
-# Initialize the Groq client
+# Initialize the Groq client. The SDK's own retries are off: LLMScheduler and ModelRouter do all retrying,
+# so every attempt goes through the rate limit buckets and shows up in the metrics.
 try:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+    groq_client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, max_retries=0)
 except Exception as e:
     st.error(f"Failed to initialize Groq client. Check your API key in config.json. Error: {e}")
     st.stop()
@@ -59,35 +81,680 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
+# --- UI messages (routed to the running job when there is one) ---
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+def ui_message(message: str, level: str = "write"):
+    """Shows a progress/status message: on the page for inline runs, in the job log for background jobs."""
+    job = _current_job.get()
+    if job is not None:
+        job.log(message, level)
+    else:
+        getattr(st, level)(message)
+
+
+# --- Tracing & metrics (spans, durations, token usage, cache hits per run) ---
+
+RUN_METRICS_DIR = "run_metrics"
+
+
+class Span:
+    """One timed stage of a run. Attributes carry token counts, cache hits, URLs, etc."""
+    def __init__(self, span_id: int, name: str, parent_id, attrs: dict):
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.attrs = dict(attrs)
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+
+class RunTrace:
+    """Collects the spans and counters of a single generation/feedback/edit run."""
+    def __init__(self, run_name: str):
+        self.run_name = run_name
+        self.run_id = f"{run_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.spans = []
+        self.counters = {}
+        self.export_paths = {}
+        self._lock = threading.Lock()
+
+    def open_span(self, name: str, parent_id, attrs: dict) -> Span:
+        with self._lock:
+            span = Span(len(self.spans), name, parent_id, attrs)
+            self.spans.append(span)
+        return span
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def root(self):
+        return self.spans[0] if self.spans else None
+
+    def children(self, span: Span) -> list:
+        return [s for s in self.spans if s.parent_id == span.span_id and s.end is not None]
+
+    def critical_path(self) -> list:
+        """Walks back from the end of the run, always following the child that finished last.
+
+        The returned spans (in chronological order) are the chain that determined the run's wall time.
+        """
+        def walk(span: Span, depth: int) -> list:
+            chain = []
+            cursor = span.end
+            remaining = self.children(span)
+            while True:
+                candidates = [c for c in remaining if c.end <= cursor + 1e-6]
+                if not candidates:
+                    break
+                last = max(candidates, key=lambda c: c.end)
+                chain = walk(last, depth + 1) + chain
+                cursor = last.start
+                remaining = [c for c in candidates if c is not last and c.end <= cursor + 1e-6]
+            return [(span, depth)] + chain
+
+        root = self.root()
+        if root is None or root.end is None:
+            return []
+        return [
+            {"stage": s.name, "depth": depth, "start_ms": round((s.start - root.start) * 1000, 1), "duration_ms": round(s.duration_ms, 1)}
+            for s, depth in walk(root, 0)
+        ]
+
+    def token_totals(self) -> dict:
+        totals = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "llm_calls": 0}
+        for span in self.spans:
+            if "total_tokens" in span.attrs:
+                totals["llm_calls"] += 1
+                for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                    totals[key] += span.attrs.get(key) or 0
+        return totals
+
+    def to_dict(self) -> dict:
+        root = self.root()
+        return {
+            "run_id": self.run_id,
+            "run_name": self.run_name,
+            "started_at": self.started_at,
+            "duration_ms": round(root.duration_ms, 1) if root else 0.0,
+            "tokens": self.token_totals(),
+            "counters": dict(self.counters),
+            "critical_path": self.critical_path(),
+            "exports": dict(self.export_paths),
+            "spans": [
+                {
+                    "id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "name": s.name,
+                    "start_ms": round((s.start - root.start) * 1000, 1) if root else 0.0,
+                    "duration_ms": round(s.duration_ms, 1),
+                    **{k: v for k, v in s.attrs.items() if isinstance(v, (str, int, float, bool)) or v is None},
+                }
+                for s in self.spans
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        """Renders the run in Prometheus text exposition format."""
+        def label(value) -> str:
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+        run = label(self.run_id)
+        stage_seconds, stage_calls, agent_tokens = {}, {}, {}
+        for span in self.spans:
+            stage_seconds[span.name] = stage_seconds.get(span.name, 0.0) + span.duration_ms / 1000
+            stage_calls[span.name] = stage_calls.get(span.name, 0) + 1
+            if "total_tokens" in span.attrs:
+                agent = span.attrs.get("agent", span.name)
+                for kind in ("prompt", "completion"):
+                    key = (agent, kind)
+                    agent_tokens[key] = agent_tokens.get(key, 0) + (span.attrs.get(f"{kind}_tokens") or 0)
+
+        lines = [
+            "# HELP qa_run_duration_seconds Wall time of the whole run.",
+            "# TYPE qa_run_duration_seconds gauge",
+            f'qa_run_duration_seconds{{run_id="{run}",run="{label(self.run_name)}"}} {self.root().duration_ms / 1000 if self.root() else 0:.4f}',
+            "# HELP qa_stage_duration_seconds Summed wall time per stage.",
+            "# TYPE qa_stage_duration_seconds gauge",
+        ]
+        lines += [f'qa_stage_duration_seconds{{run_id="{run}",stage="{label(n)}"}} {v:.4f}' for n, v in stage_seconds.items()]
+        lines += ["# HELP qa_stage_calls_total Number of spans per stage.", "# TYPE qa_stage_calls_total counter"]
+        lines += [f'qa_stage_calls_total{{run_id="{run}",stage="{label(n)}"}} {v}' for n, v in stage_calls.items()]
+        lines += ["# HELP qa_llm_tokens_total Tokens reported by the LLM per agent.", "# TYPE qa_llm_tokens_total counter"]
+        lines += [f'qa_llm_tokens_total{{run_id="{run}",agent="{label(a)}",kind="{k}"}} {v}' for (a, k), v in agent_tokens.items()]
+        lines += ["# HELP qa_run_counter Free-form run counters (cache hits, pages, ...).", "# TYPE qa_run_counter gauge"]
+        lines += [f'qa_run_counter{{run_id="{run}",name="{label(n)}"}} {v}' for n, v in self.counters.items()]
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory: str = RUN_METRICS_DIR) -> dict:
+        """Writes <run_id>.json and <run_id>.prom and returns their paths."""
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f"{self.run_id}.json")
+        prom_path = os.path.join(directory, f"{self.run_id}.prom")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        self.export_paths = {"json": json_path, "prometheus": prom_path}
+        return self.export_paths
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+@contextlib.contextmanager
+def trace_span(name: str, **attrs):
+    """Times a stage inside the active run trace. Outside a run it yields a detached span."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield Span(-1, name, None, attrs)
+        return
+    parent = _current_span.get()
+    span = trace.open_span(name, parent.span_id if parent else None, attrs)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.attrs["error"] = e.__class__.__name__
+        raise
+    finally:
+        span.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def trace_count(name: str, value: float = 1):
+    """Increments a counter (e.g. cache hits) on the active run trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+@contextlib.contextmanager
+def start_run_trace(run_name: str):
+    """Opens a run-level trace; on exit the metrics are exported to RUN_METRICS_DIR."""
+    trace = RunTrace(run_name)
+    trace_token = _current_trace.set(trace)
+    try:
+        with trace_span(run_name):
+            yield trace
+    finally:
+        _current_trace.reset(trace_token)
+        try:
+            trace.export()
+        except OSError as e:
+            ui_message(f"⚠️ Could not export run metrics: {e}", "warning")
+
+
+# --- Model routing (per-stage model tiers with latency-aware fallback) ---
+
+# Stage -> tier. Only planning needs the large model; everything else is a short, cheap call.
+DEFAULT_STAGE_TIERS = {
+    "refine": "fast",
+    "page_summary": "fast",
+    "inspector_reduce": "fast",
+    "site_inspector": "fast",
+    "planner": "large",
+    "planner_json": "large",
+    "script_writer": "large",
+    "gap_planner": "large",
+    "field_detect": "fast",
+    "field_rewrite": "fast",
+}
+# Per-request timeout for each tier's models; a timed-out request moves on to the next candidate
+DEFAULT_TIER_TIMEOUT_SECONDS = {"fast": 30.0, "large": 120.0}
+# A model whose rolling p95 exceeds its tier's threshold is skipped while a faster candidate exists.
+# Thresholds are capped below the tier's timeout, since slower requests never complete to be measured.
+DEFAULT_TIER_SLOW_P95_MS = {"fast": 15000, "large": 90000}
+MODEL_SLOW_TIMEOUT_FRACTION = 0.75
+MODEL_LATENCY_WINDOW = 50
+MODEL_LATENCY_MIN_SAMPLES = 5
+MODEL_COOLDOWN_SECONDS = 30
+# Errors after which the same request is retried on the next candidate model (429s are handled separately)
+ROUTER_RETRYABLE_ERRORS = (APITimeoutError, APIConnectionError, InternalServerError)
+
+
+class LLMUnavailable(Exception):
+    """Raised when no candidate model of a stage produced a completion."""
+    pass
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class ModelRouter:
+    """Picks a model per pipeline stage from configured tiers, tracking rolling latency per model.
+
+    Candidates of a stage are its tier's models in configured order followed by DEFAULT_GROQ_MODEL.
+    Models that were rate-limited or failed are cooled down; models whose p95 is over the tier's
+    threshold are moved behind healthy ones.
+    """
+    def __init__(self, tiers: dict, stage_tiers: dict, slow_p95_ms: dict, default_model: str = DEFAULT_GROQ_MODEL,
+                 timeouts_s: dict = None):
+        self.tiers = {tier: list(models) for tier, models in tiers.items()}
+        self.stage_tiers = dict(stage_tiers)
+        self.timeouts_s = {**DEFAULT_TIER_TIMEOUT_SECONDS, **(timeouts_s or {})}
+        self.slow_p95_ms = {
+            tier: min(threshold, self.timeouts_s[tier] * 1000 * MODEL_SLOW_TIMEOUT_FRACTION) if tier in self.timeouts_s else threshold
+            for tier, threshold in slow_p95_ms.items()
+        }
+        self.default_model = default_model
+        self._latencies = {}
+        self._cooldown_until = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def tier_for(self, stage: str) -> str:
+        return self.stage_tiers.get(stage, "large")
+
+    def timeout_for(self, stage: str) -> float:
+        return self.timeouts_s.get(self.tier_for(stage), DEFAULT_TIER_TIMEOUT_SECONDS["large"])
+
+    def observe(self, model: str, latency_ms: float):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=MODEL_LATENCY_WINDOW)).append(latency_ms)
+
+    def penalize(self, model: str, seconds: float = MODEL_COOLDOWN_SECONDS):
+        with self._lock:
+            self._cooldown_until[model] = max(self._cooldown_until.get(model, 0.0), time.monotonic() + seconds)
+            self._failures[model] = self._failures.get(model, 0) + 1
+
+    def latency_stats(self, model: str) -> dict:
+        with self._lock:
+            samples = list(self._latencies.get(model, ()))
+        if not samples:
+            return {"samples": 0, "p50_ms": None, "p95_ms": None}
+        return {"samples": len(samples), "p50_ms": round(percentile(samples, 0.5), 1), "p95_ms": round(percentile(samples, 0.95), 1)}
+
+    def route(self, stage: str) -> list:
+        """Ordered candidate models for a stage: healthy and fast first, slow next, cooling down last."""
+        tier = self.tier_for(stage)
+        candidates = []
+        for model in self.tiers.get(tier, []) + [self.default_model]:
+            if model and model not in candidates:
+                candidates.append(model)
+        now = time.monotonic()
+        threshold = self.slow_p95_ms.get(tier)
+
+        def rank(model: str):
+            with self._lock:
+                cooling = self._cooldown_until.get(model, 0.0) > now
+                cooldown_until = self._cooldown_until.get(model, 0.0)
+            stats = self.latency_stats(model)
+            slow = bool(threshold and stats["samples"] >= MODEL_LATENCY_MIN_SAMPLES and stats["p95_ms"] > threshold)
+            return (cooling, cooldown_until if cooling else 0.0, slow)
+
+        # sorted() is stable, so configured order is kept within each health class
+        return sorted(candidates, key=rank)
+
+    def snapshot(self) -> list:
+        now = time.monotonic()
+        models = []
+        for tier_models in list(self.tiers.values()) + [[self.default_model]]:
+            for model in tier_models:
+                if model not in models:
+                    models.append(model)
+        rows = []
+        for model in models:
+            with self._lock:
+                cooldown = max(self._cooldown_until.get(model, 0.0) - now, 0.0)
+                failures = self._failures.get(model, 0)
+            rows.append({
+                "model": model,
+                "tiers": ", ".join(t for t, m in self.tiers.items() if model in m) or "default",
+                **self.latency_stats(model),
+                "failures": failures,
+                "cooldown_s": round(cooldown, 1),
+            })
+        return rows
+
+
+@st.cache_resource
+def get_model_router():
+    tiers = {tier: list(models) for tier, models in st.secrets.get("model_tiers", {}).items()}
+    tiers.setdefault("fast", [DEFAULT_GROQ_MODEL])
+    tiers.setdefault("large", [DEFAULT_GROQ_MODEL])
+    stage_tiers = {**DEFAULT_STAGE_TIERS, **dict(st.secrets.get("model_routing", {}))}
+    slow_p95_ms = {**DEFAULT_TIER_SLOW_P95_MS, **{k: float(v) for k, v in st.secrets.get("model_slow_p95_ms", {}).items()}}
+    timeouts_s = {k: float(v) for k, v in st.secrets.get("model_timeout_s", {}).items()}
+    return ModelRouter(tiers, stage_tiers, slow_p95_ms, timeouts_s=timeouts_s)
+
+
+# --- LLM scheduling (shared RPM/TPM budget, priorities, 429 backoff) ---
+
+# Per-model budgets; leave unset to skip proactive metering and only react to 429s
+LLM_REQUESTS_PER_MINUTE = st.secrets.get("groq_rpm")
+LLM_TOKENS_PER_MINUTE = st.secrets.get("groq_tpm")
+LLM_MAX_RATE_LIMIT_RETRIES = int(st.secrets.get("groq_max_retries", 4))
+LLM_BACKOFF_BASE_SECONDS = 1.0
+LLM_BACKOFF_MAX_SECONDS = 60.0
+LLM_SCHEDULER_POLL_SECONDS = 0.05
+LLM_WAIT_NOTICE_SECONDS = 2.0
+# Rough prompt size estimate used for metering before the API reports real usage
+CHARS_PER_TOKEN = 4
+
+# Lower runs first: interactive edits go ahead of bulk planning
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+STAGE_PRIORITIES = {
+    "field_detect": PRIORITY_INTERACTIVE,
+    "field_rewrite": PRIORITY_INTERACTIVE,
+    "planner": PRIORITY_BULK,
+    "planner_json": PRIORITY_BULK,
+    "gap_planner": PRIORITY_BULK,
+}
+
+
+class LLMRateLimitExceeded(LLMUnavailable):
+    """Raised when a call is still rate limited after all retries, instead of passing error text on as model output."""
+
+
+class TokenBucket:
+    """Continuously refilled budget of `capacity` units per minute."""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute) if per_minute else None
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.capacity is None:
+            return
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (requests larger than the bucket only need a full bucket)."""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        deficit = min(amount, self.capacity) - self.level
+        return max(deficit, 0.0) * 60 / self.capacity
+
+    def take(self, amount: float, now: float):
+        if self.capacity is None:
+            return
+        self._refill(now)
+        # May go negative when actual usage exceeds the estimate; later callers then wait it off
+        self.level -= amount
+
+
+def retry_after_seconds(error: Exception):
+    """The server's retry-after hint from a 429 response, if it sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LLMScheduler:
+    """Process-wide gate in front of the Groq client.
+
+    Every call waits for a slot in its model's request and token buckets; waiters are served by
+    priority, then arrival. A 429 pauses the model for the server's retry-after (or an exponential
+    backoff) plus jitter, so concurrent sessions back off together instead of hammering the API.
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._buckets = {}
+        self._paused_until = {}
+        self._waiting = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._waits_ms = deque(maxlen=200)
+        self.stats = {"calls": 0, "rate_limited": 0, "retries": 0, "gave_up": 0, "max_queue_depth": 0}
+
+    def _buckets_for(self, model: str):
+        if model not in self._buckets:
+            self._buckets[model] = (TokenBucket(self.requests_per_minute), TokenBucket(self.tokens_per_minute))
+        return self._buckets[model]
+
+    def _delay(self, model: str, tokens: int, now: float) -> float:
+        requests_bucket, tokens_bucket = self._buckets_for(model)
+        return max(
+            self._paused_until.get(model, 0.0) - now,
+            requests_bucket.wait_time(1, now),
+            tokens_bucket.wait_time(tokens, now),
+        )
+
+    async def acquire(self, model: str, tokens: int, priority: int = PRIORITY_NORMAL) -> float:
+        """Waits until this call may be sent to `model`; returns the time spent queued in ms."""
+        started = time.monotonic()
+        with self._lock:
+            self._sequence += 1
+            ticket = (priority, self._sequence, model)
+            self._waiting.append(ticket)
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._waiting))
+        notified = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    head = min(t for t in self._waiting if t[2] == model)
+                    delay = self._delay(model, tokens, now) if head == ticket else LLM_SCHEDULER_POLL_SECONDS
+                    if head == ticket and delay <= 0:
+                        requests_bucket, tokens_bucket = self._buckets_for(model)
+                        requests_bucket.take(1, now)
+                        tokens_bucket.take(tokens, now)
+                        self._waiting.remove(ticket)
+                        waited_ms = (now - started) * 1000
+                        self._waits_ms.append(waited_ms)
+                        self.stats["calls"] += 1
+                        return waited_ms
+                if not notified and head == ticket and delay >= LLM_WAIT_NOTICE_SECONDS:
+                    ui_message(f"Waiting ~{delay:.0f}s for Groq rate limit budget on {model}...")
+                    notified = True
+                # Re-check at least every 250ms so a higher-priority arrival can take the head
+                await asyncio.sleep(min(max(delay, LLM_SCHEDULER_POLL_SECONDS), 0.25))
+        finally:
+            with self._lock:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+
+    def settle(self, model: str, estimated_tokens: int, actual_tokens: int):
+        """Corrects the token bucket once the API has reported real usage."""
+        if not actual_tokens:
+            return
+        with self._lock:
+            self._buckets_for(model)[1].take(actual_tokens - estimated_tokens, time.monotonic())
+
+    def backoff(self, model: str, error: Exception, attempt: int) -> float:
+        """Pauses `model` after a 429 and returns the pause in seconds."""
+        hint = retry_after_seconds(error)
+        base = hint if hint is not None else min(LLM_BACKOFF_BASE_SECONDS * 2 ** attempt, LLM_BACKOFF_MAX_SECONDS)
+        delay = base + random.uniform(0, base * 0.25)
+        with self._lock:
+            self._paused_until[model] = max(self._paused_until.get(model, 0.0), time.monotonic() + delay)
+            self.stats["rate_limited"] += 1
+        return delay
+
+    def count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            waits = list(self._waits_ms)
+            return {
+                **self.stats,
+                "queue_depth": len(self._waiting),
+                "wait_p50_ms": round(percentile(waits, 0.5), 1) if waits else 0.0,
+                "wait_p95_ms": round(percentile(waits, 0.95), 1) if waits else 0.0,
+                "paused_models": {m: round(until - now, 1) for m, until in self._paused_until.items() if until > now},
+                "rpm_limit": self.requests_per_minute,
+                "tpm_limit": self.tokens_per_minute,
+            }
+
+
+@st.cache_resource
+def get_llm_scheduler():
+    return LLMScheduler(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+
+
+class LLMResult:
+    """Text of one completion plus the usage and latency needed for accounting."""
+    def __init__(self, text: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0, latency_ms: float = 0.0, error: str = None):
+        self.text = text
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency_ms = latency_ms
+        self.error = error
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
 class GroqOSSAgent:
     """Base agent class using Groq models"""
-    def __init__(self, name: str, system_message: str, model_name: str = DEFAULT_GROQ_MODEL):
+    def __init__(self, name: str, system_message: str, model_name: str = DEFAULT_GROQ_MODEL,
+                 max_tokens: int = 8500, temperature: float = None, profile: str = None, response_format: dict = None):
         self.name = name
         self.system_message = system_message
         self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.profile = profile
+        self.response_format = response_format
 
     async def generate_response(self, message: str) -> str:
-        try:
-            def run_completion():
-                completion = groq_client.chat.completions.create(
-                    model=self.model_name,
-                    max_tokens=8500,
+        return (await self.complete(message)).text
+
+    async def complete(self, message: str, stage: str = None) -> LLMResult:
+        """Runs one completion for a pipeline stage (defaults to the agent's profile).
+
+        The model comes from the router and every attempt waits its turn in the shared scheduler.
+        Timeouts and server errors fall through to the stage's next candidate model; 429s pause the
+        model and re-route, raising LLMRateLimitExceeded once the retries are used up. LLMUnavailable is
+        raised when every candidate failed, so an error never reaches callers disguised as model output.
+        """
+        stage = stage or self.profile
+        router = get_model_router()
+        candidates = router.route(stage) if stage else [self.model_name]
+        timeout = router.timeout_for(stage or self.profile)
+        with trace_span(f"llm:{self.name}", agent=self.name, profile=self.profile, stage=stage, model=candidates[0],
+                        system_chars=len(self.system_message), prompt_chars=len(self.system_message) + len(message)) as span:
+            started = time.perf_counter()
+            error = None
+
+            def run_completion(model: str):
+                options = {"temperature": self.temperature} if self.temperature is not None else {}
+                if self.response_format is not None:
+                    options["response_format"] = self.response_format
+                return groq_client.chat.completions.create(
+                    model=model,
+                    timeout=timeout,
+                    max_tokens=self.max_tokens,
                     messages=[
                         {"role": "system", "content": self.system_message},
                         {"role": "user", "content": message}
-                    ]
+                    ],
+                    **options
                 )
-                return completion.choices[0].message.content
 
+            scheduler = get_llm_scheduler()
+            priority = STAGE_PRIORITIES.get(stage, PRIORITY_NORMAL)
+            estimated_tokens = (len(self.system_message) + len(message)) // CHARS_PER_TOKEN + self.max_tokens
             loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, run_completion)
-        except Exception as e:
-            return f"Error generating Groq OSS response: {str(e)}"
-
-async def refine_instruction(instruction: str) -> str:
-    refiner = GroqOSSAgent(
-        name="InstructionRefiner",
-        system_message="""
+            fallbacks = rate_limit_retries = 0
+            queued_ms = 0.0
+            index = 0
+            while index < len(candidates):
+                model = candidates[index]
+                waited_ms = await scheduler.acquire(model, estimated_tokens, priority)
+                queued_ms += waited_ms
+                span.attrs["queue_wait_ms"] = round(queued_ms, 1)
+                trace_count("llm_queue_wait_ms", round(waited_ms, 1))
+                call_started = time.perf_counter()
+                try:
+                    completion = await loop.run_in_executor(None, run_completion, model)
+                except RateLimitError as e:
+                    delay = scheduler.backoff(model, e, rate_limit_retries)
+                    router.penalize(model, delay)
+                    rate_limit_retries += 1
+                    span.attrs["rate_limited"] = rate_limit_retries
+                    trace_count("llm_rate_limited")
+                    if rate_limit_retries > LLM_MAX_RATE_LIMIT_RETRIES:
+                        scheduler.count("gave_up")
+                        raise LLMRateLimitExceeded(
+                            f"Groq rate limit still exceeded for stage '{stage or self.name}' after {LLM_MAX_RATE_LIMIT_RETRIES} retries: {e}"
+                        ) from e
+                    # Re-route: the paused model now sorts behind any candidate that is still available
+                    scheduler.count("retries")
+                    candidates = router.route(stage) if stage else [self.model_name]
+                    index = 0
+                    continue
+                except ROUTER_RETRYABLE_ERRORS as e:
+                    router.penalize(model)
+                    error = e
+                    fallbacks += 1
+                    span.attrs["fallbacks"] = fallbacks
+                    index += 1
+                    continue
+                except Exception as e:
+                    error = e
+                    break
+                router.observe(model, (time.perf_counter() - call_started) * 1000)
+                span.attrs["model"] = model
+                result = LLMResult(completion.choices[0].message.content, model, latency_ms=(time.perf_counter() - started) * 1000)
+                usage = getattr(completion, "usage", None)
+                if usage is not None:
+                    result.prompt_tokens = usage.prompt_tokens or 0
+                    result.completion_tokens = usage.completion_tokens or 0
+                    span.attrs["prompt_tokens"] = result.prompt_tokens
+                    span.attrs["completion_tokens"] = result.completion_tokens
+                    span.attrs["total_tokens"] = result.total_tokens
+                scheduler.settle(model, estimated_tokens, result.total_tokens)
+                get_profile_stats().record(self.profile or self.name, len(self.system_message), result)
+                return result
+
+            span.attrs["error"] = error.__class__.__name__
+            raise LLMUnavailable(
+                f"No model could complete stage '{stage or self.name}' (tried {', '.join(candidates[:index + 1])}): "
+                f"{error.__class__.__name__}: {error}"
+            ) from error
+
+# --- Agent profiles (task-specific system prompts and generation settings) ---
+
+class AgentProfile:
+    """Settings for one kind of LLM task. A system_message of None means the agent class defines it."""
+    def __init__(self, name: str, system_message, max_tokens: int, temperature: float = None, response_format: dict = None):
+        self.name = name
+        self.system_message = system_message
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.response_format = response_format
+
+
+AGENT_PROFILES = {
+    # Reserved for test planning; its multi-kilobyte prompt lives in PlannerAgentOSS
+    "planner": AgentProfile("PlannerOSS", None, max_tokens=8500),
+    # Same planner prompt plus PLANNER_JSON_OUTPUT_INSTRUCTIONS, with the API's JSON mode switched on
+    "planner_json": AgentProfile("PlannerOSS-JSON", None, max_tokens=8500, response_format={"type": "json_object"}),
+    # Small targeted requests for one empty coverage cell; prompt is GAP_PLANNER_SYSTEM_MESSAGE
+    "gap_planner": AgentProfile("GapPlanner", None, max_tokens=2048, response_format={"type": "json_object"}),
+    "site_inspector": AgentProfile("SiteInspector", None, max_tokens=8500),
+    "refine": AgentProfile(
+        "InstructionRefiner",
+        """
         You are an expert in writing clear, precise, and unambiguous instructions for QA automation tasks.
         Your task is to refine the provided instruction and make it understandable by an LLM easily, to ensure it is:
         - Clear and concise, actionable language, avoiding ambiguity.
@@ -107,9 +774,776 @@ async def refine_instruction(instruction: str) -> str:
         - Requests per-step pass/fail logging and assertions
         Output only the refined instruction as plain text, no markdown or explanations. Dont output any testcases in this step.
         """,
-        model_name=DEFAULT_GROQ_MODEL
+        max_tokens=4096,
+        temperature=0.3
+    ),
+    "script_writer": AgentProfile(
+        "ScriptWriter",
+        "You are a senior test automation engineer. Convert the given manual test case into ONE Python function:\n"
+        "async def run_test(page, base_url, credentials):\n"
+        "using the Playwright async API (await page.goto, page.get_by_role, page.get_by_label, page.locator, fill, click) "
+        "and `expect` assertions; `expect` is already imported and nothing else may be imported or used "
+        "(no asyncio, time or os: wait with page.wait_for_timeout or expect), and no names starting with an underscore. "
+        "Stay on the page you are given: no page.context, page.request, file paths (path=, set_input_files) or str.format; "
+        "use f-strings instead. "
+        "Navigate with urls built from base_url. credentials is a dict with 'username' and 'password'. "
+        "Prefer the provided known locators, then role- and text-based locators. "
+        "Raise AssertionError with a clear message when a check fails. "
+        "Return ONLY the Python code of the function, without markdown fences or explanations.",
+        max_tokens=2048,
+        temperature=0
+    ),
+    "field_detect": AgentProfile(
+        "FieldDetector",
+        "You are a QA assistant. Given an edit instruction and a list of test case fields, "
+        "return ONLY the exact field name that should be edited, copied verbatim from the list. Do not return anything else.",
+        max_tokens=512,
+        temperature=0
+    ),
+    "field_rewrite": AgentProfile(
+        "FieldEditor",
+        "You are a strict QA editor. Apply the instruction to the given test case field value. "
+        "Return ONLY the updated value. Do NOT include the field name, bullets or any extra text.",
+        max_tokens=2048,
+        temperature=0.2
+    ),
+}
+
+
+def get_profile_agent(profile_name: str) -> GroqOSSAgent:
+    """Builds a lightweight agent from a profile that carries its own system prompt."""
+    profile = AGENT_PROFILES[profile_name]
+    return GroqOSSAgent(
+        profile.name, profile.system_message, model_name=DEFAULT_GROQ_MODEL,
+        max_tokens=profile.max_tokens, temperature=profile.temperature, profile=profile_name,
+        response_format=profile.response_format
     )
-    return await refiner.generate_response(instruction)
+
+
+class ProfileStats:
+    """Process-wide per-profile accounting of system-prompt size, tokens and latency."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiles = {}
+
+    def record(self, profile: str, system_chars: int, result: LLMResult):
+        with self._lock:
+            stats = self.profiles.setdefault(profile, {
+                "calls": 0, "system_chars": system_chars, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": 0.0
+            })
+            stats["calls"] += 1
+            stats["system_chars"] = system_chars
+            stats["prompt_tokens"] += result.prompt_tokens
+            stats["completion_tokens"] += result.completion_tokens
+            stats["latency_ms"] += result.latency_ms
+
+    def table(self, baseline_system_chars: int = None) -> list:
+        """One row per profile; input savings are estimated against the planner prompt (~4 chars per token)."""
+        with self._lock:
+            rows = []
+            for profile, stats in self.profiles.items():
+                calls = max(stats["calls"], 1)
+                row = {
+                    "profile": profile,
+                    "calls": stats["calls"],
+                    "system_prompt_chars": stats["system_chars"],
+                    "avg_prompt_tokens": round(stats["prompt_tokens"] / calls),
+                    "avg_completion_tokens": round(stats["completion_tokens"] / calls),
+                    "avg_latency_ms": round(stats["latency_ms"] / calls, 1),
+                }
+                if baseline_system_chars and profile not in ("planner", "planner_json", "site_inspector"):
+                    row["est_input_tokens_saved"] = max(baseline_system_chars - stats["system_chars"], 0) // 4 * stats["calls"]
+                rows.append(row)
+            return rows
+
+
+@st.cache_resource
+def get_profile_stats():
+    return ProfileStats()
+
+
+async def refine_instruction(instruction: str) -> str:
+    return await get_profile_agent("refine").generate_response(instruction)
+
+# --- Hybrid page fetching (HTTP fast path with browser escalation) ---
+
+CRAWLER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+SKIPPED_LINK_EXTENSIONS = ('.pdf', '.jpg', '.png', '.gif', '.css', '.js', '.zip')
+HTTP_FETCH_TIMEOUT = 15
+SITEMAP_MAX_URLS = 200
+# Pages with less visible text than this (and at least one script) are assumed to be rendered client-side
+STATIC_PAGE_MIN_TEXT_CHARS = 200
+SPA_SHELL_PATTERN = re.compile(
+    r'<div[^>]+id=["\'](?:root|app|__next|__nuxt|svelte)["\'][^>]*>\s*</div>|<app-root|ng-app|data-reactroot',
+    re.IGNORECASE
+)
+NOSCRIPT_JS_PATTERN = re.compile(r'<noscript[^>]*>[^<]*(?:enable|requires?)\s+javascript', re.IGNORECASE)
+LOGIN_URL_PATTERN = re.compile(r'log-?in|sign-?in|auth', re.IGNORECASE)
+
+
+INTERACTIVE_TAGS = ("a", "button", "input", "select", "textarea", "form", "label", "details", "dialog")
+INVENTORY_ATTRIBUTES = ("id", "name", "type", "role", "aria-label", "placeholder", "data-testid", "action", "method")
+# Site-wide chrome, left out of the layout skeleton used for template clustering
+LAYOUT_CHROME_TAGS = ("nav", "header", "footer", "aside")
+
+
+class StaticPageScanner(HTMLParser):
+    """Single pass over raw HTML collecting links, visible text size, script count, interactive elements and tag skeleton.
+
+    The skeleton leaves out page chrome (nav/header/footer/aside), which is shared across a site and would
+    otherwise outweigh the content that tells one layout from another.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.elements = []
+        self.skeleton = []
+        self.text_chars = 0
+        self.script_count = 0
+        self._skip_depth = 0
+        self._chrome_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if tag in ("script", "style", "noscript", "template"):
+            self._skip_depth += 1
+            if tag == "script":
+                self.script_count += 1
+            return
+        if tag in LAYOUT_CHROME_TAGS:
+            self._chrome_depth += 1
+        if not self._skip_depth and not self._chrome_depth:
+            classes = sorted(re.sub(r'\d+', '', c) for c in attributes.get("class", "").split() if c)
+            self.skeleton.append(tag + "".join("." + c for c in classes))
+        if tag == "a":
+            href = attributes.get("href")
+            if href:
+                self.links.append(href)
+        if tag in INTERACTIVE_TAGS or "role" in attributes or "onclick" in attributes:
+            signature = tag + "".join(f"[{name}={attributes[name]}]" for name in INVENTORY_ATTRIBUTES if attributes.get(name))
+            if tag == "a" and attributes.get("href"):
+                signature += f"[href={urlparse(attributes['href']).path}]"
+            self.elements.append(signature)
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style", "noscript", "template") and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in LAYOUT_CHROME_TAGS and self._chrome_depth:
+            self._chrome_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.text_chars += len(data.strip())
+
+
+def inventory_fingerprint(elements: list) -> str:
+    """Order-insensitive hash of a page's interactive-element inventory."""
+    return hashlib.sha256("\n".join(sorted(elements)).encode("utf-8")).hexdigest()[:16]
+
+
+def scan_static_page(html: str) -> StaticPageScanner:
+    scanner = StaticPageScanner()
+    try:
+        scanner.feed(html)
+        scanner.close()
+    except Exception:
+        pass  # Malformed markup: keep whatever was collected so far
+    return scanner
+
+
+def is_crawlable_link(link: str, base_origin: str) -> bool:
+    parsed = urlparse(link)
+    return (link.startswith(base_origin) and
+            not any(link.lower().endswith(ext) for ext in SKIPPED_LINK_EXTENSIONS) and
+            parsed.path != '/' and parsed.path != '')
+
+
+def extract_links(hrefs, page_url: str, base_origin: str) -> list:
+    """Resolves raw hrefs against the page URL and keeps crawlable same-origin links."""
+    links = []
+    for href in hrefs:
+        try:
+            full_url = urldefrag(urljoin(page_url, href.strip())).url
+        except ValueError:
+            continue
+        if is_crawlable_link(full_url, base_origin) and full_url not in links:
+            links.append(full_url)
+    return links
+
+
+def build_http_session(cookies: list, user_agent: str = CRAWLER_USER_AGENT) -> requests.Session:
+    """Pooled HTTP session carrying the authenticated cookies of a Playwright context."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "User-Agent": user_agent,
+        "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+    })
+    for cookie in cookies:
+        session.cookies.set(
+            cookie["name"], cookie["value"],
+            domain=cookie.get("domain", ""), path=cookie.get("path", "/")
+        )
+    return session
+
+
+def fetch_sitemap_urls(session: requests.Session, base_origin: str, limit: int = SITEMAP_MAX_URLS) -> list:
+    """Reads <loc> entries from /sitemap.xml, following one level of sitemap indexes."""
+    urls = []
+    sitemaps = deque([base_origin + "/sitemap.xml"])
+    seen_sitemaps = set()
+    while sitemaps and len(urls) < limit:
+        sitemap_url = sitemaps.popleft()
+        if sitemap_url in seen_sitemaps or len(seen_sitemaps) > 10:
+            continue
+        seen_sitemaps.add(sitemap_url)
+        try:
+            response = session.get(sitemap_url, timeout=HTTP_FETCH_TIMEOUT)
+        except requests.RequestException:
+            continue
+        if response.status_code != 200:
+            continue
+        for loc in re.findall(r'<loc>\s*([^<\s]+)\s*</loc>', response.text, re.IGNORECASE):
+            loc = loc.replace("&amp;", "&")
+            if loc.lower().endswith(".xml") or loc.lower().endswith(".xml.gz"):
+                if loc.startswith(base_origin):
+                    sitemaps.append(loc)
+            elif is_crawlable_link(loc, base_origin) and loc not in urls:
+                urls.append(loc)
+                if len(urls) >= limit:
+                    break
+    return urls
+
+
+def needs_js_rendering(url: str, response: requests.Response, scanner: StaticPageScanner):
+    """Heuristics deciding whether an HTTP response is usable or the page must go through the browser.
+
+    Returns a (needs_browser, reason) tuple.
+    """
+    if response.status_code >= 400:
+        return True, f"http {response.status_code}"
+    content_type = response.headers.get("Content-Type", "")
+    if "html" not in content_type.lower():
+        return True, f"non-html ({content_type or 'unknown'})"
+    if response.url != url and LOGIN_URL_PATTERN.search(urlparse(response.url).path) and not LOGIN_URL_PATTERN.search(urlparse(url).path):
+        return True, "redirected to login"
+    html = response.text
+    if SPA_SHELL_PATTERN.search(html) and scanner.text_chars < STATIC_PAGE_MIN_TEXT_CHARS * 5:
+        return True, "spa shell"
+    if NOSCRIPT_JS_PATTERN.search(html):
+        return True, "noscript javascript notice"
+    if scanner.script_count and scanner.text_chars < STATIC_PAGE_MIN_TEXT_CHARS:
+        return True, "little static text"
+    return False, "static html"
+
+
+def fetch_page_over_http(session: requests.Session, url: str, headers: dict = None, known_hash: str = None):
+    """Fetches a page without a browser. Returns (html, scanner, reason, response); html is None if the browser is needed.
+
+    Extra headers (e.g. conditional request validators) are sent as given; a 304 comes back with html and
+    scanner set to None so the caller can reuse what it stored. A successful body matching known_hash is
+    returned unscanned (scanner None), since its artifacts are already known.
+    """
+    try:
+        response = session.get(url, timeout=HTTP_FETCH_TIMEOUT, allow_redirects=True, headers=headers)
+    except requests.RequestException as e:
+        return None, None, f"http error: {e.__class__.__name__}", None
+    if response.status_code == 304:
+        return None, None, "not modified", response
+    if response.status_code < 400 and known_hash and known_hash == content_hash(response.text):
+        return response.text, None, "content unchanged", response
+    scanner = scan_static_page(response.text) if "html" in response.headers.get("Content-Type", "").lower() else StaticPageScanner()
+    needs_browser, reason = needs_js_rendering(url, response, scanner)
+    if needs_browser:
+        return None, scanner, reason, response
+    return response.text, scanner, reason, response
+
+
+def summarize_crawl_report(report: list) -> dict:
+    """Aggregates per-page fetch entries into path counts and total latency saved."""
+    return {
+        "pages": sum(1 for entry in report if entry["path"] != "skipped"),
+        "http_pages": sum(1 for entry in report if entry["path"] == "http"),
+        "browser_pages": sum(1 for entry in report if entry["path"] == "browser"),
+        "latency_saved_ms": round(sum(entry.get("saved_ms", 0) for entry in report), 1),
+    }
+
+
+# --- Incremental re-crawl (per-URL validators, content hashes and extracted artifacts) ---
+
+# Root for everything kept between runs: page records, learned login selectors, storage state, insights
+QA_CACHE_DIR = ".qa_cache"
+PAGE_RECORDS_DIR = os.path.join(QA_CACHE_DIR, "page_records")
+PAGE_SNIPPET_CHARS = 4000
+GONE_STATUS_CODES = (404, 410)
+CHANGE_KINDS = ("new", "changed", "unchanged", "removed")
+# Inspector recommendations kept per origin, keyed by the exact crawl summary and instruction they came from
+STORED_RECOMMENDATIONS_PER_ORIGIN = 8
+
+
+class PageRecordStore:
+    """Per-origin JSON store of what the last crawl saw at each URL.
+
+    A record holds the ETag/Last-Modified validators, a content hash and the artifacts extracted from
+    the page (snippet, links, skeleton, interactive elements), so an unchanged page needs no processing.
+    The inspector's recommendations are stored alongside, so an unchanged site needs no reduce call either.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, origin: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(origin.encode("utf-8")).hexdigest()[:16] + ".json")
+
+    def _read(self, origin: str) -> dict:
+        try:
+            with open(self._path(origin), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, origin: str, document: dict):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self._path(origin) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(document, f)
+            os.replace(tmp_path, self._path(origin))
+        except OSError as e:
+            ui_message(f"⚠️ Could not save page records: {e}", "warning")
+
+    def load(self, origin: str) -> dict:
+        with self._lock:
+            return self._read(origin).get("pages", {})
+
+    def save(self, origin: str, records: dict):
+        with self._lock:
+            document = self._read(origin)
+            document.update(origin=origin, pages=records)
+            self._write(origin, document)
+
+    def get_recommendations(self, origin: str, key: str):
+        with self._lock:
+            return self._read(origin).get("recommendations", {}).get(key)
+
+    def put_recommendations(self, origin: str, key: str, recommendations: str):
+        with self._lock:
+            document = self._read(origin)
+            stored = document.get("recommendations", {})
+            stored.pop(key, None)
+            stored[key] = recommendations
+            # Dicts keep insertion order, so the oldest entries are dropped first
+            document["recommendations"] = dict(list(stored.items())[-STORED_RECOMMENDATIONS_PER_ORIGIN:])
+            document.setdefault("origin", origin)
+            self._write(origin, document)
+
+
+@st.cache_resource
+def get_page_record_store():
+    return PageRecordStore(PAGE_RECORDS_DIR)
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8", "replace")).hexdigest()[:16]
+
+
+def conditional_headers(previous: dict) -> dict:
+    headers = {}
+    if previous and previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous and previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+    return headers
+
+
+def page_record(html: str, links: list, path: str, scanner: StaticPageScanner, response=None) -> dict:
+    """What the next crawl needs to recognize the page unchanged, plus the artifacts to reuse when it is.
+
+    For a browser-rendered page, response is the HTTP reply that was escalated. content_hash covers the
+    rendered DOM, which a plain HTTP fetch never reproduces, so the reply's validators and body hash
+    (source_hash) are what the next crawl compares. Redirected or failed replies are not kept: they say
+    nothing about the page itself.
+    """
+    usable = response is not None and (path == "http" or (response.status_code == 200 and not response.history))
+    headers = response.headers if usable else {}
+    record = {
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "content_hash": content_hash(html),
+        "path": path,
+        "snippet": html[:PAGE_SNIPPET_CHARS],
+        "links": links,
+        "skeleton": scanner.skeleton,
+        "elements": scanner.elements,
+        "fetched_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    if path == "browser" and usable:
+        record["source_hash"] = content_hash(response.text)
+    return record
+
+
+def known_hash(record: dict):
+    """Hash a plain HTTP body must match for the page to count as unchanged."""
+    return (record or {}).get("source_hash") or (record or {}).get("content_hash")
+
+
+def refreshed_record(record: dict, response) -> dict:
+    """An unchanged page's record with any fresh validators the server sent."""
+    refreshed = dict(record, fetched_at=datetime.now().isoformat(timespec="seconds"))
+    for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+        if response.headers.get(header):
+            refreshed[key] = response.headers[header]
+    return refreshed
+
+
+def page_gone(previous: dict, response) -> bool:
+    """Only a page an earlier crawl saw is removed by a 404/410; an unknown URL answering one is just broken."""
+    return bool(previous) and response is not None and response.status_code in GONE_STATUS_CODES
+
+
+def unreached_removed_urls(previous_records: dict, visited: set, frontier, sitemap_urls: list, crawl_finished: bool) -> list:
+    """Previously crawled URLs that this crawl proved are no longer linked or listed.
+
+    That takes a crawl that finished with its frontier drained; one cut short by max_pages or the fetch
+    budget proves nothing about the pages it didn't reach.
+    """
+    if not crawl_finished or any(url not in visited for url in frontier):
+        return []
+    discovered = set(visited) | set(sitemap_urls)
+    return [url for url in previous_records if url not in discovered]
+
+
+def scanner_from_record(record: dict) -> StaticPageScanner:
+    """Rebuilds the scan results of an unchanged page from its stored record."""
+    scanner = StaticPageScanner()
+    scanner.skeleton = list(record.get("skeleton", []))
+    scanner.elements = list(record.get("elements", []))
+    return scanner
+
+
+# --- Template clustering (group crawled pages that share one layout) ---
+
+# Pages whose skeleton SimHashes differ in at most this many bits are treated as one template
+TEMPLATE_SIMHASH_THRESHOLD = 3
+# Upper bound on fetches per crawl, since template duplicates don't count against max_pages
+TEMPLATE_FETCH_BUDGET_FACTOR = 3
+ID_SEGMENT_PATTERN = re.compile(r'^(?:\d+|[0-9a-f]{8,}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[\w-]*\d[\w-]*-[\w-]+|[\w-]+-\d+)$', re.IGNORECASE)
+
+
+def url_template(url: str) -> str:
+    """Collapses ID-like path segments, e.g. /item/42?tab=x -> /item/{id}?tab."""
+    parsed = urlparse(url)
+    segments = ["{id}" if ID_SEGMENT_PATTERN.match(segment) else segment for segment in parsed.path.split("/")]
+    query_keys = sorted({part.split("=", 1)[0] for part in parsed.query.split("&") if part})
+    return "/".join(segments) + ("?" + "&".join(query_keys) if query_keys else "")
+
+
+def simhash(tokens: list, bits: int = 64) -> int:
+    """SimHash over 3-token shingles of a page's tag/class skeleton."""
+    shingles = [" ".join(tokens[i:i + 3]) for i in range(max(len(tokens) - 2, 1))] if tokens else []
+    weights = [0] * bits
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.md5(shingle.encode("utf-8")).digest()[:bits // 8], "big")
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class TemplateClusterer:
+    """Assigns crawled pages to layout clusters; only each cluster's representative is analyzed."""
+    def __init__(self, threshold: int = TEMPLATE_SIMHASH_THRESHOLD):
+        self.threshold = threshold
+        self.clusters = []
+        self._by_url_template = {}
+
+    def cluster_for_url(self, url: str):
+        """Cluster already holding a page with this ID-style URL template, if any (no fetch needed)."""
+        template = url_template(url)
+        return self._by_url_template.get(template) if "{id}" in template else None
+
+    def assign(self, url: str, skeleton: list):
+        """Returns (cluster, is_new_template) for a fetched page."""
+        signature = simhash(skeleton)
+        for cluster in self.clusters:
+            if hamming_distance(signature, cluster["simhash"]) <= self.threshold:
+                self.add_member(cluster, url)
+                return cluster, False
+        cluster = {
+            "template": f"T{len(self.clusters) + 1}",
+            "representative": url,
+            "url_template": url_template(url),
+            "simhash": signature,
+            "members": [url],
+        }
+        self.clusters.append(cluster)
+        self._by_url_template.setdefault(cluster["url_template"], cluster)
+        return cluster, True
+
+    def add_member(self, cluster: dict, url: str):
+        cluster["members"].append(url)
+        self._by_url_template.setdefault(url_template(url), cluster)
+
+    def summary(self) -> list:
+        return [
+            {"template": c["template"], "url_template": c["url_template"], "representative": c["representative"], "pages": len(c["members"])}
+            for c in self.clusters
+        ]
+
+
+# --- Login detection (concurrent selector racing, learned selectors per origin) ---
+
+LEARNED_SELECTORS_PATH = os.path.join(QA_CACHE_DIR, "login_selectors.json")
+# Logged-in cookies/localStorage per origin, saved by the crawler and reused by generated test scripts
+STORAGE_STATE_DIR = os.path.join(QA_CACHE_DIR, "storage_state")
+LOGIN_FIELD_TIMEOUT_MS = 10000
+LOGIN_OUTCOME_TIMEOUT_MS = 30000
+
+# Candidate selectors for each login role. These can be expanded based on common patterns.
+SIGN_IN_SELECTORS = ["a[href*='login']", "button:has-text('Sign In')", "button:has-text('Log In')"]
+EMAIL_SELECTORS = [
+    "#userNameInput", "[data-testid='email']", "input[type='email']",
+    "input[name='email']", "input[id='email']", "xpath=//input[contains(@placeholder, 'Email')]"
+]
+PASSWORD_SELECTORS = [
+    "#passwordInput", "[data-testid='password']", "input[type='password']",
+    "input[name='password']", "input[id='password']", "xpath=//input[contains(@placeholder, 'Password')]"
+]
+SUBMIT_SELECTORS = [
+    "#submitButton", ".submit", "[role='button']:has-text('Sign in')",
+    "[data-testid='submit']", "button[type='submit']",
+    "button:has-text('Sign In')", "button:has-text('Log In')"
+]
+LOGIN_SUCCESS_SELECTORS = [".search-panel", "#searchPanel", "[role='search']"]
+LOGIN_ERROR_SELECTORS = ["text='Invalid credentials'", "text='Login failed'", "[role='alert']"]
+
+
+class LearnedSelectorStore:
+    """JSON-backed map of origin -> {role: selector} remembering which candidate won the last race."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+
+    def get(self, origin: str, role: str):
+        with self._lock:
+            return self._data.get(origin, {}).get(role)
+
+    def remember(self, origin: str, role: str, selector: str):
+        with self._lock:
+            if self._data.get(origin, {}).get(role) == selector:
+                return
+            self._data.setdefault(origin, {})[role] = selector
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._data, f, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass  # Learning is best-effort; the race still works without it
+
+
+@st.cache_resource
+def get_learned_selector_store():
+    return LearnedSelectorStore(LEARNED_SELECTORS_PATH)
+
+
+def storage_state_path(origin: str) -> str:
+    return os.path.join(STORAGE_STATE_DIR, hashlib.sha256(origin.encode("utf-8")).hexdigest()[:16] + ".json")
+
+
+async def race_selectors(page, selectors: list, timeout_ms: int = LOGIN_FIELD_TIMEOUT_MS, state: str = "visible"):
+    """Waits for all candidate selectors concurrently and returns the first one to match, or None.
+
+    Invalid or missing selectors simply lose the race. When several match in the same tick,
+    the earliest candidate in the list wins.
+    """
+    if not selectors:
+        return None
+    tasks = {
+        asyncio.ensure_future(page.wait_for_selector(selector, state=state, timeout=timeout_ms)): selector
+        for selector in selectors
+    }
+    pending = set(tasks)
+    winner = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            matched = [tasks[task] for task in done if not task.cancelled() and task.exception() is None]
+            if matched:
+                winner = min(matched, key=selectors.index)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return winner
+
+
+async def find_login_selector(page, origin: str, role: str, candidates: list, timeout_ms: int = LOGIN_FIELD_TIMEOUT_MS):
+    """Races the learned selector for this origin together with all candidates.
+
+    Returns (selector, source, elapsed_ms) where source is 'learned' or 'raced'; selector is None on a miss.
+    """
+    store = get_learned_selector_store()
+    learned = store.get(origin, role)
+    ordered = [learned] + [c for c in candidates if c != learned] if learned else list(candidates)
+    started = time.perf_counter()
+    winner = await race_selectors(page, ordered, timeout_ms)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if winner:
+        store.remember(origin, role, winner)
+    return winner, ("learned" if winner and winner == learned else "raced"), elapsed_ms
+
+
+def _is_auth_submission_response(response) -> bool:
+    request = response.request
+    return request.method in ("POST", "PUT") and request.resource_type in ("document", "xhr", "fetch")
+
+
+async def submit_and_wait_for_login(page, submit_selector: str, timeout_ms: int = LOGIN_OUTCOME_TIMEOUT_MS):
+    """Clicks submit and waits for the first post-login signal instead of sleeping.
+
+    Signals: a success marker, an error marker, a URL change, or a rejected (4xx/5xx) auth response.
+    Returns (outcome, detail) with outcome one of 'success', 'error', 'redirect', 'rejected', 'timeout'.
+    """
+    url_before = page.url
+    # Error markers that are already visible before submitting say nothing about this attempt
+    error_selectors = []
+    for selector in LOGIN_ERROR_SELECTORS:
+        try:
+            if not await page.is_visible(selector):
+                error_selectors.append(selector)
+        except Exception:
+            continue
+
+    waiters = {
+        asyncio.ensure_future(race_selectors(page, LOGIN_SUCCESS_SELECTORS, timeout_ms)): "success",
+        asyncio.ensure_future(race_selectors(page, error_selectors, timeout_ms)): "error",
+        asyncio.ensure_future(page.wait_for_url(lambda url: url != url_before, wait_until="commit", timeout=timeout_ms)): "redirect",
+        asyncio.ensure_future(page.wait_for_event("response", predicate=_is_auth_submission_response, timeout=timeout_ms)): "response",
+    }
+    pending = set(waiters)
+    try:
+        await page.click(submit_selector)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled() or task.exception() is not None:
+                    continue
+                kind, result = waiters[task], task.result()
+                if kind in ("success", "error") and result:
+                    detail = result
+                    if kind == "error":
+                        try:
+                            detail = await page.inner_text(result)
+                        except Exception:
+                            pass
+                    return kind, detail
+                if kind == "redirect":
+                    return "redirect", page.url
+                if kind == "response" and result.status >= 400:
+                    return "rejected", f"{result.request.method} {result.url} -> {result.status}"
+        return "timeout", page.url
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+# --- Site insights cache (per-origin page fingerprints -> inspector insights) ---
+
+SITE_INSIGHTS_DIR = os.path.join(QA_CACHE_DIR, "site_insights")
+INSPECTOR_PAGE_CONCURRENCY = 4
+INSPECTOR_MAX_INVENTORY_ITEMS = 60
+
+
+class SiteInsightsCache:
+    """Per-origin JSON store of page fingerprints and the inspector's per-page insights.
+
+    An entry is reused only while the page's interactive-element fingerprint is unchanged.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._origins = {}
+        self._lock = threading.Lock()
+
+    def _path(self, origin: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(origin.encode("utf-8")).hexdigest()[:16] + ".json")
+
+    def _pages(self, origin: str) -> dict:
+        if origin not in self._origins:
+            try:
+                with open(self._path(origin), "r", encoding="utf-8") as f:
+                    self._origins[origin] = json.load(f).get("pages", {})
+            except (OSError, ValueError):
+                self._origins[origin] = {}
+        return self._origins[origin]
+
+    def get(self, origin: str, url: str, fingerprint: str):
+        with self._lock:
+            entry = self._pages(origin).get(url)
+            if entry and entry.get("fingerprint") == fingerprint:
+                return dict(entry)
+            return None
+
+    def put(self, origin: str, url: str, fingerprint: str, insights: str, tokens: int, latency_ms: float):
+        with self._lock:
+            self._pages(origin)[url] = {
+                "fingerprint": fingerprint,
+                "insights": insights,
+                "tokens": tokens,
+                "latency_ms": round(latency_ms, 1),
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+            }
+
+    def save(self, origin: str):
+        with self._lock:
+            payload = {"origin": origin, "pages": self._pages(origin)}
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = self._path(origin) + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(payload, f, indent=2)
+                os.replace(tmp_path, self._path(origin))
+            except OSError as e:
+                ui_message(f"⚠️ Could not save site insights cache: {e}", "warning")
+
+
+@st.cache_resource
+def get_site_insights_cache():
+    return SiteInsightsCache(SITE_INSIGHTS_DIR)
+
+
+class InspectionReport:
+    """Side results of one inspect_site call: per-page crawl entries, template clusters and insights-cache statistics."""
+    def __init__(self):
+        self.pages = []
+        self.clusters = []
+        self.insights_cache = {}
+        self.changes = {}
+        self.had_previous_crawl = False
+        self.recommendations_reused = False
+
+    def to_dict(self) -> dict:
+        return {
+            "pages": [{k: v for k, v in entry.items() if k != "inventory"} for entry in self.pages],
+            "clusters": list(self.clusters),
+            "insights_cache": dict(self.insights_cache),
+            "changes": {kind: list(urls) for kind, urls in self.changes.items()},
+            "had_previous_crawl": self.had_previous_crawl,
+            "recommendations_reused": self.recommendations_reused,
+        }
+
 
 class SiteInspectorAgent(GroqOSSAgent):
     def __init__(self):
@@ -135,203 +1569,402 @@ class SiteInspectorAgent(GroqOSSAgent):
         - Use text-based selectors where applicable
         - Prioritize selectors based on reliability and stability
         """
-        super().__init__("SiteInspector", system_message, model_name=DEFAULT_GROQ_MODEL)
-
-    async def crawl_site(self, start_url: str, username: str, password: str, max_pages: int = 5) -> dict:
-        """Simple BFS crawler to fetch up to max_pages internal pages and their HTML snippets after logging in."""
-        from collections import deque
+        profile = AGENT_PROFILES["site_inspector"]
+        super().__init__(profile.name, system_message, model_name=DEFAULT_GROQ_MODEL,
+                         max_tokens=profile.max_tokens, temperature=profile.temperature, profile="site_inspector")
+
+    async def login(self, page, start_url: str, username: str, password: str):
+        """Logs in on the current page using raced, per-origin learned selectors and event-driven waits."""
+        origin = urlparse(start_url).scheme + "://" + urlparse(start_url).netloc
+
+        # Check if a "Sign In" button/link needs to be clicked
+        sign_in_button = await page.query_selector(", ".join(SIGN_IN_SELECTORS))
+        if sign_in_button:
+            ui_message("Clicking 'Sign In' button...")
+            await sign_in_button.click()
+            await page.wait_for_load_state("domcontentloaded", timeout=30000)
+
+        email_locator, source, elapsed_ms = await find_login_selector(page, origin, "email", EMAIL_SELECTORS)
+        if not email_locator:
+            html = await page.content()
+            ui_message(f"Error: No email input found. Page HTML:\n{html[:1000]}...", "error")
+            raise Exception("No email input found with provided selectors")
+
+        ui_message(f"Filling email with selector: {email_locator} ({source}, {elapsed_ms:.0f} ms)")
+        await page.fill(email_locator, username)
+
+        password_locator, source, elapsed_ms = await find_login_selector(page, origin, "password", PASSWORD_SELECTORS)
+        if not password_locator:
+            raise Exception("No password input found with provided selectors")
+
+        ui_message(f"Filling password with selector: {password_locator} ({source}, {elapsed_ms:.0f} ms)")
+        await page.fill(password_locator, password)
+
+        submit_locator, source, elapsed_ms = await find_login_selector(page, origin, "submit", SUBMIT_SELECTORS)
+        if not submit_locator:
+            raise Exception("No submit button found with provided selectors")
+
+        ui_message(f"Clicking submit with selector: {submit_locator} ({source}, {elapsed_ms:.0f} ms)")
+        outcome, detail = await submit_and_wait_for_login(page, submit_locator)
+
+        # Wait for post-login page
+        if outcome == "success":
+            ui_message(f"Logged in successfully at {start_url}")
+        elif outcome == "redirect":
+            ui_message(f"Redirected to {detail} after login")
+        elif outcome in ("error", "rejected"):
+            ui_message(f"Login failed with error: {detail}", "error")
+            raise Exception(f"Login failed: {detail}")
+        else:
+            html = await page.content()
+            ui_message(f"Error: No redirect after login. Current URL: {detail}\nPage HTML:\n{html[:1000]}...", "error")
+            raise Exception("No redirect after login attempt")
+
+    async def fetch_page(self, page, http_session, url: str, base_origin: str, previous: dict = None):
+        """Fetches one page over HTTP, escalating to the browser when needed.
+
+        Returns (html, links, path, reason, scanner, change, record) where path is 'http' or 'browser' and
+        change is one of CHANGE_KINDS relative to the previous crawl's record of the page. A 304 reply to the
+        conditional request, or an identical body hash, reuses the stored artifacts (including those of a page
+        that was rendered in the browser last time) instead of fetching and scanning it again.
+        Only a previously crawled page answering 404/410 is 'removed'; any other error status goes to the browser.
+        """
+        loop = asyncio.get_event_loop()
+        html, scanner, reason, response = await loop.run_in_executor(
+            None, fetch_page_over_http, http_session, url, conditional_headers(previous), known_hash(previous)
+        )
+        if previous and response is not None and (response.status_code == 304 or (html is not None and scanner is None)):
+            return (previous["snippet"], previous["links"], "http", reason, scanner_from_record(previous), "unchanged",
+                    refreshed_record(previous, response))
+        if page_gone(previous, response):
+            return None, [], "http", f"HTTP {response.status_code}", StaticPageScanner(), "removed", None
+        if html is not None:
+            links = extract_links(scanner.links, url, base_origin)
+            return html, links, "http", reason, scanner, "changed" if previous else "new", page_record(html, links, "http", scanner, response)
+        await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+        html = await page.content()
+        scanner = scan_static_page(html)
+        links = await page.evaluate('''
+            (base_origin) => {
+                return Array.from(document.querySelectorAll('a[href]'))
+                    .map(a => {
+                        let href = a.getAttribute('href');
+                        if (href) {
+                            try {
+                                let fullUrl = new URL(href, window.location.href).href;
+                                if (fullUrl.startsWith(base_origin)) {
+                                    return fullUrl;
+                                }
+                            } catch (e) {}
+                        }
+                        return null;
+                    })
+                    .filter(Boolean);
+            }
+        ''', base_origin)
+        change = "new" if not previous else "unchanged" if previous.get("content_hash") == content_hash(html) else "changed"
+        return html, links, "browser", reason, scanner, change, page_record(html, links, "browser", scanner, response)
+
+    async def crawl_site(self, start_url: str, username: str, password: str, max_pages: int = 5, report: "InspectionReport" = None) -> dict:
+        """BFS crawler to fetch up to max_pages distinct page templates and their HTML snippets after logging in.
+
+        The frontier is seeded from sitemap.xml. Pages are fetched over a pooled HTTP session carrying the
+        logged-in cookies and only escalated to the browser when they look like they need JS rendering.
+        Pages sharing a layout are clustered: only one representative per template is returned for analysis,
+        and duplicates don't use up max_pages, so the budget goes to unexplored templates.
+        Pages seen by an earlier crawl are fetched conditionally; unchanged ones reuse their stored artifacts,
+        and the new/changed/unchanged/removed pages are recorded as a change report.
+        If report is given, per-page entries (path, latency, template, change) and the cluster summary are recorded on it.
+        """
         visited = set()
         to_visit = deque([start_url])
         page_contents = {}
+        page_entries = []
+        clusterer = TemplateClusterer()
+        max_fetches = max_pages * TEMPLATE_FETCH_BUDGET_FACTOR
+        fetches = 0
         base_origin = urlparse(start_url).scheme + "://" + urlparse(start_url).netloc
+        loop = asyncio.get_event_loop()
+        http_session = None
+        browser_latencies = []
+        sitemap_urls = []
+        record_store = get_page_record_store()
+        previous_records = record_store.load(base_origin)
+        page_records = {}
+        changes = {kind: [] for kind in CHANGE_KINDS}
+        crawl_finished = False
 
         async with async_playwright() as p:
             browser = await p.chromium.launch(headless=True)
             context = await browser.new_context(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+                user_agent=CRAWLER_USER_AGENT,
                 viewport={"width": 1280, "height": 720}
             )
             page = await context.new_page()
             try:
                 # Navigate to login page
-                st.write(f"Navigating to {start_url}...")
+                ui_message(f"Navigating to {start_url}...")
+                nav_started = time.perf_counter()
                 await page.goto(start_url, wait_until="domcontentloaded", timeout=60000)
+                browser_latencies.append((time.perf_counter() - nav_started) * 1000)
 
-                # Check if a "Sign In" button/link needs to be clicked
-                sign_in_button = await page.query_selector("a[href*='login'], button:has-text('Sign In'), button:has-text('Log In')")
-                if sign_in_button:
-                    st.write("Clicking 'Sign In' button...")
-                    await sign_in_button.click()
-                    await page.wait_for_load_state("domcontentloaded", timeout=30000)
-
-                # Selectors for email, password, and submit button. These can be expanded based on common patterns.
-                email_selectors = [
-                    "#userNameInput", "data-testid='email'", "input[type='email']", 
-                    "input[name='email']", "input[id='email']", "//input[contains(@placeholder, 'Email')]"
-                ]
-                password_selectors = [
-                    "#passwordInput", "data-testid='password'", "input[type='password']", 
-                    "input[name='password']", "input[id='password']", "//input[contains(@placeholder, 'Password')]"
-                ]
-                submit_selectors = [
-                    "#submitButton", ".submit", "[role='button']:has-text('Sign in')", 
-                    "data-testid='submit'", "button[type='submit']", 
-                    "button:has-text('Sign In')", "button:has-text('Log In')"
-                ]
-
-                email_locator = None
-                for selector in email_selectors:
-                    try:
-                        await page.wait_for_selector(selector, state="visible", timeout=10000)
-                        email_locator = selector
-                        break
-                    except:
-                        continue
-
-                if not email_locator:
-                    html = await page.content()
-                    st.error(f"Error: No email input found. Page HTML:\n{html[:1000]}...")
-                    raise Exception("No email input found with provided selectors")
-
-                st.write(f"Filling email with selector: {email_locator}")
-                await page.fill(email_locator, username)
-                await page.wait_for_timeout(1000) 
-
-                password_locator = None
-                for selector in password_selectors:
-                    try:
-                        await page.wait_for_selector(selector, state="visible", timeout=10000)
-                        password_locator = selector
-                        break
-                    except:
-                        continue
-
-                if not password_locator:
-                    raise Exception("No password input found with provided selectors")
-
-                st.write(f"Filling password with selector: {password_locator}")
-                await page.fill(password_locator, password)
-                await page.wait_for_timeout(1000)
-
-                submit_locator = None
-                for selector in submit_selectors:
-                    try:
-                        await page.wait_for_selector(selector, state="visible", timeout=10000)
-                        submit_locator = selector
-                        break
-                    except:
-                        continue
-
-                if not submit_locator:
-                    raise Exception("No submit button found with provided selectors")
-
-                st.write(f"Clicking submit with selector: {submit_locator}")
-                await page.click(submit_locator)
-
-                # Wait for post-login page
+                with trace_span("login", url=start_url):
+                    await self.login(page, start_url, username, password)
                 try:
-                    await page.wait_for_selector(".search-panel, #searchPanel, [role='search']", state="visible", timeout=30000)
-                    st.write(f"Logged in successfully at {start_url}")
-                except:
-                    error_selector = "text='Invalid credentials', text='Login failed', [role='alert']"
-                    error_element = await page.query_selector(error_selector)
-                    if error_element:
-                        error_text = await error_element.inner_text()
-                        st.error(f"Login failed with error: {error_text}")
-                        raise Exception(f"Login failed: {error_text}")
-                    await page.wait_for_timeout(5000)
-                    current_url = page.url
-                    if current_url == start_url:
-                        html = await page.content()
-                        st.error(f"Error: No redirect after login. Current URL: {current_url}\nPage HTML:\n{html[:1000]}...")
-                        raise Exception("No redirect after login attempt")
-                    st.write(f"Redirected to {current_url} after login")
+                    os.makedirs(STORAGE_STATE_DIR, exist_ok=True)
+                    await context.storage_state(path=storage_state_path(base_origin))
+                except OSError:
+                    pass  # Only a shortcut for generated test scripts, which can log in themselves
+
+                # Hand the authenticated cookies to a pooled HTTP session and seed the frontier from the sitemap
+                http_session = build_http_session(await context.cookies())
+                sitemap_urls = await loop.run_in_executor(None, fetch_sitemap_urls, http_session, base_origin)
+                if sitemap_urls:
+                    ui_message(f"Seeded {len(sitemap_urls)} URLs from sitemap.xml")
+                for link in sitemap_urls:
+                    if link not in to_visit:
+                        to_visit.append(link)
 
                 # Start crawling after login
-                while to_visit and len(page_contents) < max_pages:
+                while to_visit and len(page_contents) < max_pages and fetches < max_fetches:
                     current = to_visit.popleft()
                     if current in visited:
                         continue
                     visited.add(current)
+                    known_cluster = clusterer.cluster_for_url(current)
+                    if known_cluster is not None:
+                        # Same ID-style URL as an analyzed page: count it in the cluster without fetching
+                        clusterer.add_member(known_cluster, current)
+                        page_entries.append({
+                            "url": current, "path": "skipped", "reason": f"url template {known_cluster['url_template']}",
+                            "latency_ms": 0.0, "template": known_cluster["template"], "cluster_role": "duplicate",
+                        })
+                        trace_count("crawl_pages_template_skipped")
+                        continue
                     try:
-                        st.write(f"Crawling page: {current}")
-                        await page.goto(current, wait_until="domcontentloaded", timeout=60000)
-                        html = await page.content()
-                        page_contents[current] = html[:4000] # Snippet
-                        
-                        new_links = await page.evaluate('''
-                            (base_origin) => {
-                                return Array.from(document.querySelectorAll('a[href]'))
-                                    .map(a => {
-                                        let href = a.getAttribute('href');
-                                        if (href) {
-                                            try {
-                                                let fullUrl = new URL(href, window.location.href).href;
-                                                if (fullUrl.startsWith(base_origin)) {
-                                                    return fullUrl;
-                                                }
-                                            } catch (e) {}
-                                        }
-                                        return null;
-                                    })
-                                    .filter(Boolean);
-                            }
-                        ''', base_origin)
+                        fetches += 1
+                        fetch_started = time.perf_counter()
+                        with trace_span("crawl_page", url=current) as page_span:
+                            html, new_links, path, reason, scanner, change, record = await self.fetch_page(
+                                page, http_session, current, base_origin, previous_records.get(current)
+                            )
+                            page_span.attrs.update(path=path, change=change)
+                        latency_ms = (time.perf_counter() - fetch_started) * 1000
+                        changes[change].append(current)
+                        trace_count(f"crawl_pages_{change}")
+                        if change == "removed":
+                            page_entries.append({
+                                "url": current, "path": "skipped", "reason": reason, "latency_ms": round(latency_ms, 1),
+                                "template": None, "cluster_role": None, "change": change,
+                            })
+                            continue
+                        page_records[current] = record
+                        if path == "browser":
+                            browser_latencies.append(latency_ms)
+                        cluster, new_template = clusterer.assign(current, scanner.skeleton)
+                        if new_template:
+                            ui_message(f"Crawled page via {path} ({reason}, {latency_ms:.0f} ms): {current}")
+                            page_contents[current] = html[:4000] # Snippet
+                        else:
+                            ui_message(f"Crawled page via {path} ({latency_ms:.0f} ms): {current} — same template as {cluster['representative']}, not analyzed")
+                            trace_count("crawl_pages_template_duplicates")
+                        page_entries.append({
+                            "url": current, "path": path, "reason": reason, "latency_ms": round(latency_ms, 1),
+                            "template": cluster["template"], "cluster_role": "representative" if new_template else "duplicate",
+                            "change": change, "fingerprint": inventory_fingerprint(scanner.elements), "inventory": scanner.elements,
+                        })
+                        trace_count(f"crawl_pages_{path}")
 
                         for link in new_links:
-                            parsed = urlparse(link)
                             if (link not in visited and
                                 link not in to_visit and
-                                not any(link.lower().endswith(ext) for ext in ('.pdf', '.jpg', '.png', '.gif', '.css', '.js', '.zip')) and
-                                parsed.path != '/' and parsed.path != ''):
+                                is_crawlable_link(link, base_origin)):
                                 to_visit.append(link)
                     except Exception as e:
-                        st.write(f"Error crawling {current}: {e}")
+                        ui_message(f"Error crawling {current}: {e}")
                         continue
+                crawl_finished = True
             except Exception as e:
-                st.error(f"Error during login or crawling: {e}")
+                ui_message(f"Error during login or crawling: {e}", "error")
                 if not page_contents:
                     try:
                         html = await page.content()
-                        st.write(f"Page HTML on failure:\n{html[:1000]}...")
+                        ui_message(f"Page HTML on failure:\n{html[:1000]}...")
                     except Exception as page_e:
-                        st.error(f"Could not even get page content on failure: {page_e}")
+                        ui_message(f"Could not even get page content on failure: {page_e}", "error")
             finally:
+                if http_session is not None:
+                    http_session.close()
                 await context.close()
                 await browser.close()
+
+        # Pages answering 404/410 are always retired. A page merely not reached is only retired when the crawl
+        # drained its whole frontier; a crawl cut short by max_pages or the fetch budget proves nothing about it.
+        if page_records:
+            unreached = unreached_removed_urls(previous_records, visited, to_visit, sitemap_urls, crawl_finished)
+            changes["removed"] += [url for url in unreached if url not in changes["removed"]]
+            kept = {url: record for url, record in previous_records.items() if url not in changes["removed"]}
+            kept.update(page_records)
+            record_store.save(base_origin, kept)
+            if previous_records:
+                ui_message(
+                    "Changes since the last crawl: " + ", ".join(f"{len(changes[kind])} {kind}" for kind in CHANGE_KINDS)
+                )
+
+        # Latency saved by the fast path is measured against the mean browser navigation of this crawl
+        browser_baseline_ms = sum(browser_latencies) / len(browser_latencies) if browser_latencies else 0.0
+        for entry in page_entries:
+            if entry["path"] == "http":
+                entry["saved_ms"] = round(max(browser_baseline_ms - entry["latency_ms"], 0.0), 1)
+            else:
+                entry["saved_ms"] = 0.0
+        if report is not None:
+            report.pages.extend(page_entries)
+            report.clusters.extend(clusterer.summary())
+            report.changes = {kind: list(urls) for kind, urls in changes.items()}
+            report.had_previous_crawl = bool(previous_records)
+        trace_count("crawl_templates", len(clusterer.clusters))
         return page_contents
 
-    async def inspect_site(self, url: str, key_elements: str, instruction: str, username: str, password: str) -> str:
+    async def summarize_page(self, url: str, snippet: str, inventory: list) -> LLMResult:
+        """Instruction-independent insights for one page, so they can be cached per page fingerprint."""
+        elements = "\n".join(f"- {element}" for element in inventory[:INSPECTOR_MAX_INVENTORY_ITEMS]) or "- (none found)"
+        return await self.complete(
+            stage="page_summary",
+            message=f"Summarize this single crawled page for later test planning: its purpose, structure, interactive elements, "
+            f"the user flows it supports, and reliable Playwright locators for its key elements.\n"
+            f"Page: {url}\nInteractive Elements:\n{elements}\nHTML Snippet:\n{snippet}"
+        )
+
+    async def analyze_pages(self, origin: str, page_contents: dict, report: "InspectionReport") -> list:
+        """Per-page insights, reusing cached ones for pages whose fingerprint is unchanged.
+
+        Returns a list of (url, insights) in crawl order and records reuse statistics on the report.
+        """
+        cache = get_site_insights_cache()
+        entries = {entry["url"]: entry for entry in report.pages}
+        semaphore = asyncio.Semaphore(INSPECTOR_PAGE_CONCURRENCY)
+
+        async def analyze(url: str, snippet: str):
+            entry = entries.get(url, {})
+            fingerprint = entry.get("fingerprint")
+            with trace_span("inspect_page", url=url) as span:
+                cached = cache.get(origin, url, fingerprint) if fingerprint else None
+                span.attrs["cache_hit"] = cached is not None
+                if cached is not None:
+                    trace_count("insights_cache_hits")
+                    return url, cached["insights"], cached
+                trace_count("insights_cache_misses")
+                try:
+                    async with semaphore:
+                        result = await self.summarize_page(url, snippet, entry.get("inventory", []))
+                except LLMUnavailable as e:
+                    # One page's summary isn't worth the whole inspection; the reduce step works with the rest
+                    ui_message(f"⚠️ Skipped insights for {url}: {e}", "warning")
+                    return url, "", None
+                if result.error is None and fingerprint:
+                    cache.put(origin, url, fingerprint, result.text, result.total_tokens, result.latency_ms)
+                return url, result.text, None
+
+        results = await asyncio.gather(*(analyze(url, snippet) for url, snippet in page_contents.items()))
+        cache.save(origin)
+
+        reused = [cached for _, _, cached in results if cached is not None]
+        stats = {
+            "pages": len(results),
+            "reused": len(reused),
+            "analyzed": len(results) - len(reused),
+            "reuse_ratio": round(len(reused) / len(results), 3) if results else 0.0,
+            "tokens_saved": sum(cached.get("tokens", 0) for cached in reused),
+            "latency_saved_ms": round(sum(cached.get("latency_ms", 0.0) for cached in reused), 1),
+        }
+        report.insights_cache = stats
+        trace_count("insights_tokens_saved", stats["tokens_saved"])
+        trace_count("insights_latency_saved_ms", stats["latency_saved_ms"])
+        if reused:
+            ui_message(
+                f"Reused cached insights for {stats['reused']}/{stats['pages']} pages "
+                f"(~{stats['tokens_saved']} tokens, ~{stats['latency_saved_ms'] / 1000:.1f}s of LLM time saved)"
+            )
+        return [(url, insights) for url, insights, _ in results]
+
+    async def inspect_site(self, url: str, key_elements: str, instruction: str, username: str, password: str, report: "InspectionReport" = None) -> str:
+        report = report if report is not None else InspectionReport()
         if url:
             if not username or not password:
-                st.warning("Username or password not provided in prompt. Crawling without login.")
+                ui_message("Username or password not provided in prompt. Crawling without login.", "warning")
                 # Implement a non-login crawl or return generic response
                 return await self.generate_response(
                     f"No login credentials provided. Generate reliable Playwright locators and insights for {key_elements} based on common web patterns and the instruction: {instruction}"
                 )
                 
-            page_contents = await self.crawl_site(url, username, password, max_pages=5)
+            with trace_span("crawl", url=url):
+                page_contents = await self.crawl_site(url, username, password, max_pages=5, report=report)
             if not page_contents:
-                st.warning("No pages crawled successfully. Generating generic insights.")
+                ui_message("No pages crawled successfully. Generating generic insights.", "warning")
                 return await self.generate_response(
                     f"No URL content crawled. Generate reliable Playwright locators and insights for {key_elements} based on common web patterns and the instruction: {instruction}"
                 )
-            content_str = "\n\n---\n\n".join([f"Page: {k}\nHTML Snippet:\n{v}" for k, v in page_contents.items()])
-            crawl_summary = await self.generate_response(
-                f"Start URL: {url}\nKey Elements to Focus: {key_elements}\nUser Instruction: {instruction}\nCrawled Pages Snippets:\n{content_str}"
-            )
-            recommendations = await self.generate_response(
-                f"Analyze the crawl summary for site insights and locators: {crawl_summary}\nUser Key Elements: {key_elements}\nUser Instruction: {instruction}"
-            )
+            origin = urlparse(url).scheme + "://" + urlparse(url).netloc
+            with trace_span("inspect_pages", pages=len(page_contents)):
+                page_insights = await self.analyze_pages(origin, page_contents, report)
+            crawl_summary = "\n\n---\n\n".join([f"Page: {page_url}\n{insights}" for page_url, insights in page_insights if insights])
+            reduce_prompt = f"Analyze the crawl summary for site insights and locators: {crawl_summary}\nUser Key Elements: {key_elements}\nUser Instruction: {instruction}"
+            # Unchanged pages reuse their cached insights, so an unchanged site reproduces this prompt exactly
+            record_store = get_page_record_store()
+            reduce_key = content_hash(reduce_prompt)
+            recommendations = record_store.get_recommendations(origin, reduce_key)
+            if recommendations is not None:
+                ui_message("♻️ No page insights changed since the last crawl; reusing the stored site recommendations")
+                trace_count("inspector_reduce_reused")
+                report.recommendations_reused = True
+                return recommendations
+            with trace_span("inspect_reduce"):
+                recommendations = (await self.complete(reduce_prompt, stage="inspector_reduce")).text
+            record_store.put_recommendations(origin, reduce_key, recommendations)
             return recommendations
         else:
-            st.warning("No URL provided. Generating generic insights.")
+            ui_message("No URL provided. Generating generic insights.", "warning")
             return await self.generate_response(
                 f"No URL provided. Generate reliable Playwright locators, self-healing strategies, and generic site insights (e.g., common flows for {key_elements}) based on common web patterns and the instruction: {instruction}"
             )
 
+# --- Structured planner output (JSON mode) ---
+
+PLANNER_OUTPUT_MODES = ("markdown", "json")
+PLANNER_OUTPUT_MODE = st.secrets.get("planner_output_mode", "markdown")
+
+TESTCASE_FIELDS = [
+    "Test Case ID", "High Level Feature", "Feature Name", "Test Scenario", "Test Case", "Test Case Description",
+    "Step-by-step actions", "Possible Values", "Sources", "Expected Result", "Data Correctness Checked",
+    "Release/Platform Version", "Automation Possibility", "Testing Type", "Priority", "Testing Phase",
+]
+# Record keys follow the markdown parser, which stores "Testing Type" as "Testing_Type"
+TESTCASE_RECORD_KEYS = {field: "Testing_Type" if field == "Testing Type" else field for field in TESTCASE_FIELDS}
+# Filled in locally when the model leaves them out; items missing a required field are re-requested instead
+TESTCASE_FIELD_DEFAULTS = {
+    "Possible Values": "None",
+    "Sources": "N/A",
+    "Data Correctness Checked": "N/A",
+    "Release/Platform Version": "N/A",
+    "Testing Phase": "QA",
+}
+TESTCASE_REQUIRED_FIELDS = ("Test Case", "Step-by-step actions", "Expected Result")
+
+PLANNER_JSON_OUTPUT_INSTRUCTIONS = f"""
+        JSON OUTPUT MODE (this replaces the markdown output format, section headers and numbered lists described above):
+        Respond with one JSON object of the form {{"test_cases": [ ... ]}} and nothing else.
+        Every element of "test_cases" is one test case object with exactly these string keys:
+        {json.dumps(TESTCASE_FIELDS)}
+        - "Test Case ID" is TC-<number>, numbered sequentially.
+        - "Step-by-step actions" is a single string with all steps in sequence, without numbering or bullets.
+        - Use "None" for "Possible Values" and "N/A" for "Sources", "Data Correctness Checked" and "Release/Platform Version" when not applicable.
+        - Do not use markdown inside the values.
+        """
+
+
 class PlannerAgentOSS(GroqOSSAgent):
-    def __init__(self):
+    def __init__(self, profile_name: str = "planner"):
         system_message = """
         You are an expert QA test planner with deep NLP understanding.
         Your goal is to generate comprehensive test cases covering all possible variations, including but not limited to:
@@ -427,7 +2060,12 @@ class PlannerAgentOSS(GroqOSSAgent):
         - Then expand to cover all other types of test cases as mentioned above.
         - Dont include the locator reccomendation itself in the description of testcases fields, but instead use the insights from crawled data. Dont mention any locators in testcases.
         """
-        super().__init__("PlannerOSS", system_message, model_name=DEFAULT_GROQ_MODEL)
+        if profile_name == "planner_json":
+            system_message += PLANNER_JSON_OUTPUT_INSTRUCTIONS
+        profile = AGENT_PROFILES[profile_name]
+        super().__init__(profile.name, system_message, model_name=DEFAULT_GROQ_MODEL,
+                         max_tokens=profile.max_tokens, temperature=profile.temperature, profile=profile_name,
+                         response_format=profile.response_format)
 
 class UserProxyAgent:
     def __init__(self, name: str):
@@ -439,117 +2077,994 @@ class UserProxyAgent:
 # --- 2. MODIFIED PARSING FUNCTION (Added st.success/warning) ---
 
 
-def parse_and_export_testcases(test_cases_str: str):
+def parse_and_export_testcases(test_cases_str: str, state=None):
     """
     Parses test cases from a string with variable formatting and exports them to an Excel file.
+    Parsed records are stored on `state` (defaults to st.session_state).
+    """
+    state = state if state is not None else st.session_state
+    with trace_span("parse", chars=len(test_cases_str)):
+        # Add re.MULTILINE and anchors (^) to only split on titles at the start of a line
+        test_matches = re.findall(r'(\d*)\.?\s*\*\*(.+?)\*\*\s*((?:.|\n)*?)(?=\n\s*\d*\.?\s*\*\*|\Z)', test_cases_str)
+        all_data = []
+        state.test_cases_list = []  # Reset test cases list
+
+        # Fallback regex if the primary one fails (e.g., no markdown bolding)
+        if not test_matches:
+            test_matches = re.findall(
+                r'(\d+)\.\s*(.+?)\n((?:.|\n)*?)(?=\n\s*\d+\.|\Z)',
+                test_cases_str
+            )
+
+        for num, High_Level_Feature, content in test_matches:
+            data = {
+                'Test Case ID': '',
+                'High Level Feature': High_Level_Feature.strip(),
+                'Feature Name': '',
+                'Test Scenario': '',
+                'Test Case': '',
+                'Test Case Description': '',
+                'Step-by-step actions': '',
+                'Possible Values': '',
+                'Sources': '',
+                'Expected Result': '',
+                'Data Correctness Checked': '',
+                'Release/Platform Version': '',
+                'Automation Possibility': '',
+                'Testing_Type': '',
+                'Priority': '',
+                'Testing Phase': ''
+            }
+
+            # Try to find the keys. Relaxed the regex to not require '-'
+            # field_patterns = {
+            #     'Test Case ID': r'(?:[-*]\s*)?Test\s*Case\s*ID\s*:\s*(.+?)(?=\n\s*[-*]|\Z)',
+            #     'Title': r'[o\*-]\s*(?:\*\*)?Title(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+            #     'Test Scenario': r'[o\*-]\s*(?:\*\*)?Test\s*Scenario(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',   
+            #     'Testing_Type': r'[o\*-]\s*(?:\*\*)?Testing\s*Type(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+            #     'Test Case': r'[o\*-]\s*(?:\*\*)?Test\s*Case(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+            #     'Step-by-step actions': r'[o\*-]\s*(?:\*\*)?Step-by-step\s*actions(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+            #     'Possible Values': r'[o\*-]\s*(?:\*\*)?Possible\s*Values(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+            #     'Expected Result': r'[o\*-]\s*(?:\*\*)?Expected\s*Result(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+            # }
+            field_patterns = {
+        'Test Case ID': r'(?:[-*]\s*)?Test\s*Case\s*ID\s*:\s*(.+?)(?=\n\s*[-*]|\Z)',
+        'High Level Feature': r'[o\*-]?\s*(?:\*\*)?High\s*Level\s*Feature(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Feature Name': r'[o\*-]?\s*(?:\*\*)?Feature\s*Name(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Test Scenario': r'[o\*-]\s*(?:\*\*)?Test\s*Scenario(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Test Case': r'[o\*-]\s*(?:\*\*)?Test\s*Case(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Test Case Description': r'[o\*-]?\s*(?:\*\*)?Test\s*Case\s*Description(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Step-by-step actions': r'[o\*-]\s*(?:\*\*)?Step-by-step\s*actions(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Possible Values': r'[o\*-]\s*(?:\*\*)?Possible\s*Values(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Sources': r'[o\*-]?\s*(?:\*\*)?Sources(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Expected Result': r'[o\*-]\s*(?:\*\*)?Expected\s*Result(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Data Correctness Checked': r'[o\*-]?\s*(?:\*\*)?Data\s*Correctness\s*Checked(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Release/Platform Version': r'[o\*-]?\s*(?:\*\*)?Release\/Platform\s*Version(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Automation Possibility': r'[o\*-]?\s*(?:\*\*)?Automation\s*Possibility(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Testing_Type': r'[o\*-]\s*(?:\*\*)?Testing\s*Type(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Priority': r'[o\*-]?\s*(?:\*\*)?Priority(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+        'Testing Phase': r'[o\*-]?\s*(?:\*\*)?Testing\s*Phase(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+
+    }
+
+
+            for key, pattern in field_patterns.items():
+                match = re.search(pattern, content, re.DOTALL | re.IGNORECASE)
+                if match:
+                    value = match.group(1).strip()
+                    value = re.sub(r'\*\*|_+|`+', '', value)  # Clean markdown
+                    if key == "Step-by-step actions":
+                        value = re.sub(r'\n\s*(\d+\.)\s*', r'\n\1 ', value)
+                        value = re.sub(r'^\s*(\d+\.)\s*', r'\1 ', value, flags=re.MULTILINE)
+                    else:
+                        value = re.sub(r'\s*\n\s*', ' ', value)
+                    data[key] = value.strip()
+
+            all_data.append(data)
+            state.test_cases_list.append(data)  # Store in session state
+
+    export_testcases(all_data)
+
+
+def build_testcases_workbook(all_data: list) -> bytes:
+    """Formatted .xlsx bytes for the given test case records."""
+    buffer = io.BytesIO()
+    pd.DataFrame(all_data).to_excel(buffer, index=False)
+    buffer.seek(0)
+
+    # Format Excel cells
+    wb = load_workbook(buffer)
+    ws = wb.active
+    for col in ws.columns:
+        max_length = 0
+        column = get_column_letter(col[0].column)
+        for cell in col:
+            cell.alignment = Alignment(wrap_text=True, vertical='top')
+            if cell.value:
+                lines = str(cell.value).split('\n')
+                max_length = max(max_length, *[len(line) for line in lines])
+
+        adjusted_width = (max_length + 2) * 1.2
+        ws.column_dimensions[column].width = min(adjusted_width, 70)
+
+    formatted = io.BytesIO()
+    wb.save(formatted)
+    return formatted.getvalue()
+
+
+def export_testcases(all_data: list):
+    """Writes parsed test case records to the formatted Excel file."""
+    with trace_span("export", cases=len(all_data)):
+        output_path = "cleaned_generated_test_cases.xlsx"
+        if all_data:
+            try:
+                with open(output_path, "wb") as f:
+                    f.write(build_testcases_workbook(all_data))
+                ui_message(f"✅ Test cases exported successfully to {output_path}", "success")
+            except Exception as e:
+                ui_message(f"Error saving or formatting Excel file: {e}", "error")
+        else:
+            ui_message("⚠️ No test cases were parsed — please check the LLM output format.", "warning")
+
+
+def _field_key(name) -> str:
+    return re.sub(r'[^a-z]', '', str(name).lower())
+
+
+# Tolerates casing/spacing/underscore drift in the keys the model returns
+TESTCASE_FIELD_LOOKUP = {_field_key(field): field for field in TESTCASE_FIELDS}
+# End of one array element: a closing brace followed by the next element or the end of the array
+JSON_ITEM_END = re.compile(r'\}\s*(?=,\s*\{|\s*\])')
+# Opening of the "test_cases" array, wherever the model put it and however it cased the key
+TESTCASES_ARRAY_START = re.compile(r'"test[\s_-]*cases"\s*:\s*\[', re.IGNORECASE)
+
+
+def scan_json_testcases(text: str):
+    """Decodes the planner's JSON reply into (items, broken_fragments).
+
+    The whole document is parsed in one go when it is valid. Otherwise the "test_cases" array is
+    decoded element by element, so a single broken or truncated item only loses itself. The scan starts
+    at the "test_cases" key (or at a reply that is a bare array), never at a bracket in some other value.
+    """
+    text = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', text.strip())
+    try:
+        document = json.loads(text)
+        if isinstance(document, dict):
+            document = next((value for key, value in document.items() if _field_key(key) == "testcases"), [document])
+        return (document if isinstance(document, list) else [document]), []
+    except ValueError:
+        pass
+
+    array_start = TESTCASES_ARRAY_START.search(text)
+    if array_start:
+        pos = array_start.end()
+    elif text.startswith("["):
+        pos = 1
+    else:
+        return [], []
+    decoder = json.JSONDecoder()
+    separator = re.compile(r'[\s,]*')
+    items, fragments = [], []
+    while True:
+        pos = separator.match(text, pos).end()
+        if pos >= len(text) or text[pos] == "]":
+            break
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+            items.append(item)
+        except ValueError:
+            end = JSON_ITEM_END.search(text, pos)
+            stop = end.end() if end else len(text)
+            fragments.append(text[pos:stop].strip())
+            pos = stop
+    return items, fragments
+
+
+def normalize_testcase(item, fallback_id: str):
+    """Maps one decoded item onto a test case record, filling optional fields locally.
+
+    Returns (record, None), or (None, problem) when the item needs to be re-requested.
+    """
+    if not isinstance(item, dict):
+        return None, "not a JSON object"
+    values = {}
+    for key, value in item.items():
+        field = TESTCASE_FIELD_LOOKUP.get(_field_key(key))
+        if field is None:
+            continue
+        if isinstance(value, list):
+            value = " ".join(str(part).strip() for part in value)
+        # Records are also rendered as one-line bullets, which the edit flow relies on
+        values[field] = re.sub(r'\s*\n\s*', ' ', "" if value is None else str(value)).strip()
+    missing = [field for field in TESTCASE_REQUIRED_FIELDS if not values.get(field)]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+    values.setdefault("Test Case ID", "")
+    values["Test Case ID"] = values["Test Case ID"] or fallback_id
+    return {TESTCASE_RECORD_KEYS[field]: values.get(field) or TESTCASE_FIELD_DEFAULTS.get(field, "") for field in TESTCASE_FIELDS}, None
+
+
+def next_testcase_number(records: list) -> int:
+    numbers = [int(m.group(1)) for r in records for m in [re.search(r'(\d+)', r.get("Test Case ID", ""))] if m]
+    return max(numbers, default=len(records)) + 1
+
+
+def validate_testcases(items: list, existing: list):
+    """Splits decoded items into valid records and (item, problem) pairs to re-request."""
+    records, broken = [], []
+    for item in items:
+        record, problem = normalize_testcase(item, f"TC-{next_testcase_number(existing + records)}")
+        if record is None:
+            broken.append((item, problem))
+        else:
+            records.append(record)
+    return records, broken
+
+
+async def plan_testcases_json(planner_input: str, existing: list = None, agent: GroqOSSAgent = None) -> list:
+    """Runs the planner (or another JSON-mode planning agent) and returns validated records.
+
+    Only malformed items are sent back to the same agent, in a single repair request.
     """
-    # Add re.MULTILINE and anchors (^) to only split on titles at the start of a line
-    test_matches = re.findall(r'(\d*)\.?\s*\*\*(.+?)\*\*\s*((?:.|\n)*?)(?=\n\s*\d*\.?\s*\*\*|\Z)', test_cases_str)
-    all_data = []
-    st.session_state.test_cases_list = []  # Reset test cases list
-
-    # Fallback regex if the primary one fails (e.g., no markdown bolding)
-    if not test_matches:
-        test_matches = re.findall(
-            r'(\d+)\.\s*(.+?)\n((?:.|\n)*?)(?=\n\s*\d+\.|\Z)',
-            test_cases_str
+    existing = existing or []
+    agent = agent or planner_json
+    with trace_span("plan", mode="json"):
+        reply = await user.initiate_chat(agent, planner_input)
+    with trace_span("parse_json", chars=len(reply)) as span:
+        items, fragments = scan_json_testcases(reply)
+        records, broken = validate_testcases(items, existing)
+        span.attrs.update(items=len(items), valid=len(records), broken=len(broken) + len(fragments))
+    if not broken and not fragments:
+        return records
+
+    with trace_span("repair_json", items=len(broken) + len(fragments)) as span:
+        ui_message(f"Re-requesting {len(broken) + len(fragments)} malformed test case(s)...")
+        malformed = [f"{json.dumps(item)}  <- {problem}" for item, problem in broken] + [f"{fragment}  <- invalid JSON" for fragment in fragments]
+        repair_prompt = (
+            "These test case objects from your previous answer are malformed or incomplete. "
+            "Return them corrected, in the same JSON format, and return nothing else. Keep their Test Case IDs.\n\n"
+            + "\n".join(malformed)
         )
+        reply = await user.initiate_chat(agent, repair_prompt)
+        repaired, still_broken = validate_testcases(scan_json_testcases(reply)[0], existing + records)
+        span.attrs.update(repaired=len(repaired), dropped=len(broken) + len(fragments) - len(repaired))
+    if len(repaired) < len(broken) + len(fragments):
+        ui_message(f"⚠️ Dropped {len(broken) + len(fragments) - len(repaired)} test case(s) that were still malformed after repair.", "warning")
+    return records + repaired
+
+
+def render_testcases_markdown(records: list, first_number: int = 1) -> str:
+    """Renders records in the planner's markdown layout, so display, feedback and edits work unchanged."""
+    blocks = []
+    for offset, record in enumerate(records):
+        title = record.get("High Level Feature") or record.get("Feature Name") or "Test Case"
+        lines = [f"{first_number + offset}. **{title}**"]
+        lines += [f"* {field}: {record[TESTCASE_RECORD_KEYS[field]]}" for field in TESTCASE_FIELDS]
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def update_testcase_record(records: list, test_case_id: str, field: str, value: str) -> bool:
+    """Applies an edit directly to the stored record; returns False when the case or field is unknown."""
+    key = TESTCASE_RECORD_KEYS.get(field)
+    for record in records or []:
+        if key and record.get("Test Case ID", "").strip() == test_case_id.strip():
+            record[key] = value
+            return True
+    return False
+
+
+# --- Test automation (Playwright script generation and parallel execution) ---
+
+GENERATED_TESTS_DIR = "generated_tests"
+AUTOMATION_WORKERS = int(st.secrets.get("automation_workers", 4))
+AUTOMATION_TEST_TIMEOUT_SECONDS = float(st.secrets.get("automation_test_timeout_s", 90))
+AUTOMATION_RETRIES = int(st.secrets.get("automation_retries", 1))
+AUTOMATION_ACTION_TIMEOUT_MS = 10000
+SCRIPT_WRITER_CONCURRENCY = 4
+SCRIPT_LOCATOR_CONTEXT_CHARS = 3000
+# Bump when the script template changes, so cached scripts are regenerated
+SCRIPT_TEMPLATE_VERSION = "1"
+# Test cases about authentication itself start from a logged-out browser
+FRESH_SESSION_PATTERN = re.compile(r'\b(log\s*-?\s*in|sign\s*-?\s*in|auth\w*|password|credentials?)\b', re.IGNORECASE)
+AUTOMATION_RESULT_KEYS = ("Automation Status", "Automation Attempts", "Automation Duration (s)", "Automation Error")
+# What a generated run_test may reference besides its parameters and its own locals
+SCRIPT_ALLOWED_GLOBALS = ("expect",)
+SCRIPT_ALLOWED_BUILTINS = (
+    "len", "range", "str", "int", "float", "bool", "list", "dict", "tuple", "set", "enumerate", "zip", "min", "max",
+    "sum", "any", "all", "sorted", "reversed", "abs", "round", "isinstance", "print",
+    "Exception", "AssertionError", "ValueError", "TypeError", "KeyError", "IndexError", "TimeoutError",
+)
+# Playwright API that leads from the page to the browser process, the local file system or arbitrary HTTP,
+# plus str.format, whose replacement fields reach attributes the AST never shows
+SCRIPT_BLOCKED_ATTRIBUTES = (
+    "context", "browser", "browser_type", "launch", "launch_persistent_context", "launch_server", "connect",
+    "connect_over_cdp", "executable_path", "request", "route_from_har", "set_input_files", "storage_state",
+    "save_as", "path", "tracing", "expose_binding", "expose_function", "format", "format_map",
+)
+# Keyword arguments that name a local path to read or write (screenshot(path=...), add_script_tag(path=...), ...)
+SCRIPT_BLOCKED_KEYWORDS = (
+    "path", "executable_path", "files", "har", "record_har_path", "record_video_dir", "downloads_path", "user_data_dir",
+    "traces_dir",
+)
+# A worker is killed when a test takes this much longer than its attempts allow; startup covers the browser launch
+AUTOMATION_WORKER_GRACE_SECONDS = 30
+AUTOMATION_WORKER_STARTUP_SECONDS = 60
+# The only environment test workers inherit; HOME and the temp dirs point into the worker's sandbox directory,
+# and the test account's credentials are added as QA_USERNAME/QA_PASSWORD
+AUTOMATION_WORKER_ENV_KEYS = ("PATH", "LANG", "SYSTEMROOT")
+# Unprivileged account the workers run as (POSIX, when the app runs as root). The Python environment and
+# Playwright's browsers (PLAYWRIGHT_BROWSERS_PATH) must then be installed where that account can read them.
+AUTOMATION_WORKER_USER = st.secrets.get("automation_worker_user")
+AUTOMATION_RESULT_PREFIX = "QA_RESULT "
+
+SCRIPT_TEMPLATE = '''"""{test_case_id}: {title}
+
+Generated by the QA Test Case Generator. Run standalone with `python {file_name}`.
+"""
+# source-hash: {source_hash}
+import asyncio
+import os
 
-    for num, High_Level_Feature, content in test_matches:
-        data = {
-            'Test Case ID': '',
-            'High Level Feature': High_Level_Feature.strip(),
-            'Feature Name': '',
-            'Test Scenario': '',
-            'Test Case': '',
-            'Test Case Description': '',
-            'Step-by-step actions': '',
-            'Possible Values': '',
-            'Sources': '',
-            'Expected Result': '',
-            'Data Correctness Checked': '',
-            'Release/Platform Version': '',
-            'Automation Possibility': '',
-            'Testing_Type': '',
-            'Priority': '',
-            'Testing Phase': ''
-        }
+from playwright.async_api import async_playwright, expect
 
-        # Try to find the keys. Relaxed the regex to not require '-'
-        # field_patterns = {
-        #     'Test Case ID': r'(?:[-*]\s*)?Test\s*Case\s*ID\s*:\s*(.+?)(?=\n\s*[-*]|\Z)',
-        #     'Title': r'[o\*-]\s*(?:\*\*)?Title(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-        #     'Test Scenario': r'[o\*-]\s*(?:\*\*)?Test\s*Scenario(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',   
-        #     'Testing_Type': r'[o\*-]\s*(?:\*\*)?Testing\s*Type(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-        #     'Test Case': r'[o\*-]\s*(?:\*\*)?Test\s*Case(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-        #     'Step-by-step actions': r'[o\*-]\s*(?:\*\*)?Step-by-step\s*actions(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-        #     'Possible Values': r'[o\*-]\s*(?:\*\*)?Possible\s*Values(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-        #     'Expected Result': r'[o\*-]\s*(?:\*\*)?Expected\s*Result(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-        # }
-        field_patterns = {
-    'Test Case ID': r'(?:[-*]\s*)?Test\s*Case\s*ID\s*:\s*(.+?)(?=\n\s*[-*]|\Z)',
-    'High Level Feature': r'[o\*-]?\s*(?:\*\*)?High\s*Level\s*Feature(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Feature Name': r'[o\*-]?\s*(?:\*\*)?Feature\s*Name(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Test Scenario': r'[o\*-]\s*(?:\*\*)?Test\s*Scenario(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Test Case': r'[o\*-]\s*(?:\*\*)?Test\s*Case(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Test Case Description': r'[o\*-]?\s*(?:\*\*)?Test\s*Case\s*Description(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Step-by-step actions': r'[o\*-]\s*(?:\*\*)?Step-by-step\s*actions(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Possible Values': r'[o\*-]\s*(?:\*\*)?Possible\s*Values(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Sources': r'[o\*-]?\s*(?:\*\*)?Sources(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Expected Result': r'[o\*-]\s*(?:\*\*)?Expected\s*Result(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Data Correctness Checked': r'[o\*-]?\s*(?:\*\*)?Data\s*Correctness\s*Checked(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Release/Platform Version': r'[o\*-]?\s*(?:\*\*)?Release\/Platform\s*Version(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Automation Possibility': r'[o\*-]?\s*(?:\*\*)?Automation\s*Possibility(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Testing_Type': r'[o\*-]\s*(?:\*\*)?Testing\s*Type(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Priority': r'[o\*-]?\s*(?:\*\*)?Priority(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
-    'Testing Phase': r'[o\*-]?\s*(?:\*\*)?Testing\s*Phase(?:\*\*)?\s*:\s*(.+?)(?=\n\s*[o\*-]|\Z)',
+BASE_URL = {base_url!r}
+STORAGE_STATE = {storage_state!r}
+FRESH_SESSION = {fresh_session!r}
+CREDENTIALS = {{"username": os.environ.get("QA_USERNAME", ""), "password": os.environ.get("QA_PASSWORD", "")}}
 
-}
 
+{body}
 
-        for key, pattern in field_patterns.items():
-            match = re.search(pattern, content, re.DOTALL | re.IGNORECASE)
-            if match:
-                value = match.group(1).strip()
-                value = re.sub(r'\*\*|_+|`+', '', value)  # Clean markdown
-                if key == "Step-by-step actions":
-                    value = re.sub(r'\n\s*(\d+\.)\s*', r'\n\1 ', value)
-                    value = re.sub(r'^\s*(\d+\.)\s*', r'\1 ', value, flags=re.MULTILINE)
-                else:
-                    value = re.sub(r'\s*\n\s*', ' ', value)
-                data[key] = value.strip()
-
-        all_data.append(data)
-        st.session_state.test_cases_list.append(data)  # Store in session state
-
-    output_path = "cleaned_generated_test_cases.xlsx"
-    if all_data:
-        df = pd.DataFrame(all_data)
-        
+
+async def main():
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        use_state = STORAGE_STATE and not FRESH_SESSION and os.path.exists(STORAGE_STATE)
+        context = await browser.new_context(storage_state=STORAGE_STATE if use_state else None)
         try:
-            df.to_excel(output_path, index=False)
-
-            # Format Excel cells
-            wb = load_workbook(output_path)
-            ws = wb.active
-            for col in ws.columns:
-                max_length = 0
-                column = get_column_letter(col[0].column)
-                for cell in col:
-                    cell.alignment = Alignment(wrap_text=True, vertical='top')
-                    if cell.value:
-                        lines = str(cell.value).split('\n')
-                        max_length = max(max_length, *[len(line) for line in lines])
-                
-                adjusted_width = (max_length + 2) * 1.2
-                ws.column_dimensions[column].width = min(adjusted_width, 70)
+            await run_test(await context.new_page(), BASE_URL, CREDENTIALS)
+            print("PASSED")
+        finally:
+            await browser.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+'''
+
+# Runs one shard of validated run_test functions in its own process and browser. Reads the job as JSON on
+# stdin and writes one prefixed JSON result line per test; anything the tests print goes to stderr.
+AUTOMATION_WORKER_SOURCE = r'''
+import asyncio
+import builtins
+import json
+import os
+import sys
+import time
+
+from playwright.async_api import async_playwright, expect
+
 
-            wb.save(output_path)
-            st.success(f"✅ Test cases exported successfully to {output_path}")
+def load_run_test(code, allowed_builtins):
+    namespace = {"__builtins__": {name: getattr(builtins, name) for name in allowed_builtins}, "expect": expect}
+    exec(compile(code, "<run_test>", "exec"), namespace)
+    return namespace["run_test"]
+
+
+async def run_one(browser, job, test, credentials):
+    result = {"test_case_id": test["test_case_id"], "status": "error", "attempts": 0, "duration_s": 0.0, "error": ""}
+    try:
+        run_test = load_run_test(test["code"], job["builtins"])
+    except Exception as e:
+        result["error"] = f"Script failed to load: {e.__class__.__name__}: {e}"
+        return result
+    for attempt in range(1, job["retries"] + 2):
+        result["attempts"] = attempt
+        context = await browser.new_context(
+            storage_state=None if test["fresh_session"] else job["storage_state"],
+            viewport={"width": 1280, "height": 720}
+        )
+        context.set_default_timeout(job["action_timeout_ms"])
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(run_test(await context.new_page(), job["base_url"], dict(credentials)), job["timeout_s"])
+            result["status"] = "passed" if attempt == 1 else "flaky"
+            result["error"] = ""
+        except asyncio.TimeoutError:
+            result["status"] = "failed"
+            result["error"] = f"Timed out after {job['timeout_s']:g}s"
         except Exception as e:
-            st.error(f"Error saving or formatting Excel file: {e}")
-    else:
-        st.warning("⚠️ No test cases were parsed — please check the LLM output format.")
+            result["status"] = "failed"
+            result["error"] = f"{e.__class__.__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+        finally:
+            result["duration_s"] = round(time.perf_counter() - started, 2)
+            await context.close()
+        if result["status"] != "failed":
+            break
+    return result
+
+
+async def main():
+    job = json.loads(sys.stdin.read())
+    results = sys.stdout
+    sys.stdout = sys.stderr
+    credentials = {"username": os.environ.get("QA_USERNAME", ""), "password": os.environ.get("QA_PASSWORD", "")}
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            for test in job["tests"]:
+                result = await run_one(browser, job, test, credentials)
+                results.write(job["result_prefix"] + json.dumps(result) + "\n")
+                results.flush()
+        finally:
+            await browser.close()
+
+
+asyncio.run(main())
+'''
+
+
+def is_automatable(record: dict) -> bool:
+    return record.get("Automation Possibility", "").strip().lower().startswith("yes")
+
+
+def needs_fresh_session(record: dict) -> bool:
+    return bool(FRESH_SESSION_PATTERN.search(" ".join(
+        record.get(key, "") for key in ("High Level Feature", "Feature Name", "Test Scenario")
+    )))
+
+
+def script_source_hash(record: dict, locator_context: str) -> str:
+    content = {key: value for key, value in record.items() if key not in AUTOMATION_RESULT_KEYS}
+    payload = json.dumps([SCRIPT_TEMPLATE_VERSION, content, locator_context], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def script_path(test_case_id: str) -> str:
+    slug = re.sub(r'[^a-z0-9]+', '_', test_case_id.lower()).strip("_") or "case"
+    return os.path.join(GENERATED_TESTS_DIR, f"test_{slug}.py")
+
+
+def cached_script(path: str, source_hash: str):
+    """The existing script at path if it was generated from the same test case and locators."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            source = f.read()
+    except OSError:
+        return None
+    return source if f"# source-hash: {source_hash}\n" in source else None
+
+
+def validate_run_test(code: str):
+    """Rejects generated code that is more than a run_test driving its page. Raises ValueError.
+
+    The code must be the run_test function alone: no imports, global/nonlocal, classes, underscore
+    attributes, **kwargs unpacking, Playwright API from SCRIPT_BLOCKED_ATTRIBUTES or file path keywords,
+    and no names besides its parameters, its own locals, `expect` and a few plain builtins. This is a
+    filter for model mistakes; isolation comes from the worker sandbox the script runs in.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        raise ValueError(f"script is not valid Python: {e.msg} (line {e.lineno})")
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.AsyncFunctionDef) or tree.body[0].name != "run_test":
+        raise ValueError("script must consist of async def run_test(page, base_url, credentials) only")
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            raise ValueError(f"imports are not allowed (line {node.lineno})")
+        if isinstance(node, (ast.Global, ast.Nonlocal, ast.ClassDef)):
+            raise ValueError(f"{node.__class__.__name__.lower()} statements are not allowed (line {node.lineno})")
+        if isinstance(node, ast.Attribute) and (node.attr.startswith("_") or node.attr in SCRIPT_BLOCKED_ATTRIBUTES):
+            raise ValueError(f"attribute '{node.attr}' is not allowed (line {node.lineno})")
+        if isinstance(node, ast.keyword) and (node.arg is None or node.arg in SCRIPT_BLOCKED_KEYWORDS):
+            raise ValueError(f"keyword argument '{node.arg or '**'}' is not allowed (line {node.value.lineno})")
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+    allowed = bound | set(SCRIPT_ALLOWED_GLOBALS) | set(SCRIPT_ALLOWED_BUILTINS)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in allowed:
+            raise ValueError(f"name '{node.id}' is not allowed (line {node.lineno})")
+
+
+def extract_run_test(reply: str) -> str:
+    """Pulls the run_test function out of the model's reply and validates it."""
+    code = re.sub(r'^\s*```(?:python)?\s*|\s*```\s*$', '', reply.strip())
+    start = code.find("async def run_test")
+    if start == -1:
+        raise ValueError("reply does not define async def run_test(page, base_url, credentials)")
+    code = code[start:]
+    validate_run_test(code)
+    return code
+
+
+def run_test_source(source: str) -> str:
+    """The validated run_test function of a generated script file; only this code is ever executed."""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        raise ValueError(f"script is not valid Python: {e.msg} (line {e.lineno})")
+    node = next((node for node in tree.body if isinstance(node, ast.AsyncFunctionDef) and node.name == "run_test"), None)
+    if node is None:
+        raise ValueError("script does not define async def run_test(page, base_url, credentials)")
+    code = ast.get_source_segment(source, node)
+    validate_run_test(code)
+    return code
+
+
+def automation_context(state, origin: str) -> str:
+    """Locators the scripts should prefer: learned login selectors plus the inspector's recommendations."""
+    store = get_learned_selector_store()
+    learned = {role: store.get(origin, role) for role in ("email", "password", "submit")}
+    lines = [f"- login {role} field: {selector}" for role, selector in learned.items() if selector]
+    recommendations = (state.locator_recommendations or "")[:SCRIPT_LOCATOR_CONTEXT_CHARS]
+    return "Learned login locators:\n" + ("\n".join(lines) or "- (none)") + "\n\nSite insights and recommended locators:\n" + recommendations
+
+
+async def write_test_script(record: dict, base_url: str, storage_state: str, locator_context: str) -> dict:
+    """Returns {"path", "source", "code", "cached"} for one test case, generating the script only when needed.
+
+    code is the validated run_test function; a cached script that no longer validates is regenerated.
+    """
+    test_case_id = record.get("Test Case ID") or "TC-?"
+    path = script_path(test_case_id)
+    source_hash = script_source_hash(record, locator_context)
+    source = cached_script(path, source_hash)
+    if source is not None:
+        try:
+            code = run_test_source(source)
+            trace_count("scripts_cached")
+            return {"path": path, "source": source, "code": code, "cached": True}
+        except ValueError as e:
+            ui_message(f"Regenerating {os.path.basename(path)}: {e}", "warning")
+
+    fresh_session = needs_fresh_session(record)
+    steps = "\n".join(f"{field}: {record.get(TESTCASE_RECORD_KEYS[field], '')}" for field in TESTCASE_FIELDS)
+    prompt = (
+        f"Base URL: {base_url}\n"
+        f"Session: {'the browser starts logged out; use credentials to log in if the test needs it' if fresh_session else 'the browser is already logged in'}\n\n"
+        f"{locator_context}\n\nTest case:\n{steps}"
+    )
+    body = extract_run_test(await user.initiate_chat(get_profile_agent("script_writer"), prompt))
+    source = SCRIPT_TEMPLATE.format(
+        test_case_id=test_case_id,
+        title=record.get("Test Case", "").replace('"""', "'''"),
+        file_name=os.path.basename(path),
+        source_hash=source_hash,
+        base_url=base_url,
+        storage_state=storage_state,
+        fresh_session=fresh_session,
+        body=body,
+    )
+    os.makedirs(GENERATED_TESTS_DIR, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(source)
+    trace_count("scripts_generated")
+    return {"path": path, "source": source, "code": body, "cached": False}
+
+
+def shard_scripts(scripts: list, workers: int) -> list:
+    """Longest-first assignment by last known duration, so shards finish at about the same time."""
+    shards = [[] for _ in range(max(1, min(workers, len(scripts))))]
+    loads = [0.0] * len(shards)
+    ordered = sorted(scripts, key=lambda item: -float(item["record"].get("Automation Duration (s)") or AUTOMATION_TEST_TIMEOUT_SECONDS / 3))
+    for item in ordered:
+        index = loads.index(min(loads))
+        shards[index].append(item)
+        loads[index] += float(item["record"].get("Automation Duration (s)") or AUTOMATION_TEST_TIMEOUT_SECONDS / 3)
+    return shards
+
+
+async def ensure_storage_state(base_url: str, credentials: dict) -> str:
+    """Path of a logged-in storage state for the site, logging in once if the crawl didn't leave one."""
+    path = storage_state_path(urlparse(base_url).scheme + "://" + urlparse(base_url).netloc)
+    if os.path.exists(path) or not credentials.get("username") or not credentials.get("password"):
+        return path if os.path.exists(path) else None
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        context = await browser.new_context(user_agent=CRAWLER_USER_AGENT)
+        try:
+            page = await context.new_page()
+            await page.goto(base_url, wait_until="domcontentloaded", timeout=60000)
+            with trace_span("login", url=base_url):
+                await inspector.login(page, base_url, credentials["username"], credentials["password"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            await context.storage_state(path=path)
+            return path
+        except Exception as e:
+            ui_message(f"Could not log in for the test run ({e}); tests will start logged out.", "warning")
+            return None
+        finally:
+            await context.close()
+            await browser.close()
+
+
+def playwright_browsers_path() -> str:
+    """Where the app's Playwright browsers are installed, so a worker with a sandboxed HOME still finds them."""
+    if os.environ.get("PLAYWRIGHT_BROWSERS_PATH"):
+        return os.environ["PLAYWRIGHT_BROWSERS_PATH"]
+    if sys.platform == "win32":
+        return os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "ms-playwright")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/ms-playwright")
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ms-playwright")
+
+
+def worker_env(credentials: dict, sandbox: str) -> dict:
+    """Minimal environment for a test worker, so generated code can't read the server's variables."""
+    env = {key: os.environ[key] for key in AUTOMATION_WORKER_ENV_KEYS if key in os.environ}
+    env.update(HOME=sandbox, USERPROFILE=sandbox, TMPDIR=sandbox, TEMP=sandbox, TMP=sandbox,
+               PLAYWRIGHT_BROWSERS_PATH=playwright_browsers_path())
+    env.update(QA_USERNAME=credentials.get("username", ""), QA_PASSWORD=credentials.get("password", ""))
+    return env
+
+
+def worker_identity() -> dict:
+    """Subprocess options that run a worker as AUTOMATION_WORKER_USER, if one is configured."""
+    if not AUTOMATION_WORKER_USER:
+        return {}
+    if pwd is None:
+        raise RuntimeError("automation_worker_user is only supported on POSIX systems")
+    account = pwd.getpwnam(AUTOMATION_WORKER_USER)
+    return {"user": account.pw_uid, "group": account.pw_gid, "extra_groups": []}
+
+
+@contextlib.contextmanager
+def worker_sandbox(storage_state: str):
+    """A throwaway working directory for one worker process, away from the app's secrets and caches.
+
+    Yields (directory, storage_state), where storage_state is the worker's own copy of the logged-in state.
+    Both belong to AUTOMATION_WORKER_USER when one is configured. The directory is removed afterwards.
+    """
+    directory = tempfile.mkdtemp(prefix="qa-worker-")
+    try:
+        copied = shutil.copy(storage_state, os.path.join(directory, "storage_state.json")) if storage_state else None
+        if AUTOMATION_WORKER_USER:
+            for path in filter(None, (directory, copied)):
+                shutil.chown(path, user=AUTOMATION_WORKER_USER)
+        yield directory, copied
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+async def run_shard_in_worker(index: int, shard: list, base_url: str, credentials: dict, storage_state: str) -> list:
+    """Runs a shard's tests in a worker subprocess with its own browser; every test gets a fresh context.
+
+    Each worker starts in a throwaway sandbox directory (see worker_sandbox) with a minimal environment,
+    as AUTOMATION_WORKER_USER when one is configured. It still gets the test account's credentials, which
+    the tests log in with.
+
+    A hard deadline per test is enforced from here, since a script blocking the worker's event loop
+    (time.sleep, a busy loop) can't be interrupted there: the worker is killed, the test counts as an
+    error and the rest of the shard continues in a new worker.
+    """
+    test_deadline = AUTOMATION_TEST_TIMEOUT_SECONDS * (AUTOMATION_RETRIES + 1) + AUTOMATION_WORKER_GRACE_SECONDS
+    pending = list(shard)
+    results = []
+    os.makedirs(GENERATED_TESTS_DIR, exist_ok=True)
+    log_path = os.path.join(GENERATED_TESTS_DIR, f"worker-{index}.log")
+
+    def finish(result: dict):
+        pending.pop(0)
+        results.append(result)
+        trace_count(f"tests_{result['status']}")
+        ui_message(f"{result['test_case_id']}: {result['status']} ({result['duration_s']}s)")
+
+    def worker_error(item: dict, error: str) -> dict:
+        return {"test_case_id": item["record"].get("Test Case ID", ""), "status": "error", "attempts": 1, "duration_s": 0.0, "error": error}
+
+    with trace_span("test_shard", shard=index, tests=len(shard)):
+        while pending:
+            with worker_sandbox(storage_state) as (sandbox, sandbox_storage_state):
+                job = {
+                    "base_url": base_url,
+                    "storage_state": sandbox_storage_state,
+                    "timeout_s": AUTOMATION_TEST_TIMEOUT_SECONDS,
+                    "retries": AUTOMATION_RETRIES,
+                    "action_timeout_ms": AUTOMATION_ACTION_TIMEOUT_MS,
+                    "builtins": list(SCRIPT_ALLOWED_BUILTINS),
+                    "result_prefix": AUTOMATION_RESULT_PREFIX,
+                    "tests": [
+                        {"test_case_id": item["record"].get("Test Case ID", ""), "code": item["code"], "fresh_session": needs_fresh_session(item["record"])}
+                        for item in pending
+                    ],
+                }
+                with open(log_path, "ab") as log:
+                    process = await asyncio.create_subprocess_exec(
+                        sys.executable, "-c", AUTOMATION_WORKER_SOURCE,
+                        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=log,
+                        env=worker_env(credentials, sandbox), cwd=sandbox, **worker_identity(),
+                    )
+                trace_count("test_workers_started")
+                try:
+                    process.stdin.write(json.dumps(job).encode("utf-8"))
+                    await process.stdin.drain()
+                    process.stdin.close()
+                    deadline = time.monotonic() + AUTOMATION_WORKER_STARTUP_SECONDS + test_deadline
+                    while pending:
+                        try:
+                            line = await asyncio.wait_for(process.stdout.readline(), max(deadline - time.monotonic(), 0))
+                        except asyncio.TimeoutError:
+                            finish(worker_error(pending[0], f"Worker killed after {test_deadline:g}s: the script blocked or never finished"))
+                            trace_count("test_workers_killed")
+                            break
+                        except ValueError:
+                            continue  # An overlong stray line; results are short
+                        if not line:
+                            await process.wait()
+                            finish(worker_error(pending[0], f"Worker exited with code {process.returncode}; see {log_path}"))
+                            break
+                        text = line.decode("utf-8", "replace")
+                        if not text.startswith(AUTOMATION_RESULT_PREFIX):
+                            continue
+                        finish(json.loads(text[len(AUTOMATION_RESULT_PREFIX):]))
+                        deadline = time.monotonic() + test_deadline
+                finally:
+                    if process.returncode is None:
+                        process.kill()
+                    await process.wait()
+    return results
+
+
+async def run_test_scripts(scripts: list, base_url: str, credentials: dict, workers: int = AUTOMATION_WORKERS) -> list:
+    """Executes scripts on a pool of worker processes, each sharing one browser across its shard."""
+    storage_state = await ensure_storage_state(base_url, credentials)
+    shards = shard_scripts(scripts, workers)
+    shard_results = await asyncio.gather(*(
+        run_shard_in_worker(index, shard, base_url, credentials, storage_state) for index, shard in enumerate(shards)
+    ))
+    return [result for results in shard_results for result in results]
+
+
+# --- Coverage matrix (feature x testing type x priority) and gap filling ---
+
+COVERAGE_TESTING_TYPES = [
+    "Functional", "Negative", "Boundary", "Performance", "Security", "Integration", "Usability",
+    "Regression", "Smoke", "Sanity", "Database", "End-to-End", "Exploratory",
+]
+# Types that apply to almost every feature; the rest are opt-in when filling gaps
+COVERAGE_DEFAULT_TYPES = ["Functional", "Negative", "Boundary", "Security", "Usability"]
+COVERAGE_PRIORITIES = ["High", "Medium", "Low"]
+COVERAGE_CASES_PER_CELL = 2
+COVERAGE_MAX_CELLS_PER_ROUND = int(st.secrets.get("coverage_max_cells_per_round", 12))
+COVERAGE_GAP_CONCURRENCY = 4
+# A cell holding this many times the average of the non-empty cells is reported as overfilled
+COVERAGE_OVERFILL_FACTOR = 3
+COVERAGE_CONTEXT_CHARS = 4000
+COVERAGE_TYPE_LOOKUP = {_field_key(testing_type): testing_type for testing_type in COVERAGE_TESTING_TYPES}
+
+GAP_PLANNER_SYSTEM_MESSAGE = """
+        You are an expert QA test planner. You add a few NEW test cases for exactly one feature and one testing type
+        to an existing suite, using the given instruction and site insights as context.
+        Do not repeat the existing test cases listed for the feature. Steps must be concrete (navigate, fill, click, assert)
+        and must not mention locators. Set "High Level Feature" and "Testing Type" to the requested values.
+        """ + PLANNER_JSON_OUTPUT_INSTRUCTIONS
+
+
+def testing_types_of(record: dict) -> list:
+    """Canonical testing types of a record ("Functional, Regression" counts for both)."""
+    types = []
+    for part in re.split(r'[,/&;]|\band\b', record.get("Testing_Type", "")):
+        testing_type = COVERAGE_TYPE_LOOKUP.get(_field_key(part))
+        if testing_type and testing_type not in types:
+            types.append(testing_type)
+    return types
+
+
+def coverage_counts(records: list) -> dict:
+    """{(feature, testing_type): {priority: count}} over all records."""
+    counts = {}
+    for record in records:
+        feature = record.get("High Level Feature", "").strip() or "(unspecified)"
+        priority = next((p for p in COVERAGE_PRIORITIES if p.lower() in record.get("Priority", "").lower()), "Other")
+        for testing_type in testing_types_of(record) or ["Other"]:
+            cell = counts.setdefault((feature, testing_type), {})
+            cell[priority] = cell.get(priority, 0) + 1
+    return counts
+
+
+def coverage_gaps(records: list, testing_types: list) -> list:
+    """Empty (feature, testing_type) cells for the given types, features in order of first appearance."""
+    counts = coverage_counts(records)
+    features = list(dict.fromkeys(feature for feature, _ in counts))
+    return [(feature, testing_type) for feature in features for testing_type in testing_types if (feature, testing_type) not in counts]
+
+
+def coverage_overfilled(records: list) -> list:
+    counts = {cell: sum(by_priority.values()) for cell, by_priority in coverage_counts(records).items()}
+    if not counts:
+        return []
+    average = sum(counts.values()) / len(counts)
+    return sorted((cell for cell, total in counts.items() if total >= max(COVERAGE_OVERFILL_FACTOR * average, 2)), key=lambda cell: -counts[cell])
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def coverage_frame(digest: str, priority: str, _records: list) -> pd.DataFrame:
+    """Feature x testing type counts (optionally for one priority), for display."""
+    counts = coverage_counts(_records)
+    features = list(dict.fromkeys(feature for feature, _ in counts))
+    columns = COVERAGE_TESTING_TYPES + (["Other"] if any(t == "Other" for _, t in counts) else [])
+    rows = {
+        feature: [
+            sum(count for p, count in counts.get((feature, testing_type), {}).items() if priority in ("All", p))
+            for testing_type in columns
+        ]
+        for feature in features
+    }
+    return pd.DataFrame.from_dict(rows, orient="index", columns=columns)
+
+
+def get_gap_planner() -> GroqOSSAgent:
+    profile = AGENT_PROFILES["gap_planner"]
+    return GroqOSSAgent(
+        profile.name, GAP_PLANNER_SYSTEM_MESSAGE, model_name=DEFAULT_GROQ_MODEL, max_tokens=profile.max_tokens,
+        temperature=profile.temperature, profile="gap_planner", response_format=profile.response_format
+    )
+
+
+async def fill_coverage_gap(agent: GroqOSSAgent, feature: str, testing_type: str, context: str, existing: list) -> list:
+    """Plans COVERAGE_CASES_PER_CELL new cases for one empty cell."""
+    titles = [record.get("Test Case", "") for record in existing if record.get("High Level Feature", "").strip() == feature]
+    prompt = (
+        f"Write {COVERAGE_CASES_PER_CELL} new {testing_type} test cases for the feature \"{feature}\".\n\n"
+        f"Existing test cases for this feature:\n" + ("\n".join(f"- {title}" for title in titles[:30]) or "- (none)") +
+        f"\n\nContext:\n{context}"
+    )
+    with trace_span("fill_gap", feature=feature, testing_type=testing_type) as span:
+        records = await plan_testcases_json(prompt, existing, agent=agent)
+        span.attrs["cases"] = len(records)
+    for record in records:
+        # The cell was requested explicitly, so keep the matrix consistent even if the model drifts
+        record["High Level Feature"] = feature
+        record["Testing_Type"] = testing_type
+    return records
+
+
+# --- Multi-site inspection ---
+
+SITE_INSPECTION_CONCURRENCY = int(st.secrets.get("max_concurrent_sites", 3))
+# Total size of the site insights handed to the planner when several sites are inspected
+PLANNER_SITE_CONTEXT_CHARS = int(st.secrets.get("planner_site_context_chars", 12000))
+PROMPT_URL_PATTERN = re.compile(r'https?://[^\s]+')
+PROMPT_USERNAME_PATTERN = re.compile(r"username\s*=\s*'([^']+)'")
+PROMPT_PASSWORD_PATTERN = re.compile(r"password\s*=\s*'([^']+)'")
+
+
+class SiteInspectionLimiter:
+    """Process-wide cap on site inspections in flight, each of which holds its own browser.
+
+    Shared by every job, so concurrent runs together stay within the limit; one semaphore per event loop.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._semaphores:
+                self._semaphores[loop] = asyncio.Semaphore(self.limit)
+            return self._semaphores[loop]
+
+
+@st.cache_resource
+def get_site_inspection_limiter():
+    return SiteInspectionLimiter(SITE_INSPECTION_CONCURRENCY)
+
+
+def extract_site_targets(user_prompt: str) -> list:
+    """Start URLs in the prompt, each with the credentials written after it (before the next URL).
+
+    Credentials given before the first URL apply to every site that has none of its own.
+    """
+    matches = list(PROMPT_URL_PATTERN.finditer(user_prompt))
+    if not matches:
+        return []
+    prefix = user_prompt[:matches[0].start()]
+    default_username = PROMPT_USERNAME_PATTERN.search(prefix)
+    default_password = PROMPT_PASSWORD_PATTERN.search(prefix)
+    sites = []
+    for index, match in enumerate(matches):
+        url = match.group(0).rstrip(".,;:)'\"")
+        if any(site["url"] == url for site in sites):
+            continue
+        segment = user_prompt[match.end():matches[index + 1].start() if index + 1 < len(matches) else len(user_prompt)]
+        username = PROMPT_USERNAME_PATTERN.search(segment) or default_username
+        password = PROMPT_PASSWORD_PATTERN.search(segment) or default_password
+        sites.append({
+            "url": url,
+            "username": username.group(1) if username else None,
+            "password": password.group(1) if password else None,
+        })
+    return sites
+
+
+def fair_share(lengths: list, budget: int) -> list:
+    """Splits budget across items: short items keep their full length, the rest share what's left evenly."""
+    allowances = [0] * len(lengths)
+    remaining = budget
+    pending = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    while pending:
+        share = remaining // len(pending)
+        if lengths[pending[0]] > share:
+            for i in pending:
+                allowances[i] = share
+            break
+        index = pending.pop(0)
+        allowances[index] = lengths[index]
+        remaining -= lengths[index]
+    return allowances
+
+
+def merge_site_insights(results: list, budget: int = PLANNER_SITE_CONTEXT_CHARS) -> str:
+    """One planner context with a section per site, each cut to its share of the budget."""
+    texts = [(site["url"], insights if error is None else f"(Inspection failed: {error})") for site, insights, _, error in results]
+    allowances = fair_share([len(text) for _, text in texts], budget)
+    sections = [f"The product spans {len(texts)} sites; each has its own section below."]
+    for number, ((url, text), allowance) in enumerate(zip(texts, allowances), start=1):
+        body = text if len(text) <= allowance else text[:allowance].rstrip() + "\n[...truncated to fit the context budget]"
+        sections.append(f"### Site {number}: {url}\n{body}")
+    return "\n\n".join(sections)
+
+
+def merge_inspection_reports(results: list) -> dict:
+    """Combines per-site reports into the crawl report shape, tagging pages and clusters with their site."""
+    merged = {"pages": [], "clusters": [], "insights_cache": {}, "changes": {}, "had_previous_crawl": False,
+              "recommendations_reused": bool(results), "sites": []}
+    totals = {"pages": 0, "reused": 0, "analyzed": 0, "tokens_saved": 0, "latency_saved_ms": 0.0}
+    for site, _, report, error in results:
+        report_dict = report.to_dict()
+        merged["pages"] += [{"site": site["url"], **entry} for entry in report_dict["pages"]]
+        merged["clusters"] += [{"site": site["url"], **cluster} for cluster in report_dict["clusters"]]
+        for kind, urls in report_dict["changes"].items():
+            merged["changes"].setdefault(kind, []).extend(urls)
+        merged["had_previous_crawl"] = merged["had_previous_crawl"] or report_dict["had_previous_crawl"]
+        merged["recommendations_reused"] = merged["recommendations_reused"] and report_dict["recommendations_reused"]
+        for key in totals:
+            totals[key] += report_dict["insights_cache"].get(key, 0)
+        merged["sites"].append({
+            "site": site["url"],
+            "login": "yes" if site["username"] and site["password"] else "no",
+            "pages": summarize_crawl_report(report_dict["pages"])["pages"],
+            "status": "failed" if error else "ok",
+            "error": error or "",
+        })
+    if totals["pages"]:
+        merged["insights_cache"] = {**totals, "reuse_ratio": round(totals["reused"] / totals["pages"], 3)}
+    return merged
+
+
+async def inspect_sites(sites: list, key_elements: str, instruction: str):
+    """Inspects every site concurrently (each in its own browser), returning (planner context, crawl report).
+
+    Browsers are capped by the process-wide limiter, so other jobs' inspections count against the same limit.
+    """
+    semaphore = get_site_inspection_limiter().semaphore()
+
+    async def inspect_one(site: dict):
+        report = InspectionReport()
+        if semaphore.locked():
+            ui_message(f"Waiting for a free browser slot to inspect {site['url']}...")
+        async with semaphore:
+            with trace_span("inspect_site", url=site["url"]):
+                try:
+                    insights = await inspector.inspect_site(site["url"], key_elements, instruction, site["username"], site["password"], report=report)
+                    return site, insights, report, None
+                except Exception as e:
+                    # One unreachable site shouldn't cost the insights of the others
+                    ui_message(f"Inspection of {site['url']} failed: {e}", "error")
+                    return site, "", report, f"{e.__class__.__name__}: {e}"
+
+    results = await asyncio.gather(*(inspect_one(site) for site in sites))
+    return merge_site_insights(results), merge_inspection_reports(results)
 
 
 # --- 3. STREAMLIT UI & ASYNC LOGIC ---
@@ -563,59 +3078,127 @@ def get_agents():
     return {
         "user": UserProxyAgent("User"),
         "inspector": SiteInspectorAgent(),
-        "planner": PlannerAgentOSS()
+        "planner": PlannerAgentOSS(),
+        "planner_json": PlannerAgentOSS("planner_json")
     }
 
 agents = get_agents()
 user = agents["user"]
 inspector = agents["inspector"]
 planner = agents["planner"]
+planner_json = agents["planner_json"]
 
 # --- Async Helper Functions ---
 
-async def run_initial_generation(user_prompt, status_placeholder):
-    """Orchestrates the full initial generation process."""
+async def run_initial_generation(user_prompt, status_placeholder, state=None):
+    """Orchestrates the full initial generation process.
+
+    A re-run of the same prompt reuses its refined instruction, and when the crawl finds nothing new
+    for the planner (identical planner input and output mode), the last generation's test cases are kept.
+    """
+    state = state if state is not None else st.session_state
+    last_generation = getattr(state, "last_generation", None) or {}
     
     # 1. Extract details from prompt
     status_placeholder.update(label="Extracting details from prompt...")
-    url_match = re.search(r'(https?://[^\s]+)', user_prompt)
-    site_url = url_match.group(1) if url_match else None
-    username_match = re.search(r"username\s*=\s*'([^']+)'", user_prompt)
-    password_match = re.search(r"password\s*=\s*'([^']+)'", user_prompt)
-    username = username_match.group(1) if username_match else None
-    password = password_match.group(1) if password_match else None
-    element_keywords = [kw for kw in ["search", "input", "button", "link", "verify", "assert", "click", "fill", "submit", "navigate", "page", "text", "selector"] if kw in user_prompt.lower()]
-    key_elements = ", ".join(element_keywords) if element_keywords else "main interactive elements"
+    with trace_span("extract"):
+        sites = extract_site_targets(user_prompt)
+        site_url = sites[0]["url"] if sites else None
+        username = sites[0]["username"] if sites else None
+        password = sites[0]["password"] if sites else None
+        element_keywords = [kw for kw in ["search", "input", "button", "link", "verify", "assert", "click", "fill", "submit", "navigate", "page", "text", "selector"] if kw in user_prompt.lower()]
+        key_elements = ", ".join(element_keywords) if element_keywords else "main interactive elements"
 
     # 2. Refine Instruction
-    status_placeholder.update(label="Step 1/3: Refining instruction...")
-    refined = await refine_instruction(user_prompt)
-    st.session_state.refined_instruction = refined
-
-    # 3. Inspect Site
-    crawl_status_container = st.container()
-    with crawl_status_container:
+    if last_generation.get("user_prompt") == user_prompt:
+        # The refinement isn't deterministic, and a new wording would defeat every cache downstream
+        refined = last_generation["refined"]
+        trace_count("refine_reused")
+    else:
+        status_placeholder.update(label="Step 1/3: Refining instruction...")
+        with trace_span("refine"):
+            refined = await refine_instruction(user_prompt)
+    state.refined_instruction = refined
+
+    # 3. Inspect Site(s)
+    if len(sites) > 1:
+        status_placeholder.update(label=f"Step 2/3: Inspecting {len(sites)} sites concurrently... (This may take a moment)")
+        with trace_span("inspect", sites=len(sites)):
+            locators, crawl_report = await inspect_sites(sites, key_elements, refined)
+    else:
         status_placeholder.update(label=f"Step 2/3: Inspecting {site_url or 'site'}... (This may take a moment)")
-        locators = await inspector.inspect_site(site_url, key_elements, refined, username, password)
-    st.session_state.locator_recommendations = locators
-    crawl_status_container.empty() # Clear crawl messages
+        inspection_report = InspectionReport()
+        # A single site still holds a browser, so it takes a slot from the same process-wide limit
+        async with get_site_inspection_limiter().semaphore():
+            with trace_span("inspect", url=site_url):
+                locators = await inspector.inspect_site(site_url, key_elements, refined, username, password, report=inspection_report)
+        crawl_report = inspection_report.to_dict()
+    state.locator_recommendations = locators
+    state.crawl_report = crawl_report
+    state.target_site = {"url": site_url, "username": username, "password": password}
 
     # 4. Plan Test Cases
     planner_input = f"Refined Instruction:\n{refined}\n\nSite Insights and Recommended Locators:\n{locators}"
-    st.session_state.planner_input = planner_input # Save for feedback
-    
-    status_placeholder.update(label="Step 3/3: Planning initial test cases...")
-    initial_cases = await user.initiate_chat(planner, planner_input)
-    st.session_state.all_test_cases_str = initial_cases
+    state.planner_input = planner_input # Save for feedback
+    output_mode = getattr(state, "planner_output_mode", "markdown")
+    generation_key = content_hash(output_mode + "\n" + planner_input)
+
+    if last_generation.get("key") == generation_key and last_generation.get("test_cases_list"):
+        ui_message(f"♻️ Nothing changed for the planner since the last run; keeping its {len(last_generation['test_cases_list'])} test cases")
+        trace_count("plan_reused")
+        state.all_test_cases_str = last_generation["all_test_cases_str"]
+        state.test_cases_list = copy.deepcopy(last_generation["test_cases_list"])
+        status_placeholder.update(label="Saving test cases to Excel...")
+        export_testcases(state.test_cases_list)
+        return
 
-    # 5. Parse and Save
-    status_placeholder.update(label="Parsing and saving test cases to Excel...")
-    parse_and_export_testcases(st.session_state.all_test_cases_str)
+    status_placeholder.update(label="Step 3/3: Planning initial test cases...")
+    if output_mode == "json":
+        records = await plan_testcases_json(planner_input)
+        state.all_test_cases_str = render_testcases_markdown(records)
+        state.test_cases_list = records
+        status_placeholder.update(label="Saving test cases to Excel...")
+        export_testcases(records)
+    else:
+        with trace_span("plan"):
+            initial_cases = await user.initiate_chat(planner, planner_input)
+        state.all_test_cases_str = initial_cases
+
+        # 5. Parse and Save
+        status_placeholder.update(label="Parsing and saving test cases to Excel...")
+        parse_and_export_testcases(state.all_test_cases_str, state)
+
+    # Kept apart from test_cases_list, which feedback and edits change afterwards
+    state.last_generation = {
+        "user_prompt": user_prompt,
+        "refined": refined,
+        "key": generation_key,
+        "all_test_cases_str": state.all_test_cases_str,
+        "test_cases_list": copy.deepcopy(state.test_cases_list or []),
+    }
 
 
-async def run_feedback_generation(feedback_prompt, status_placeholder):
+async def run_feedback_generation(feedback_prompt, status_placeholder, state=None):
     """Orchestrates the feedback-based generation process."""
-    
+    state = state if state is not None else st.session_state
+
+    if getattr(state, "planner_output_mode", "markdown") == "json":
+        existing = list(state.test_cases_list or [])
+        status_placeholder.update(label="Generating additional test cases...")
+        planner_input = (
+            f"You have already generated a set of test cases. A human user now wants you to ADD MORE test cases based on the following feedback. "
+            f"**IMPORTANT: Generate ONLY the NEW test cases requested. Do NOT repeat or modify the previously generated ones.**\n"
+            f"Continue numbering from TC-{next_testcase_number(existing)} and answer in the JSON format from your instructions.\n\n"
+            f"Feedback: '{feedback_prompt}'"
+        )
+        records = await plan_testcases_json(planner_input, existing)
+        status_placeholder.update(label="Appending new test cases...")
+        new_test_cases = render_testcases_markdown(records, first_number=len(existing) + 1)
+        state.all_test_cases_str = (state.all_test_cases_str + "\n\n" + new_test_cases) if state.all_test_cases_str else new_test_cases
+        state.test_cases_list = existing + records
+        export_testcases(state.test_cases_list)
+        return
+
     # 1. Create new prompt for planner
     status_placeholder.update(label="Formulating feedback for planner...")
     planner_input = (
@@ -651,19 +3234,20 @@ async def run_feedback_generation(feedback_prompt, status_placeholder):
     
     # 2. Generate new test cases
     status_placeholder.update(label="Generating additional test cases...")
-    new_test_cases = await user.initiate_chat(planner, planner_input)
+    with trace_span("plan"):
+        new_test_cases = await user.initiate_chat(planner, planner_input)
     
     # 3. Append and save
     status_placeholder.update(label="Appending new test cases...")
     # The new test cases are appended to the existing string
-    if st.session_state.all_test_cases_str:
-        st.session_state.all_test_cases_str += "\n\n" + new_test_cases
+    if state.all_test_cases_str:
+        state.all_test_cases_str += "\n\n" + new_test_cases
     else:
-        st.session_state.all_test_cases_str = new_test_cases
+        state.all_test_cases_str = new_test_cases
     
     # 4. Re-parse and save the CUMULATIVE list
     status_placeholder.update(label="Parsing and saving all test cases to Excel...")
-    parse_and_export_testcases(st.session_state.all_test_cases_str)
+    parse_and_export_testcases(state.all_test_cases_str, state)
 # --------------------------------------------------------------
 # 1. EDIT FUNCTION (replace your current run_edit_generation)
 # --------------------------------------------------------------
@@ -729,31 +3313,31 @@ def rebuild_test_case_block(fields: dict, prefix: str, numeric_header: str):
 async def detect_target_field(edit_instruction: str, fields: dict):
     field_list = list(fields.keys())
 
-    detection_prompt = f"""
-You are a QA assistant.
-
-Given this edit instruction:
+    detection_prompt = f"""Edit instruction:
 "{edit_instruction}"
 
-And this list of available fields:
+Available fields:
 {field_list}
-
-Return ONLY the exact field name that should be edited.
-Do not return anything else.
 """
 
-    response = await user.initiate_chat(planner, detection_prompt)
-    return response.strip()
+    response = await user.initiate_chat(get_profile_agent("field_detect"), detection_prompt)
+    detected = response.strip().strip('"\'`*').strip()
+    # Tolerate casing/punctuation drift from the model by mapping back onto the real field names
+    for field in field_list:
+        if field.lower() == detected.lower():
+            return field
+    return detected
 
 
 # -----------------------------
 # MAIN FUNCTION (UPDATED)
 # -----------------------------
-async def run_edit_generation(test_case_id: str, edit_instruction: str, status_placeholder):
+async def run_edit_generation(test_case_id: str, edit_instruction: str, status_placeholder, state=None):
+    state = state if state is not None else st.session_state
 
     # Normalize text
-    st.session_state.all_test_cases_str = (
-        st.session_state.all_test_cases_str
+    state.all_test_cases_str = (
+        state.all_test_cases_str
         .replace("\r\n", "\n")
         .replace("\r", "\n")
         .strip() + "\n"
@@ -763,10 +3347,10 @@ async def run_edit_generation(test_case_id: str, edit_instruction: str, status_p
 
     pattern = rf'(\d+\.\s*\n\s*\n)?(\s*[*•-]\s*Test Case ID:\s*{re.escape(test_case_id.strip())}.*?)(?=\n\d+\.|\Z)'
 
-    match = re.search(pattern, st.session_state.all_test_cases_str, re.DOTALL)
+    match = re.search(pattern, state.all_test_cases_str, re.DOTALL)
 
     if not match:
-        st.error(f"❌ Test case {test_case_id} not found.")
+        ui_message(f"❌ Test case {test_case_id} not found.", "error")
         return None, None
 
     original_block = match.group(0).strip()
@@ -776,10 +3360,11 @@ async def run_edit_generation(test_case_id: str, edit_instruction: str, status_p
 
     # Detect which field to edit
     status_placeholder.update(label="🧠 Detecting field to edit...")
-    target_field = await detect_target_field(edit_instruction, fields)
+    with trace_span("detect_field"):
+        target_field = await detect_target_field(edit_instruction, fields)
 
     if target_field not in fields:
-        st.error(f"❌ Invalid field detected: {target_field}")
+        ui_message(f"❌ Invalid field detected: {target_field}", "error")
         return None, None
 
     original_value = fields[target_field]
@@ -787,10 +3372,7 @@ async def run_edit_generation(test_case_id: str, edit_instruction: str, status_p
     # Ask LLM to regenerate ONLY that field value
     status_placeholder.update(label=f"✏️ Updating: {target_field}")
 
-    field_prompt = f"""
-You are a strict QA editor.
-
-Instruction:
+    field_prompt = f"""Instruction:
 "{edit_instruction}"
 
 Field Name:
@@ -798,14 +3380,10 @@ Field Name:
 
 Original Value:
 {original_value}
-
-Return ONLY the updated value.
-Do NOT include field name.
-Do NOT include bullets.
-Do NOT include extra text.
 """
 
-    updated_value = await user.initiate_chat(planner, field_prompt)
+    with trace_span("rewrite_field", field=target_field):
+        updated_value = await user.initiate_chat(get_profile_agent("field_rewrite"), field_prompt)
     updated_value = updated_value.strip()
 
     # Update only target field
@@ -820,35 +3398,442 @@ Do NOT include extra text.
     new_full_str, n_subs = re.subn(
         pattern,
         updated_block,
-        st.session_state.all_test_cases_str,
+        state.all_test_cases_str,
         count=1,
         flags=re.DOTALL
     )
 
     if n_subs == 0:
-        st.error("❌ Replacement failed.")
+        ui_message("❌ Replacement failed.", "error")
         return None, None
 
     # st.session_state.all_test_cases_str = (
     #     new_full_str.replace("\r\n", "\n").replace("\r", "\n").strip() + "\n"
     # )
-    st.session_state.all_test_cases_str = (
+    state.all_test_cases_str = (
     new_full_str.replace("\r\n", "\n").replace("\r", "\n").strip() + "\n"
 )
 
 # 🔥 IMPORTANT: Regenerate Excel file with updated data
     try:
-        parse_and_export_testcases(st.session_state.all_test_cases_str)
+        # JSON-mode records are updated in place; markdown output is re-parsed as before
+        if getattr(state, "planner_output_mode", "markdown") == "json" and update_testcase_record(
+                state.test_cases_list, test_case_id, target_field, updated_value):
+            export_testcases(state.test_cases_list)
+        else:
+            parse_and_export_testcases(state.all_test_cases_str, state)
     except Exception as e:
-        st.warning(f"⚠️ Excel regeneration failed after edit: {e}")
+        ui_message(f"⚠️ Excel regeneration failed after edit: {e}", "warning")
 
 
     status_placeholder.update(label="✅ Update successful", state="complete")
-    st.success(f"✅ Test case {test_case_id} updated successfully!")
+    ui_message(f"✅ Test case {test_case_id} updated successfully!", "success")
 
     return original_block, updated_block
 
 
+async def run_automation(status_placeholder, state=None):
+    """Generates Playwright scripts for the automatable test cases, runs them and records the outcomes."""
+    state = state if state is not None else st.session_state
+    site = state.target_site or {}
+    base_url = site.get("url")
+    if not base_url:
+        ui_message("❌ No site URL in the last generation; include one in the instruction to automate its test cases.", "error")
+        return
+    records = [record for record in state.test_cases_list or [] if is_automatable(record)]
+    if not records:
+        ui_message("⚠️ No test cases are marked as automatable.", "warning")
+        return
+    origin = urlparse(base_url).scheme + "://" + urlparse(base_url).netloc
+    credentials = {"username": site.get("username") or "", "password": site.get("password") or ""}
+
+    status_placeholder.update(label=f"Writing Playwright scripts for {len(records)} test case(s)...")
+    locator_context = automation_context(state, origin)
+    semaphore = asyncio.Semaphore(SCRIPT_WRITER_CONCURRENCY)
+    storage_state = storage_state_path(origin)
+
+    async def write(record: dict):
+        async with semaphore:
+            try:
+                return {"record": record, **await write_test_script(record, base_url, storage_state, locator_context)}
+            except ValueError as e:
+                return {"record": record, "error": f"Script generation failed: {e}"}
+
+    with trace_span("generate_scripts", tests=len(records)):
+        scripts = await asyncio.gather(*(write(record) for record in records))
+    runnable = [item for item in scripts if "error" not in item]
+    ui_message(f"{len(runnable)} script(s) ready ({sum(item['cached'] for item in runnable)} reused) in {GENERATED_TESTS_DIR}/")
+
+    status_placeholder.update(label=f"Running {len(runnable)} test(s) on {min(AUTOMATION_WORKERS, len(runnable))} worker(s)...")
+    with trace_span("run_tests", tests=len(runnable), workers=AUTOMATION_WORKERS):
+        results = await run_test_scripts(runnable, base_url, credentials) if runnable else []
+    results += [
+        {"test_case_id": item["record"].get("Test Case ID", ""), "status": "error", "attempts": 0, "duration_s": 0.0, "error": item["error"]}
+        for item in scripts if "error" in item
+    ]
+
+    # Write outcomes back into the records, so they appear in the table and the Excel export
+    by_id = {result["test_case_id"]: result for result in results}
+    for record in records:
+        result = by_id.get(record.get("Test Case ID", ""))
+        if result is not None:
+            record.update(dict(zip(AUTOMATION_RESULT_KEYS, (result["status"], result["attempts"], result["duration_s"], result["error"]))))
+    status_placeholder.update(label="Saving results to Excel...")
+    export_testcases(state.test_cases_list)
+
+    summary = {status: sum(result["status"] == status for result in results) for status in ("passed", "flaky", "failed", "error")}
+    state.automation_report = {
+        "summary": summary,
+        "results": results,
+        "scripts": {item["record"].get("Test Case ID", ""): item["path"] for item in runnable},
+    }
+    ui_message(
+        f"✅ {summary['passed']} passed, {summary['flaky']} flaky, {summary['failed']} failed, {summary['error']} errored",
+        "success" if not summary["failed"] and not summary["error"] else "warning"
+    )
+
+
+
+
+async def run_fill_gaps(testing_types: list, status_placeholder, state=None):
+    """Plans a few cases for each empty feature x testing type cell, concurrently, and appends them."""
+    state = state if state is not None else st.session_state
+    existing = list(state.test_cases_list or [])
+    gaps = coverage_gaps(existing, testing_types)
+    if not gaps:
+        ui_message("✅ No empty cells for the selected testing types.", "success")
+        return
+    if len(gaps) > COVERAGE_MAX_CELLS_PER_ROUND:
+        ui_message(f"{len(gaps)} empty cells; filling the first {COVERAGE_MAX_CELLS_PER_ROUND} this round.")
+        gaps = gaps[:COVERAGE_MAX_CELLS_PER_ROUND]
+
+    status_placeholder.update(label=f"Filling {len(gaps)} coverage gap(s)...")
+    agent = get_gap_planner()
+    context = (state.planner_input or "")[:COVERAGE_CONTEXT_CHARS]
+    semaphore = asyncio.Semaphore(COVERAGE_GAP_CONCURRENCY)
+
+    async def fill(feature: str, testing_type: str) -> list:
+        async with semaphore:
+            records = await fill_coverage_gap(agent, feature, testing_type, context, existing)
+        ui_message(f"{feature} × {testing_type}: {len(records)} new case(s)")
+        return records
+
+    with trace_span("fill_gaps", cells=len(gaps)):
+        results = await asyncio.gather(*(fill(feature, testing_type) for feature, testing_type in gaps))
+
+    # Requests ran concurrently, so their IDs can collide: renumber after the existing suite
+    new_records = [record for records in results for record in records]
+    first_number = next_testcase_number(existing)
+    for offset, record in enumerate(new_records):
+        record["Test Case ID"] = f"TC-{first_number + offset}"
+    trace_count("coverage_cells_filled", sum(1 for records in results if records))
+    trace_count("coverage_cases_added", len(new_records))
+    if not new_records:
+        ui_message("⚠️ The planner returned no usable test cases for the empty cells.", "warning")
+        return
+
+    status_placeholder.update(label="Appending new test cases...")
+    new_test_cases = render_testcases_markdown(new_records, first_number=len(existing) + 1)
+    state.all_test_cases_str = (state.all_test_cases_str + "\n\n" + new_test_cases) if state.all_test_cases_str else new_test_cases
+    state.test_cases_list = existing + new_records
+    export_testcases(state.test_cases_list)
+    ui_message(f"✅ Filled {sum(1 for records in results if records)}/{len(gaps)} cells with {len(new_records)} new test cases", "success")
+
+
+
+# --- Results view (filtered, paginated, cached by content hash) ---
+
+RESULTS_PAGE_SIZES = (10, 25, 50, 100)
+
+
+def testcases_digest(records: list) -> str:
+    return hashlib.sha256(json.dumps(records or [], sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+# The records are passed underscore-prefixed so Streamlit keys these caches on the digest instead of hashing them
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_testcases_workbook(digest: str, _records: list) -> bytes:
+    return build_testcases_workbook(_records)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def testcases_frame(digest: str, _records: list) -> pd.DataFrame:
+    return pd.DataFrame(_records)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def filter_testcases(digest: str, testing_types: tuple, priorities: tuple, features: tuple, search: str, _records: list) -> list:
+    """Indices of the records matching every active filter; search is case-insensitive over all fields."""
+    needle = search.strip().lower()
+    matches = []
+    for index, record in enumerate(_records):
+        if testing_types and record.get("Testing_Type", "") not in testing_types:
+            continue
+        if priorities and record.get("Priority", "") not in priorities:
+            continue
+        if features and record.get("High Level Feature", "") not in features:
+            continue
+        if needle and needle not in " ".join(str(value) for value in record.values()).lower():
+            continue
+        matches.append(index)
+    return matches
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def render_results_page(digest: str, indices: tuple, _records: list) -> str:
+    """Markdown for one page of test cases."""
+    blocks = []
+    for index in indices:
+        record = _records[index]
+        lines = [f"#### {record.get('Test Case ID') or f'#{index + 1}'} · {record.get('High Level Feature', '')}"]
+        lines += [f"- **{field}:** {record.get(TESTCASE_RECORD_KEYS[field], '')}" for field in TESTCASE_FIELDS[1:]]
+        lines += [f"- **{key}:** {record[key]}" for key in AUTOMATION_RESULT_KEYS if record.get(key) not in (None, "")]
+        blocks.append("\n".join(lines))
+    return "\n\n---\n\n".join(blocks)
+
+
+def render_results_view(records: list, digest: str):
+    """Filter bar, virtualized table and paginated detail cards over the parsed records."""
+    def options(key: str, widget_key: str) -> list:
+        values = sorted({record.get(key, "") for record in records if record.get(key)})
+        # Drop selections left over from an earlier result set, which the widget would reject
+        if widget_key in st.session_state:
+            st.session_state[widget_key] = [value for value in st.session_state[widget_key] if value in values]
+        return values
+
+    col1, col2, col3 = st.columns(3)
+    testing_types = col1.multiselect("Testing Type", options("Testing_Type", "filter_testing_type"), key="filter_testing_type")
+    priorities = col2.multiselect("Priority", options("Priority", "filter_priority"), key="filter_priority")
+    features = col3.multiselect("Feature", options("High Level Feature", "filter_feature"), key="filter_feature")
+    search = st.text_input("Search test cases", key="filter_search", placeholder="e.g. password reset, TC-12, invalid email")
+
+    indices = filter_testcases(digest, tuple(testing_types), tuple(priorities), tuple(features), search, records)
+    st.caption(f"{len(indices)} of {len(records)} test cases")
+
+    table_tab, cards_tab = st.tabs(["Table", "Details"])
+    with table_tab:
+        # st.dataframe only draws the visible rows, so the full filtered set is cheap to show
+        st.dataframe(testcases_frame(digest, records).iloc[indices], use_container_width=True, hide_index=True)
+    with cards_tab:
+        col1, col2 = st.columns([1, 3])
+        page_size = col1.selectbox("Per page", RESULTS_PAGE_SIZES, key="results_page_size")
+        pages = max(1, -(-len(indices) // page_size))
+        if st.session_state.get("results_page", 1) > pages:
+            st.session_state.results_page = 1
+        page = col2.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key="results_page")
+        page_indices = tuple(indices[(page - 1) * page_size: page * page_size])
+        if page_indices:
+            st.markdown(render_results_page(digest, page_indices, records))
+        else:
+            st.info("No test cases match the current filters.")
+
+
+# --- Background jobs (shared event loop, bounded concurrency, cancellation) ---
+
+JOB_MAX_CONCURRENCY = int(st.secrets.get("job_max_concurrency", 2))
+JOB_MAX_QUEUE_DEPTH = int(st.secrets.get("job_max_queue_depth", 8))
+JOB_POLL_INTERVAL_SECONDS = 1.0
+# Finished jobs whose session never collected them (e.g. the tab was closed) are dropped after this long
+JOB_RESULT_TTL_SECONDS = float(st.secrets.get("job_result_ttl_s", 1800))
+# Session keys a job reads from and writes back to
+JOB_STATE_KEYS = (
+    "all_test_cases_str", "refined_instruction", "locator_recommendations", "crawl_report", "planner_input",
+    "test_cases_list", "target_site", "automation_report", "last_generation",
+)
+JOB_TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobProgress:
+    """Stand-in for an st.status placeholder: records the latest label and state for polling."""
+    def __init__(self):
+        self.label = "Queued..."
+        self.state = "running"
+
+    def update(self, label: str = None, state: str = None, expanded: bool = None):
+        if label is not None:
+            self.label = label
+        if state is not None:
+            self.state = state
+
+
+class Job:
+    """A generation/feedback/edit run executing on the shared job loop."""
+    def __init__(self, kind: str, state: types.SimpleNamespace):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.state = state
+        self.progress = JobProgress()
+        self.status = "queued"
+        self.messages = []
+        self.result = None
+        self.error = None
+        self.metrics = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.cancel_requested = False
+
+    def log(self, message: str, level: str = "write"):
+        self.messages.append((level, message))
+
+    @property
+    def done(self) -> bool:
+        return self.status in JOB_TERMINAL_STATUSES
+
+
+class JobManager:
+    """Runs pipeline coroutines on one background event loop shared by every session.
+
+    At most `max_concurrency` jobs run at once; further jobs wait in the queue, and submissions are
+    rejected once `max_queue_depth` jobs are waiting. Finished jobs are evicted `result_ttl` seconds
+    after they end, whether or not their session ever polled them.
+    """
+    def __init__(self, max_concurrency: int = JOB_MAX_CONCURRENCY, max_queue_depth: int = JOB_MAX_QUEUE_DEPTH,
+                 result_ttl: float = JOB_RESULT_TTL_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._semaphore = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="qa-job-loop", daemon=True)
+        self.thread.start()
+
+    def _evict_expired(self):
+        """Drops finished jobs older than the TTL. Caller holds the lock."""
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at is not None and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._evict_expired()
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            "running": statuses.count("running"),
+            "queued": statuses.count("queued"),
+            "max_concurrency": self.max_concurrency,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def submit(self, kind: str, run, state: types.SimpleNamespace) -> Job:
+        """Queues `run(progress, state)` as a job. Raises JobQueueFull when the queue is at its limit."""
+        with self._lock:
+            self._evict_expired()
+            active = sum(1 for job in self.jobs.values() if not job.done)
+            if active >= self.max_concurrency + self.max_queue_depth:
+                raise JobQueueFull(f"{active - self.max_concurrency} jobs are already waiting; try again shortly.")
+            job = Job(kind, state)
+            self.jobs[job.job_id] = job
+        job.future = asyncio.run_coroutine_threadsafe(self._execute(job, run), self.loop)
+        return job
+
+    async def _execute(self, job: Job, run):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            async with self._semaphore:
+                if job.cancel_requested:
+                    job.status = "cancelled"
+                    return
+                job.status = "running"
+                job.started_at = time.time()
+                _current_job.set(job)
+                with start_run_trace(job.kind) as run_trace:
+                    try:
+                        job.result = await run(job.progress, job.state)
+                        job.status = "succeeded"
+                    except asyncio.CancelledError:
+                        job.status = "cancelled"
+                    except Exception as e:
+                        job.status = "failed"
+                        job.error = f"{e.__class__.__name__}: {e}"
+                        job.log(traceback.format_exc(), "code")
+                job.metrics = run_trace.to_dict()
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job is None or job.done:
+            return
+        job.cancel_requested = True
+        job.log("Cancellation requested.", "warning")
+        if job.future is not None:
+            job.future.cancel()
+
+    def forget(self, job_id: str):
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager()
+
+
+def snapshot_job_state() -> types.SimpleNamespace:
+    """Copies the session values a job needs, so the job never touches st.session_state from its thread."""
+    state = types.SimpleNamespace(**{key: copy.deepcopy(st.session_state.get(key)) for key in JOB_STATE_KEYS})
+    # Read-only for the job (it belongs to a widget), so it is not in JOB_STATE_KEYS
+    state.planner_output_mode = st.session_state.get("planner_output_mode", PLANNER_OUTPUT_MODE)
+    return state
+
+
+def submit_session_job(kind: str, run, state: types.SimpleNamespace = None):
+    """Submits a job for the current session and remembers its ID in session state."""
+    try:
+        job = get_job_manager().submit(kind, run, state if state is not None else snapshot_job_state())
+    except JobQueueFull as e:
+        st.warning(f"⏳ The job queue is full. {e}")
+        return None
+    st.session_state.active_job_id = job.job_id
+    return job
+
+
+def apply_finished_job(job: Job):
+    """Copies a finished job's results into session state and keeps its log for display."""
+    if job.status == "succeeded":
+        for key in JOB_STATE_KEYS:
+            value = getattr(job.state, key, None)
+            if value is not None:
+                st.session_state[key] = value
+        # Computed once per job, so reruns can key the results caches without re-hashing the records
+        st.session_state.test_cases_digest = testcases_digest(st.session_state.get("test_cases_list"))
+        if job.kind == "edit_generation":
+            original_block, updated_block = job.result or (None, None)
+            st.session_state.last_edit_result = {
+                "test_case_id": job.state.edit_id,
+                "original": original_block,
+                "updated": updated_block,
+            }
+    st.session_state.last_run_metrics = job.metrics
+    st.session_state.last_job_report = {
+        "kind": job.kind,
+        "status": job.status,
+        "error": job.error,
+        "messages": job.messages,
+        "duration_s": round((job.finished_at or time.time()) - (job.started_at or job.submitted_at), 1),
+    }
+
+
+def collect_finished_job(job: Job):
+    """Applies a finished job's results to the session and releases it, leaving the session free for a new job."""
+    apply_finished_job(job)
+    get_job_manager().forget(job.job_id)
+    st.session_state.active_job_id = None
 
 
 # --- Streamlit UI ---
@@ -863,15 +3848,42 @@ if 'refined_instruction' not in st.session_state:
     st.session_state.refined_instruction = ""
 if 'locator_recommendations' not in st.session_state:
     st.session_state.locator_recommendations = ""
+if 'crawl_report' not in st.session_state:
+    st.session_state.crawl_report = {}
+if 'last_run_metrics' not in st.session_state:
+    st.session_state.last_run_metrics = None
+if 'active_job_id' not in st.session_state:
+    st.session_state.active_job_id = None
+if 'last_job_report' not in st.session_state:
+    st.session_state.last_job_report = None
+if 'last_edit_result' not in st.session_state:
+    st.session_state.last_edit_result = None
+if 'target_site' not in st.session_state:
+    st.session_state.target_site = {}
+if 'automation_report' not in st.session_state:
+    st.session_state.automation_report = None
+if 'last_generation' not in st.session_state:
+    st.session_state.last_generation = None
+if 'test_cases_digest' not in st.session_state:
+    st.session_state.test_cases_digest = testcases_digest(st.session_state.get("test_cases_list"))
 
 # --- Sidebar for Inputs ---
 with st.sidebar:
     st.image("https://avatars.githubusercontent.com/u/153243936?s=200&v=4", width=100)
     st.header("1. User Instruction")
-    st.markdown("Provide your test instruction, including URL and credentials.")
+    st.markdown("Provide your test instruction, including URL and credentials. For several sites, put each URL's username/password right after it.")
     
     example_prompt = "Test the login flow at https://example.com with username='user@test.com' and password='password123'. Verify successful login by checking for the 'Dashboard' text."
     user_prompt = st.text_area("Your Instruction:", value=example_prompt, height=150, key="user_prompt_input")
+    st.radio(
+        "Planner output:",
+        PLANNER_OUTPUT_MODES,
+        index=PLANNER_OUTPUT_MODES.index(PLANNER_OUTPUT_MODE),
+        format_func=lambda mode: "Structured JSON" if mode == "json" else "Markdown",
+        horizontal=True,
+        key="planner_output_mode",
+        help="Structured JSON asks the planner for schema-checked test case objects instead of markdown that has to be parsed with regexes."
+    )
     
     generate_button = st.button("🚀 Generate Initial Test Cases", use_container_width=True, type="primary")
 
@@ -883,6 +3895,14 @@ with st.sidebar:
     
     feedback_button = st.button("🔄 Generate More Cases", use_container_width=True, type="primary")
 
+    st.markdown("Or let the planner fill the empty cells of the coverage matrix:")
+    gap_types = st.multiselect("Testing types to cover:", COVERAGE_TESTING_TYPES, default=COVERAGE_DEFAULT_TYPES, key="gap_types_input")
+    gap_count = len(coverage_gaps(st.session_state.get("test_cases_list") or [], gap_types))
+    fill_gaps_button = st.button(
+        f"🧩 Fill Coverage Gaps ({gap_count} empty cells)", use_container_width=True,
+        disabled=not gap_count or not st.session_state.all_test_cases_str
+    )
+
     st.divider()
     # st.info(f"Using model: **{DEFAULT_GROQ_MODEL}**")
 
@@ -899,6 +3919,16 @@ with st.sidebar:
     )
     edit_button = st.button("Update Test Case", use_container_width=True, type="primary")
 
+    st.divider()
+    st.header("4. Automate Test Cases")
+    automatable_count = sum(is_automatable(record) for record in st.session_state.get("test_cases_list") or [])
+    st.markdown(
+        f"Generate Playwright scripts for the {automatable_count} test case(s) marked automatable and run them "
+        f"on {AUTOMATION_WORKERS} parallel workers."
+    )
+    automate_button = st.button("🧪 Generate & Run Playwright Tests", use_container_width=True, type="primary",
+                                disabled=not automatable_count)
+
     # Optional: Show current test case
     # --------------------------------------------------------------
 # 2. UI BLOCK – CALLING THE EDIT FUNCTION
@@ -906,90 +3936,127 @@ with st.sidebar:
 # --- Main Area for Outputs ---
 output_container = st.container()
 
-# Button Clicks & Async Logic
-if generate_button and user_prompt:
+# Button Clicks & Background Jobs
+JOB_KIND_LABELS = {
+    "initial_generation": "🚀 Test generation",
+    "feedback_generation": "🔄 Feedback generation",
+    "edit_generation": "✏️ Test case edit",
+    "automation_run": "🧪 Test automation",
+    "coverage_fill": "🧩 Coverage gap filling",
+}
+job_manager = get_job_manager()
+active_job = job_manager.get(st.session_state.active_job_id) if st.session_state.active_job_id else None
+if active_job is None:
+    st.session_state.active_job_id = None
+elif active_job.done:
+    # Finished since the last poll: apply it before a click below starts a job that would replace it
+    collect_finished_job(active_job)
+    active_job = None
+
+
+def session_job_running() -> bool:
+    if active_job is not None:
+        st.warning("⏳ A job is already running for this session. Wait for it to finish or cancel it.")
+        return True
+    return False
+
+
+if generate_button and user_prompt and not session_job_running():
     # Reset state for a new run
     st.session_state.all_test_cases_str = ""
     st.session_state.refined_instruction = ""
     st.session_state.locator_recommendations = ""
-    
-    with st.status("🚀 Starting test generation process...", expanded=True) as status:
-        try:
-            asyncio.run(run_initial_generation(user_prompt, status))
-            status.update(label="✅ Generation complete!", state="complete")
-        except Exception as e:
-            st.error(f"An error occurred during generation: {e}")
-            status.update(label="Generation failed.", state="error")
-    st.rerun() # Rerun to update the main display
+    st.session_state.crawl_report = {}
+    st.session_state.last_edit_result = None
+    st.session_state.target_site = {}
+    st.session_state.automation_report = None
+    active_job = submit_session_job("initial_generation", functools.partial(run_initial_generation, user_prompt))
 
-if feedback_button and feedback:
+if feedback_button and feedback and not session_job_running():
     if not st.session_state.all_test_cases_str:
         st.warning("Please generate initial test cases first before providing feedback.")
     else:
-        with st.status("🔄 Incorporating feedback...", expanded=True) as status:
-            try:
-                asyncio.run(run_feedback_generation(feedback, status))
-                status.update(label="✅ Additional cases generated!", state="complete")
-            except Exception as e:
-                st.error(f"An error occurred during feedback generation: {e}")
-                status.update(label="Feedback generation failed.", state="error")
-        # Clear feedback box by re-running
-        st.rerun()
+        st.session_state.last_edit_result = None
+        active_job = submit_session_job("feedback_generation", functools.partial(run_feedback_generation, feedback))
 
-if edit_button and edit_id and edit_prompt:
+if edit_button and edit_id and edit_prompt and not session_job_running():
     if not st.session_state.all_test_cases_str:
         st.warning("⚠️ Please generate test cases first before editing.")
     else:
-        with st.status(f"✏️ Editing **{edit_id}**...", expanded=True) as status:
-            try:
-                raw_llm, cleaned = asyncio.run(
-                    run_edit_generation(edit_id.strip(), edit_prompt, status)
-                )
-
-                # ---- ALWAYS SHOW RAW LLM OUTPUT ----
-                with st.expander("🔍 DEBUG: Raw LLM Output", expanded=True):
-                    if raw_llm:
-                        st.code(raw_llm, language="markdown")
-                        st.caption(f"Output length: {len(raw_llm)} characters")
-                    else:
-                        st.warning("No output received from LLM.")
-
-                # ---- SHOW CLEANED BLOCK IF EXTRACTED ----
-                if cleaned:
-                    with st.expander("✅ Cleaned Output Used for Replacement", expanded=False):
-                        st.code(cleaned, language="markdown")
-                        st.caption(f"Cleaned length: {len(cleaned)} characters")
-                    
-                    status.update(label=f"✅ {edit_id} updated successfully!", state="complete")
-                    st.success(f"Test case **{edit_id}** has been updated!")
-                    
-                    # Show before/after comparison
-                    if hasattr(st.session_state, 'all_test_cases_str_before_edit'):
-                        with st.expander("📊 Before/After Comparison", expanded=False):
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.markdown("**Before:**")
-                                # Extract the old version
-                                pattern = rf'([*•]\s*Test Case ID:\s*{re.escape(edit_id.strip())}\s*\n.*?)(?=\n[*•]\s*Test Case ID:|\Z)'
-                                old_match = re.search(pattern, st.session_state.all_test_cases_str_before_edit, re.DOTALL)
-                                if old_match:
-                                    st.code(old_match.group(1).strip(), language="markdown")
-                            with col2:
-                                st.markdown("**After:**")
-                                st.code(cleaned, language="markdown")
-                    
-                    # st.rerun()
-                else:
-                    st.error("❌ Could not extract a valid test case block from the AI response.")
-                    st.info("Check the raw LLM output above to see what the AI returned.")
-                    status.update(label="⚠️ Edit failed - check raw output", state="error")
+        job_state = snapshot_job_state()
+        job_state.edit_id = edit_id.strip()
+        st.session_state.last_edit_result = None
+        active_job = submit_session_job("edit_generation", functools.partial(run_edit_generation, edit_id.strip(), edit_prompt), job_state)
+
+if fill_gaps_button and gap_types and not session_job_running():
+    st.session_state.last_edit_result = None
+    active_job = submit_session_job("coverage_fill", functools.partial(run_fill_gaps, list(gap_types)))
+
+if automate_button and not session_job_running():
+    active_job = submit_session_job("automation_run", run_automation)
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS)
+def render_active_job():
+    """Polls the session's running job; once it finishes, applies its results and reruns the page."""
+    job_id = st.session_state.get("active_job_id")
+    job = get_job_manager().get(job_id) if job_id else None
+    if job is None:
+        return
+    if job.done:
+        collect_finished_job(job)
+        st.rerun()
 
-            except Exception as e:
-                st.error(f"❌ Unexpected error during edit: {e}")
-                import traceback
-                with st.expander("🐛 Full Error Traceback", expanded=True):
-                    st.code(traceback.format_exc())
-                status.update(label="❌ Edit failed", state="error")
+    stats = get_job_manager().stats()
+    with st.status(f"{JOB_KIND_LABELS.get(job.kind, job.kind)}: {job.progress.label}", expanded=True, state="running"):
+        st.caption(
+            f"Job {job.job_id} · {job.status} · {stats['running']}/{stats['max_concurrency']} jobs running, "
+            f"{stats['queued']} queued"
+        )
+        for level, message in job.messages[-15:]:
+            getattr(st, level)(message)
+        # Partial results become visible as soon as their step finishes
+        if job.state.refined_instruction and job.kind == "initial_generation":
+            with st.expander("Step 1: Refined Instruction (ready)", expanded=False):
+                st.markdown(job.state.refined_instruction)
+        if job.state.locator_recommendations and job.kind == "initial_generation":
+            with st.expander("Step 2: Site Insights & Locator Recommendations (ready)", expanded=False):
+                st.markdown(job.state.locator_recommendations)
+        if st.button("✖ Cancel job", key=f"cancel_{job.job_id}", disabled=job.cancel_requested):
+            get_job_manager().cancel(job.job_id)
+
+
+if st.session_state.active_job_id:
+    render_active_job()
+
+if st.session_state.last_job_report:
+    report = st.session_state.last_job_report
+    label = JOB_KIND_LABELS.get(report["kind"], report["kind"])
+    if report["status"] == "succeeded":
+        st.success(f"✅ {label} finished in {report['duration_s']}s")
+    elif report["status"] == "cancelled":
+        st.warning(f"✖ {label} was cancelled after {report['duration_s']}s")
+    else:
+        st.error(f"{label} failed: {report['error']}")
+    with st.expander("Job log", expanded=report["status"] == "failed"):
+        for level, message in report["messages"]:
+            getattr(st, level)(message)
+
+if st.session_state.last_edit_result:
+    edit = st.session_state.last_edit_result
+    if edit["updated"]:
+        st.success(f"Test case **{edit['test_case_id']}** has been updated!")
+        with st.expander("📊 Before/After Comparison", expanded=False):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("**Before:**")
+                st.code(edit["original"], language="markdown")
+            with col2:
+                st.markdown("**After:**")
+                st.code(edit["updated"], language="markdown")
+                st.caption(f"Updated length: {len(edit['updated'])} characters")
+    else:
+        st.error(f"❌ Could not update test case {edit['test_case_id']}. Check the job log above for details.")
 
 # --- Display Results ---
 with output_container:
@@ -1006,25 +4073,143 @@ with output_container:
         with st.expander("Step 2: Site Insights & Locator Recommendations", expanded=False):
             st.markdown(st.session_state.locator_recommendations)
 
+    if st.session_state.crawl_report and st.session_state.crawl_report.get("pages"):
+        with st.expander("Crawl Report: Fetch Path per Page", expanded=False):
+            summary = summarize_crawl_report(st.session_state.crawl_report["pages"])
+            st.caption(
+                f"{summary['pages']} pages crawled — {summary['http_pages']} over HTTP, "
+                f"{summary['browser_pages']} in the browser, ~{summary['latency_saved_ms'] / 1000:.1f}s saved by the HTTP fast path"
+            )
+            changes = st.session_state.crawl_report.get("changes") or {}
+            if st.session_state.crawl_report.get("had_previous_crawl") and changes:
+                st.caption(
+                    "Changes since the last crawl: " + ", ".join(f"{len(changes.get(kind, []))} {kind}" for kind in CHANGE_KINDS)
+                    + " — unchanged pages reused their stored artifacts and insights"
+                    + ("; the site recommendations were reused as well" if st.session_state.crawl_report.get("recommendations_reused") else "")
+                )
+                changed_rows = [{"change": kind, "url": url} for kind in ("new", "changed", "removed") for url in changes.get(kind, [])]
+                if changed_rows:
+                    st.dataframe(pd.DataFrame(changed_rows), use_container_width=True, hide_index=True)
+            clusters = st.session_state.crawl_report.get("clusters", [])
+            if clusters:
+                clustered_pages = sum(cluster["pages"] for cluster in clusters)
+                st.caption(
+                    f"{len(clusters)} page templates across {clustered_pages} pages — "
+                    f"{clustered_pages - len(clusters)} same-layout pages were not analyzed again"
+                )
+                st.dataframe(pd.DataFrame(clusters), use_container_width=True, hide_index=True)
+            insights_cache = st.session_state.crawl_report.get("insights_cache")
+            if insights_cache:
+                st.caption(
+                    f"Site insights cache: {insights_cache['reused']}/{insights_cache['pages']} pages reused "
+                    f"({insights_cache['reuse_ratio']:.0%}), ~{insights_cache['tokens_saved']} tokens and "
+                    f"~{insights_cache['latency_saved_ms'] / 1000:.1f}s of LLM time saved"
+                )
+            if len(st.session_state.crawl_report.get("sites", [])) > 1:
+                st.markdown("**Sites**")
+                st.dataframe(pd.DataFrame(st.session_state.crawl_report["sites"]), use_container_width=True, hide_index=True)
+            st.dataframe(pd.DataFrame(st.session_state.crawl_report["pages"]), use_container_width=True)
+
+    if st.session_state.last_run_metrics:
+        metrics = st.session_state.last_run_metrics
+        with st.expander(f"📈 Run Metrics: {metrics['run_name']} ({metrics['duration_ms'] / 1000:.1f}s)", expanded=False):
+            tokens = metrics["tokens"]
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Wall time", f"{metrics['duration_ms'] / 1000:.1f}s")
+            col2.metric("LLM calls", tokens["llm_calls"])
+            col3.metric("Prompt tokens", tokens["prompt_tokens"])
+            col4.metric("Completion tokens", tokens["completion_tokens"])
+            if metrics["counters"]:
+                st.caption(" · ".join(f"{name}: {value:g}" for name, value in metrics["counters"].items()))
+            st.markdown("**Critical path**")
+            critical_path = pd.DataFrame(metrics["critical_path"])
+            if not critical_path.empty:
+                critical_path["stage"] = critical_path.apply(lambda row: " " * row["depth"] + row["stage"], axis=1)
+                st.dataframe(critical_path.drop(columns=["depth"]), use_container_width=True, hide_index=True)
+            profile_rows = get_profile_stats().table(baseline_system_chars=len(planner.system_message))
+            if profile_rows:
+                st.markdown("**Agent profiles (since server start)**")
+                st.dataframe(pd.DataFrame(profile_rows), use_container_width=True, hide_index=True)
+            st.markdown("**Model routing (since server start)**")
+            router = get_model_router()
+            st.caption(" · ".join(f"{stage} → {router.tier_for(stage)}" for stage in router.stage_tiers))
+            st.dataframe(pd.DataFrame(router.snapshot()), use_container_width=True, hide_index=True)
+            scheduler_stats = get_llm_scheduler().snapshot()
+            st.markdown("**LLM scheduler (since server start)**")
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Queue depth", scheduler_stats["queue_depth"], help=f"max {scheduler_stats['max_queue_depth']}")
+            col2.metric("Wait p50 / p95", f"{scheduler_stats['wait_p50_ms'] / 1000:.1f}s / {scheduler_stats['wait_p95_ms'] / 1000:.1f}s")
+            col3.metric("429s", scheduler_stats["rate_limited"], help=f"{scheduler_stats['retries']} retried, {scheduler_stats['gave_up']} gave up")
+            col4.metric("Budget", f"{scheduler_stats['rpm_limit'] or '∞'} RPM / {scheduler_stats['tpm_limit'] or '∞'} TPM")
+            if scheduler_stats["paused_models"]:
+                st.caption("Paused: " + ", ".join(f"{model} ({seconds}s)" for model, seconds in scheduler_stats["paused_models"].items()))
+            st.markdown("**All spans**")
+            st.dataframe(pd.DataFrame(metrics["spans"]), use_container_width=True, hide_index=True)
+            st.download_button(
+                label="Download metrics (JSON)",
+                data=json.dumps(metrics, indent=2),
+                file_name=f"{metrics['run_id']}.json",
+                mime="application/json"
+            )
+            if metrics.get("exports"):
+                st.caption(f"Exported to {metrics['exports']['json']} and {metrics['exports']['prometheus']}")
+
     if st.session_state.all_test_cases_str:
         st.header("Step 3: Cumulative Generated Test Cases")
         
+        records = st.session_state.get("test_cases_list") or []
+        digest = st.session_state.test_cases_digest
+
         # Add the download button
-        try:
-            with open("cleaned_generated_test_cases.xlsx", "rb") as fp:
+        if records:
+            st.download_button(
+                label="📥 Download All Test Cases (Excel)",
+                data=cached_testcases_workbook(digest, records),
+                file_name="generated_test_cases.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
+        else:
+            st.error("No test cases could be parsed from the planner output. Please try generating again.")
+        
+        if st.session_state.automation_report:
+            automation = st.session_state.automation_report
+            with st.expander("🧪 Automation Results", expanded=True):
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Passed", automation["summary"]["passed"])
+                col2.metric("Flaky", automation["summary"]["flaky"])
+                col3.metric("Failed", automation["summary"]["failed"])
+                col4.metric("Errored", automation["summary"]["error"])
+                st.dataframe(pd.DataFrame(automation["results"]), use_container_width=True, hide_index=True)
+                scripts_zip = io.BytesIO()
+                with zipfile.ZipFile(scripts_zip, "w", zipfile.ZIP_DEFLATED) as archive:
+                    for path in automation["scripts"].values():
+                        if os.path.exists(path):
+                            archive.write(path, os.path.basename(path))
                 st.download_button(
-                    label="📥 Download All Test Cases (Excel)",
-                    data=fp,
-                    file_name="generated_test_cases.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
+                    label="📥 Download Playwright Scripts (zip)",
+                    data=scripts_zip.getvalue(),
+                    file_name="playwright_tests.zip",
+                    mime="application/zip"
                 )
-        except FileNotFoundError:
-            st.error("Excel file ('cleaned_generated_test_cases.xlsx') not found. Please try generating again.")
-        
-        # Display the raw test cases
 
-        st.markdown(st.session_state.all_test_cases_str)
+        if records:
+            with st.expander("📊 Coverage Matrix (High Level Feature × Testing Type)", expanded=False):
+                coverage_priority = st.radio("Priority", ["All"] + COVERAGE_PRIORITIES, horizontal=True, key="coverage_priority")
+                st.dataframe(coverage_frame(digest, coverage_priority, records), use_container_width=True)
+                gaps = coverage_gaps(records, st.session_state.get("gap_types_input") or COVERAGE_DEFAULT_TYPES)
+                overfilled = coverage_overfilled(records)
+                st.caption(f"{len(gaps)} empty cells for the selected testing types" + (
+                    ": " + ", ".join(f"{feature} × {testing_type}" for feature, testing_type in gaps[:10]) + (" ..." if len(gaps) > 10 else "")
+                    if gaps else ""))
+                if overfilled:
+                    st.caption("Overfilled: " + ", ".join(f"{feature} × {testing_type}" for feature, testing_type in overfilled[:10]))
+            render_results_view(records, digest)
+            if st.toggle("Show raw planner output", key="show_raw_output"):
+                st.markdown(st.session_state.all_test_cases_str)
+        else:
+            # Nothing parsed: the raw output is all there is to show
+            st.markdown(st.session_state.all_test_cases_str)
 
 
 
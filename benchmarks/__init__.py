@@ -0,0 +1 @@
+"""Offline benchmark harness: a fake Groq chat-completions server, a local test site and scenario runners."""
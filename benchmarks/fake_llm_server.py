@@ -0,0 +1,183 @@
+"""Local stand-in for the Groq chat-completions API.
+
+Serves ``POST /openai/v1/chat/completions`` (the path the Groq SDK calls) with configurable latency and
+generation speed, and recognises each agent of ``app.py`` by its system prompt so it can answer with
+canned outputs in the format the app expects (planner test cases, site insights, field edits, ...).
+
+Run standalone with ``python -m benchmarks.fake_llm_server --port 8780 --planner-cases 25`` and point the
+app at it with ``groq_base_url = "http://127.0.0.1:8780"`` in ``.streamlit/secrets.toml``.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TESTING_TYPES = ["Functional", "Negative", "Boundary", "Security", "Usability", "Regression", "Smoke", "End-to-End"]
+PRIORITIES = ["High", "Medium", "Low"]
+FEATURES = ["Login", "Search", "Items", "Profile", "Contact"]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def canned_test_case(number: int) -> str:
+    feature = FEATURES[number % len(FEATURES)]
+    testing_type = TESTING_TYPES[number % len(TESTING_TYPES)]
+    return (
+        f"{number}. **{feature}**\n"
+        f"* Test Case ID: TC-{number}\n"
+        f"* High Level Feature: {feature}\n"
+        f"* Feature Name: {feature} scenario {number}\n"
+        f"* Test Scenario: Verify {feature.lower()} behaves as expected ({testing_type.lower()})\n"
+        f"* Test Case: {feature} {testing_type.lower()} check {number}\n"
+        f"* Test Case Description: Validates the {feature.lower()} flow for variation {number}.\n"
+        f"* Step-by-step actions: Navigate to the login page, sign in with valid credentials, open the {feature.lower()} page, "
+        f"perform the {testing_type.lower()} action for variation {number} and assert the visible outcome.\n"
+        f"* Possible Values: value-{number}\n"
+        f"* Sources: N/A\n"
+        f"* Expected Result: The {feature.lower()} page shows the expected outcome for variation {number}.\n"
+        f"* Data Correctness Checked: N/A\n"
+        f"* Release/Platform Version: Web\n"
+        f"* Automation Possibility: Yes\n"
+        f"* Testing Type: {testing_type}\n"
+        f"* Priority: {PRIORITIES[number % len(PRIORITIES)]}\n"
+        f"* Testing Phase: QA\n"
+    )
+
+
+def canned_planner_output(cases: int, first_number: int = 1) -> str:
+    return "## Functional Test Cases\n\n" + "\n".join(canned_test_case(n) for n in range(first_number, first_number + cases))
+
+
+def canned_planner_json(cases: int, first_number: int = 1) -> str:
+    """The same canned cases as objects, for the planner's JSON output mode."""
+    test_cases = []
+    for number in range(first_number, first_number + cases):
+        fields = {}
+        for line in canned_test_case(number).splitlines()[1:]:
+            key, _, value = line[2:].partition(": ")
+            fields[key] = value
+        test_cases.append(fields)
+    return json.dumps({"test_cases": test_cases})
+
+
+class FakeLLMConfig:
+    """Mutable knobs read on every request, so scenarios can change them between runs."""
+    def __init__(self, latency_ms: float = 200.0, tokens_per_sec: float = 500.0, planner_cases: int = 10):
+        self.latency_ms = latency_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.planner_cases = planner_cases
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def canned_reply(config: FakeLLMConfig, system: str, user: str, json_mode: bool = False) -> str:
+    """Picks a canned answer based on which agent of app.py is calling."""
+    system_lower = system.lower()
+    if "expert qa test planner" in system_lower:
+        planner_output = canned_planner_json if json_mode else canned_planner_output
+        if "exactly one feature" in system_lower:
+            return canned_planner_json(2)
+        if "continue numbering" in user.lower():
+            return planner_output(max(1, config.planner_cases // 2), first_number=config.planner_cases + 1)
+        return planner_output(config.planner_cases)
+    if "site inspector" in system_lower:
+        return (
+            "Site Insights and Recommended Locators: \n"
+            "- Site Structure: login, dashboard with search panel, item list and item detail pages.\n"
+            "- Discovered Test Scenarios: login (valid/invalid), search, item navigation, contact form validation.\n"
+            "- Recommended Locators: #userNameInput, #passwordInput, #submitButton, role=search, role=link[name=/Item/]."
+        )
+    if "senior test automation engineer" in system_lower:
+        return (
+            "async def run_test(page, base_url, credentials):\n"
+            "    await page.goto(base_url.rstrip('/') + '/dashboard')\n"
+            "    await expect(page.locator('body')).to_be_visible()\n"
+        )
+    prompt_lower = (system + "\n" + user).lower()
+    if "return only the exact field name" in prompt_lower:
+        return "Expected Result"
+    if "strict qa editor" in prompt_lower:
+        return "The page shows the updated expected outcome and no duplicate suggestions."
+    return "Navigate to the start URL, log in with the provided credentials and verify the dashboard is visible."
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    config: FakeLLMConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = body.get("messages", [])
+        system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+        with self.config.lock:
+            self.config.requests += 1
+
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = canned_reply(self.config, system, user, json_mode)
+        prompt_tokens = estimate_tokens(system + user)
+        completion_tokens = estimate_tokens(content)
+        time.sleep(self.config.latency_ms / 1000 + completion_tokens / max(self.config.tokens_per_sec, 1e-6))
+
+        payload = json.dumps({
+            "id": f"chatcmpl-bench-{self.config.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "bench-model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeLLMServer:
+    """Runs the fake chat-completions API on a background thread."""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: FakeLLMConfig = None):
+        self.config = config or FakeLLMConfig()
+        handler = type("BoundFakeLLMHandler", (FakeLLMHandler,), {"config": self.config})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=500.0)
+    parser.add_argument("--planner-cases", type=int, default=10)
+    args = parser.parse_args()
+    server = FakeLLMServer(port=args.port, config=FakeLLMConfig(args.latency_ms, args.tokens_per_sec, args.planner_cases)).start()
+    print(f"Fake Groq API listening on {server.base_url}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
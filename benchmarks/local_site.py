@@ -0,0 +1,188 @@
+"""Local multi-page test website for crawl benchmarks.
+
+The login form uses the selectors ``crawl_site`` looks for first (``#userNameInput``, ``#passwordInput``,
+``#submitButton``) and the post-login dashboard exposes ``.search-panel``. Besides server-rendered pages
+(dashboard, item list, ``/item/<n>`` detail pages sharing one template, contact form) it serves a
+client-rendered ``/app`` shell and a ``/sitemap.xml``, so both fetch paths of the crawler are exercised.
+
+Run standalone with ``python -m benchmarks.local_site --port 8765 --items 50``.
+"""
+import argparse
+import hashlib
+import html
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+USERNAME = "bench@example.com"
+PASSWORD = "bench-password"
+SESSION_COOKIE = "bench_session"
+
+PAGE_TEMPLATE = """<!doctype html>
+<html><head><title>{title}</title></head>
+<body>
+<nav><a href="/dashboard">Dashboard</a> <a href="/items">Items</a> <a href="/contact">Contact</a> <a href="/app">App</a> <a href="/logout">Log out</a></nav>
+<main>
+<h1>{title}</h1>
+{body}
+</main>
+<footer><p>Benchmark site footer text that gives every server-rendered page a realistic amount of static content,
+so the crawler's static-page heuristics see a normal document rather than an empty shell.</p></footer>
+</body></html>
+"""
+
+LOGIN_PAGE = """<!doctype html>
+<html><head><title>Sign in</title></head>
+<body>
+<h1>Sign in</h1>
+{error}
+<form method="post" action="/login">
+  <label for="userNameInput">Email</label>
+  <input id="userNameInput" name="email" type="email" placeholder="Email">
+  <label for="passwordInput">Password</label>
+  <input id="passwordInput" name="password" type="password" placeholder="Password">
+  <button id="submitButton" type="submit">Sign In</button>
+</form>
+</body></html>
+"""
+
+SPA_SHELL = """<!doctype html>
+<html><head><title>App</title></head>
+<body><div id="root"></div>
+<noscript>You need to enable JavaScript to run this app.</noscript>
+<script>
+document.getElementById('root').innerHTML =
+  '<h1>Client app</h1><button id="refresh">Refresh</button><a href="/items">Back to items</a>';
+</script>
+</body></html>
+"""
+
+
+class LocalSiteHandler(BaseHTTPRequestHandler):
+    items = 20
+    sessions = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str = "", content_type: str = "text/html; charset=utf-8", headers: dict = None):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _redirect(self, location: str, headers: dict = None):
+        self._send(303, "", headers={"Location": location, **(headers or {})})
+
+    def _logged_in(self) -> bool:
+        for part in self.headers.get("Cookie", "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == SESSION_COOKIE and value in self.sessions:
+                return True
+        return False
+
+    def _page(self, title: str, body: str):
+        """Sends a server-rendered page with an ETag, answering a matching If-None-Match with 304."""
+        page = PAGE_TEMPLATE.format(title=html.escape(title), body=body)
+        etag = '"' + hashlib.sha1(page.encode("utf-8")).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._send(200, page, headers={"ETag": etag})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path in ("/", "/login"):
+            self._send(200, LOGIN_PAGE.format(error=""))
+        elif path == "/sitemap.xml":
+            base = f"http://{self.headers.get('Host')}"
+            locs = ["/dashboard", "/items", "/contact", "/app"] + [f"/item/{n}" for n in range(1, self.items + 1)]
+            body = "".join(f"<url><loc>{base}{loc}</loc></url>" for loc in locs)
+            self._send(200, f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{body}</urlset>', "application/xml")
+        elif not self._logged_in():
+            self._redirect("/login")
+        elif path == "/logout":
+            self._redirect("/login", {"Set-Cookie": f"{SESSION_COOKIE}=; Max-Age=0; Path=/"})
+        elif path == "/dashboard":
+            self._page("Dashboard", '<div class="search-panel" role="search"><input id="search" name="q" placeholder="Search items">'
+                                    '<button id="searchButton">Search</button></div><p>Welcome back. Use the search panel to find items.</p>')
+        elif path == "/items":
+            links = "".join(f'<li><a href="/item/{n}">Item {n}</a></li>' for n in range(1, self.items + 1))
+            self._page("Items", f'<ul class="item-list">{links}</ul>')
+        elif path.startswith("/item/") and path[len("/item/"):].isdigit() and 1 <= int(path[len("/item/"):]) <= self.items:
+            n = int(path[len("/item/"):])
+            self._page(f"Item {n}", f'<article class="item-detail"><h2>Item {n}</h2><p>Description of item {n}.</p>'
+                                    f'<button class="add-to-cart" data-id="{n}">Add to cart</button>'
+                                    f'<a href="/items">Back to items</a></article>')
+        elif path == "/contact":
+            self._page("Contact", '<form id="contactForm" method="post" action="/contact"><input name="name" required>'
+                                  '<input name="email" type="email" required><textarea name="message"></textarea>'
+                                  '<button type="submit">Send</button></form>')
+        elif path == "/app":
+            self._send(200, SPA_SHELL)
+        else:
+            self._send(404, PAGE_TEMPLATE.format(title="Not found", body="<p>Page not found.</p>"))
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        if path == "/login":
+            if form.get("email", [""])[0] == USERNAME and form.get("password", [""])[0] == PASSWORD:
+                token = uuid.uuid4().hex
+                self.sessions.add(token)
+                self._redirect("/dashboard", {"Set-Cookie": f"{SESSION_COOKIE}={token}; Path=/; HttpOnly"})
+            else:
+                self._send(401, LOGIN_PAGE.format(error='<div role="alert">Invalid credentials</div>'))
+        elif path == "/contact" and self._logged_in():
+            self._page("Contact", "<p>Thanks, your message was sent.</p>")
+        else:
+            self._send(404, "")
+
+
+class LocalTestSite:
+    """Runs the test site on a background thread."""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, items: int = 20):
+        handler = type("BoundLocalSiteHandler", (LocalSiteHandler,), {"items": items, "sessions": set()})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def login_url(self) -> str:
+        return self.base_url + "/login"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--items", type=int, default=20)
+    args = parser.parse_args()
+    site = LocalTestSite(port=args.port, items=args.items).start()
+    print(f"Local test site on {site.login_url} (username={USERNAME!r}, password={PASSWORD!r})")
+    try:
+        site.thread.join()
+    except KeyboardInterrupt:
+        site.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""End-to-end pipeline benchmarks that run fully offline.
+
+Starts the fake Groq server and the local test site, then drives ``app.py`` through Streamlit's
+``AppTest`` harness exactly like a user would (submitting each run as a background job and polling until it
+finishes): initial generation (cold, then warm), feedback and edit,
+for a small and a very large suite. Parse and export are timed through the spans each run records
+(see ``RunTrace``). Results are written to ``benchmarks/results/<timestamp>-<commit>.json``.
+
+Usage::
+
+    python -m benchmarks.run_benchmarks                       # small + large suites
+    python -m benchmarks.run_benchmarks --suites small --latency-ms 50
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<baseline>.json --fail-on-regression
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fake_llm_server import FakeLLMConfig, FakeLLMServer
+from benchmarks.local_site import PASSWORD, USERNAME, LocalTestSite
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+SUITES = {"small": 10, "large": 400}
+STAGES = ("refine", "inspect", "crawl", "login", "plan", "parse", "export", "detect_field", "rewrite_field")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def new_app(llm: FakeLLMServer, timeout: float):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    app.secrets["groq_api_key"] = "offline-benchmark"
+    app.secrets["groq_default_model"] = "bench-model"
+    app.secrets["groq_base_url"] = llm.base_url
+    app.run()
+    return app
+
+
+def click(app, label_prefix: str):
+    button = next(b for b in app.button if b.label.startswith(label_prefix))
+    button.click()
+
+
+def stage_durations(metrics: dict) -> dict:
+    durations = {}
+    for span in (metrics or {}).get("spans", []):
+        if span["name"] in STAGES:
+            durations[span["name"]] = round(durations.get(span["name"], 0.0) + span["duration_ms"], 1)
+    return durations
+
+
+def wait_for_job(app, timeout: float):
+    """Reruns the script until the session's background job has finished and been applied."""
+    deadline = time.monotonic() + timeout
+    while app.session_state["active_job_id"] and time.monotonic() < deadline:
+        time.sleep(0.1)
+        app.run()
+
+
+def run_scenario(app, name: str, action, timeout: float) -> dict:
+    started = time.perf_counter()
+    action()
+    app.run()
+    wait_for_job(app, timeout)
+    wall_ms = (time.perf_counter() - started) * 1000
+    errors = [e.value for e in app.error]
+    metrics = app.session_state["last_run_metrics"] if "last_run_metrics" in app.session_state else None
+    cases = app.session_state["test_cases_list"] if "test_cases_list" in app.session_state else []
+    result = {
+        "scenario": name,
+        "wall_ms": round(wall_ms, 1),
+        "stages_ms": stage_durations(metrics),
+        "tokens": (metrics or {}).get("tokens", {}),
+        "cases_parsed": len(cases),
+        "errors": errors,
+    }
+    print(f"  {name:<24} {result['wall_ms']:>10.1f} ms  cases={result['cases_parsed']:<5} stages={result['stages_ms']}")
+    return result
+
+
+def run_suite(suite: str, cases: int, args) -> list:
+    config = FakeLLMConfig(latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec, planner_cases=cases)
+    llm = FakeLLMServer(config=config).start()
+    site = LocalTestSite(items=args.items).start()
+    prompt = (f"Test the login flow at {site.login_url} with username='{USERNAME}' and password='{PASSWORD}'. "
+              f"Verify successful login by checking for the search panel, then search and open an item.")
+    results = []
+    try:
+        app = new_app(llm, args.timeout)
+
+        def generate():
+            app.text_area(key="user_prompt_input").input(prompt)
+            click(app, "🚀")
+
+        def feedback():
+            app.text_area(key="feedback_input").input("Add negative tests for the contact form.")
+            click(app, "🔄")
+
+        def edit():
+            app.text_input(key="edit_id_input").input("TC-2")
+            app.text_area(key="edit_prompt_input").input("Update TC-2: also verify no duplicate suggestions are shown.")
+            click(app, "Update Test Case")
+
+        print(f"[{suite}] {cases} planner cases, {args.latency_ms} ms latency, {args.tokens_per_sec} tok/s")
+        results.append(run_scenario(app, f"{suite}:generation_cold", generate, args.timeout))
+        results.append(run_scenario(app, f"{suite}:generation_warm", generate, args.timeout))
+        results.append(run_scenario(app, f"{suite}:feedback", feedback, args.timeout))
+        results.append(run_scenario(app, f"{suite}:edit", edit, args.timeout))
+    finally:
+        site.stop()
+        llm.stop()
+    return results
+
+
+def compare(current: dict, baseline_path: str, threshold: float) -> list:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\nComparison against {baseline_path} (threshold {threshold:.0%}):")
+    for result in current["results"]:
+        before = baseline.get(result["scenario"])
+        if not before or not before["wall_ms"]:
+            continue
+        delta = (result["wall_ms"] - before["wall_ms"]) / before["wall_ms"]
+        flag = "REGRESSION" if delta > threshold else ""
+        print(f"  {result['scenario']:<24} {before['wall_ms']:>10.1f} -> {result['wall_ms']:>10.1f} ms ({delta:+.1%}) {flag}")
+        if flag:
+            regressions.append(result["scenario"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmarks for app.py")
+    parser.add_argument("--suites", nargs="+", choices=sorted(SUITES), default=["small", "large"])
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Fake LLM time to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=2000.0, help="Fake LLM generation speed")
+    parser.add_argument("--items", type=int, default=20, help="Detail pages on the local site")
+    parser.add_argument("--timeout", type=float, default=900.0, help="Per-run AppTest timeout in seconds")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    # The app writes its Excel export and caches to the working directory; keep those out of the repo.
+    workdir = tempfile.mkdtemp(prefix="qa-bench-")
+    os.chdir(workdir)
+
+    results = []
+    for suite in args.suites:
+        results.extend(run_suite(suite, SUITES[suite], args))
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("compare", "fail_on_regression")},
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out_path = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {out_path}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Tests for ``app.py``: a smoke run through Streamlit's ``AppTest`` harness plus checks of standalone helpers."""
+import ast
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from html.parser import HTMLParser
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def new_app() -> AppTest:
+    app = AppTest.from_file(APP_PATH, default_timeout=60)
+    app.secrets["groq_api_key"] = "offline-test"
+    app.secrets["groq_default_model"] = "test-model"
+    return app
+
+
+def app_definitions(*names: str) -> dict:
+    """Executes only the named top-level definitions of app.py, in file order.
+
+    Importing the script would run the whole Streamlit page, so helpers are tested in isolation.
+    """
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    nodes = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.name in names:
+            nodes.append(node)
+        elif isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id in names for t in node.targets):
+            nodes.append(node)
+    namespace = {
+        "ast": ast, "asyncio": asyncio, "hashlib": hashlib, "json": json, "re": re, "threading": threading, "time": time,
+        "deque": deque, "HTMLParser": HTMLParser, "urlparse": urlparse,
+    }
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), APP_PATH, "exec"), namespace)
+    return namespace
+
+
+def test_app_starts_without_exception():
+    app = new_app()
+    app.run()
+    assert not app.exception
+    assert app.session_state["active_job_id"] is None
+
+
+SHARED_LAYOUT = """<!doctype html>
+<html><head><title>{title}</title></head>
+<body>
+<header class="site-header"><nav class="mega-menu"><ul>{nav}</ul></nav></header>
+<main><h1>{title}</h1>{body}</main>
+<footer><p>Footer text</p></footer>
+</body></html>
+"""
+# A 64-link mega menu: on its own it makes every page's skeleton look alike
+NAV = "".join(
+    f'<li class="menu-group"><span class="menu-title">Group {group}</span><ul class="submenu">'
+    + "".join(f'<li class="submenu-item"><a class="menu-link" href="/section/{group}/{n}"><span class="icon icon-{n % 4}"></span>Link {n}</a></li>'
+              for n in range(8))
+    + '</ul></li>'
+    for group in range(8)
+)
+PAGE_BODIES = {
+    "/dashboard": '<div class="search-panel" role="search"><input id="search" name="q"><button id="searchButton">Search</button></div>'
+                  '<p>Welcome back.</p>',
+    "/item/1": '<article class="item-detail"><h2>Item 1</h2><p>Description.</p><button class="add-to-cart">Add to cart</button>'
+               '<a href="/items">Back to items</a></article>',
+    "/item/2": '<article class="item-detail"><h2>Item 2</h2><p>Other description.</p><button class="add-to-cart">Add to cart</button>'
+               '<a href="/items">Back to items</a></article>',
+    "/contact": '<form id="contactForm" method="post"><input name="name"><input name="email" type="email"><textarea name="message">'
+                '</textarea><button type="submit">Send</button></form>',
+}
+
+
+def test_distinct_forms_on_shared_layout_stay_in_separate_clusters():
+    helpers = app_definitions(
+        "INTERACTIVE_TAGS", "INVENTORY_ATTRIBUTES", "LAYOUT_CHROME_TAGS", "StaticPageScanner", "scan_static_page",
+        "TEMPLATE_SIMHASH_THRESHOLD", "ID_SEGMENT_PATTERN", "url_template", "simhash", "hamming_distance", "TemplateClusterer",
+    )
+    clusterer = helpers["TemplateClusterer"]()
+    templates = {}
+    for path, body in PAGE_BODIES.items():
+        scanner = helpers["scan_static_page"](SHARED_LAYOUT.format(title=path, nav=NAV, body=body))
+        templates[path] = clusterer.assign("http://site.test" + path, scanner.skeleton)[0]["template"]
+    assert len({templates["/dashboard"], templates["/item/1"], templates["/contact"]}) == 3
+    assert templates["/item/1"] == templates["/item/2"]
+
+
+SAFE_RUN_TEST = """async def run_test(page, base_url, credentials):
+    await page.goto(base_url.rstrip('/') + '/login')
+    await page.get_by_label('Email').fill(credentials['username'])
+    for attempt in range(2):
+        await page.wait_for_timeout(100 * attempt)
+    await expect(page.locator('.search-panel')).to_be_visible()
+"""
+
+
+@pytest.mark.parametrize("code", [
+    "import os\n" + SAFE_RUN_TEST,
+    SAFE_RUN_TEST + "    import subprocess\n",
+    SAFE_RUN_TEST + "    print(os.environ)\n",
+    SAFE_RUN_TEST + "    time.sleep(60)\n",
+    SAFE_RUN_TEST + "    open('/etc/passwd')\n",
+    SAFE_RUN_TEST + "    page.__class__.__init__.__globals__\n",
+    SAFE_RUN_TEST + "    __import__('os')\n",
+    SAFE_RUN_TEST + "print('module level')\n",
+    SAFE_RUN_TEST + "    await page.context.browser.browser_type.launch(executable_path='/bin/sh')\n",
+    SAFE_RUN_TEST + "    await page.screenshot(path='/root/.bashrc')\n",
+    SAFE_RUN_TEST + "    await page.add_script_tag(path='.streamlit/secrets.toml')\n",
+    SAFE_RUN_TEST + "    await page.locator('input').set_input_files('/etc/passwd')\n",
+    SAFE_RUN_TEST + "    await page.screenshot(**{'path': 'out.png'})\n",
+    SAFE_RUN_TEST + "    await page.request.get('http://169.254.169.254/')\n",
+    SAFE_RUN_TEST + "    print('{0.__class__.__mro__}'.format(page))\n",
+    SAFE_RUN_TEST + "    print(str.format_map('{p.__class__}', {'p': page}))\n",
+])
+def test_generated_scripts_outside_playwright_are_rejected(code):
+    helpers = app_definitions(
+        "SCRIPT_ALLOWED_GLOBALS", "SCRIPT_ALLOWED_BUILTINS", "SCRIPT_BLOCKED_ATTRIBUTES", "SCRIPT_BLOCKED_KEYWORDS", "validate_run_test",
+    )
+    helpers["validate_run_test"](SAFE_RUN_TEST)
+    with pytest.raises(ValueError):
+        helpers["validate_run_test"](code)
+
+
+def test_previously_crawled_pages_are_retired_only_when_proven_gone():
+    helpers = app_definitions("GONE_STATUS_CODES", "page_gone", "unreached_removed_urls")
+    previous = {"http://site.test/": {}, "http://site.test/old": {}, "http://site.test/listed": {}}
+    visited = {"http://site.test/"}
+    sitemap = ["http://site.test/listed"]
+    # A crawl cut short by its budget says nothing about the pages it never reached
+    assert helpers["unreached_removed_urls"](previous, visited, ["http://site.test/next"], sitemap, False) == []
+    assert helpers["unreached_removed_urls"](previous, visited, ["http://site.test/next"], sitemap, True) == []
+    # A drained frontier proves it: only pages neither linked nor in the sitemap are gone
+    assert helpers["unreached_removed_urls"](previous, visited, [], sitemap, True) == ["http://site.test/old"]
+
+    not_found = SimpleNamespace(status_code=404)
+    assert helpers["page_gone"]({"content_hash": "abc"}, not_found)
+    assert not helpers["page_gone"](None, not_found)
+    assert not helpers["page_gone"]({"content_hash": "abc"}, SimpleNamespace(status_code=503))
+    assert not helpers["page_gone"]({"content_hash": "abc"}, None)
+
+
+def planner_json_helpers() -> dict:
+    return app_definitions(
+        "TESTCASE_FIELDS", "TESTCASE_RECORD_KEYS", "TESTCASE_FIELD_DEFAULTS", "TESTCASE_REQUIRED_FIELDS", "_field_key",
+        "TESTCASE_FIELD_LOOKUP", "JSON_ITEM_END", "TESTCASES_ARRAY_START", "scan_json_testcases", "normalize_testcase",
+    )
+
+
+def planner_case(number: int) -> dict:
+    return {"Test Case ID": f"TC-{number:03d}", "Test Case": f"Case {number}", "Step-by-step actions": "1. Open the page",
+            "Expected Result": "The page loads"}
+
+
+def test_json_reply_scan_starts_at_the_test_cases_array():
+    scan = planner_json_helpers()["scan_json_testcases"]
+    reply = '{"note": "see [docs]", "test_cases": [' + json.dumps(planner_case(1)) + ', {"Test Case": oops}]}'
+    items, fragments = scan(reply)
+    assert items == [planner_case(1)]
+    assert fragments == ['{"Test Case": oops}']
+
+
+def test_json_reply_scan_keeps_items_around_a_broken_one():
+    scan = planner_json_helpers()["scan_json_testcases"]
+    reply = "```json\n" + json.dumps({"test_cases": [planner_case(1), "BROKEN", planner_case(3)]}).replace('"BROKEN"', '{"Test Case": "x",}') + "\n```"
+    items, fragments = scan(reply)
+    assert items == [planner_case(1), planner_case(3)]
+    assert fragments == ['{"Test Case": "x",}']
+
+
+def test_truncated_json_reply_keeps_the_complete_items():
+    scan = planner_json_helpers()["scan_json_testcases"]
+    reply = json.dumps({"test_cases": [planner_case(1), planner_case(2)]})
+    items, fragments = scan(reply[:-30])
+    assert items == [planner_case(1)]
+    assert len(fragments) == 1 and fragments[0].startswith('{"Test Case ID": "TC-002"')
+
+
+def test_json_reply_tolerates_key_casing_drift():
+    helpers = planner_json_helpers()
+    drifted = {"test case id": "TC-007", "TEST_CASE": "Login", "step-by-step Actions": ["1. Open", "2. Submit"],
+               "expected_result": "Dashboard shown", "testingType": "Functional"}
+    items, fragments = helpers["scan_json_testcases"](json.dumps({"Test_Cases": [drifted]}))
+    assert items == [drifted] and fragments == []
+    items, _ = helpers["scan_json_testcases"](json.dumps({"Test_Cases": [drifted]})[:-2])
+    assert items == [drifted]
+    record, problem = helpers["normalize_testcase"](drifted, "TC-999")
+    assert problem is None
+    assert record["Test Case ID"] == "TC-007"
+    assert record["Step-by-step actions"] == "1. Open 2. Submit"
+    assert record["Testing_Type"] == "Functional"
+    assert record["Sources"] == "N/A"
+    assert helpers["normalize_testcase"]({"Test Case": "Login"}, "TC-1") == (None, "missing Step-by-step actions, Expected Result")
+
+
+def test_each_site_in_the_prompt_gets_its_own_credentials():
+    helpers = app_definitions("PROMPT_URL_PATTERN", "PROMPT_USERNAME_PATTERN", "PROMPT_PASSWORD_PATTERN", "extract_site_targets")
+    prompt = (
+        "Shared login username='team' password='shared'. Test https://shop.test/login, "
+        "then https://admin.test/login with username='admin' password='secret'. "
+        "Also check https://docs.test/start and https://shop.test/login again."
+    )
+    assert helpers["extract_site_targets"](prompt) == [
+        {"url": "https://shop.test/login", "username": "team", "password": "shared"},
+        {"url": "https://admin.test/login", "username": "admin", "password": "secret"},
+        {"url": "https://docs.test/start", "username": "team", "password": "shared"},
+    ]
+    assert helpers["extract_site_targets"]("Check https://one.test and nothing else") == [
+        {"url": "https://one.test", "username": None, "password": None},
+    ]
+    assert helpers["extract_site_targets"]("No site here") == []
+
+
+@pytest.mark.parametrize("lengths, budget, expected", [
+    ([100, 200, 300], 1000, [100, 200, 300]),
+    ([100, 5000, 5000], 1000, [100, 450, 450]),
+    ([900, 900], 1000, [500, 500]),
+    ([], 1000, []),
+])
+def test_fair_share_gives_short_sites_their_full_length(lengths, budget, expected):
+    allowances = app_definitions("fair_share")["fair_share"](lengths, budget)
+    assert allowances == expected
+    assert sum(allowances) <= budget
+
+
+def coverage_helpers() -> dict:
+    return app_definitions(
+        "_field_key", "COVERAGE_TESTING_TYPES", "COVERAGE_PRIORITIES", "COVERAGE_OVERFILL_FACTOR", "COVERAGE_TYPE_LOOKUP",
+        "testing_types_of", "coverage_counts", "coverage_gaps", "coverage_overfilled",
+    )
+
+
+def coverage_record(feature: str, testing_type: str, priority: str = "High") -> dict:
+    return {"High Level Feature": feature, "Testing_Type": testing_type, "Priority": priority}
+
+
+def test_coverage_gaps_lists_empty_cells_per_feature():
+    helpers = coverage_helpers()
+    records = [
+        coverage_record("Login", "Functional, Negative"),
+        coverage_record("Search", "functional"),
+        coverage_record("Login", "Security & Boundary", "Low"),
+    ]
+    assert helpers["coverage_gaps"](records, ["Functional", "Negative", "Usability"]) == [
+        ("Login", "Usability"), ("Search", "Negative"), ("Search", "Usability"),
+    ]
+    assert helpers["coverage_gaps"]([], ["Functional"]) == []
+
+
+def test_coverage_overfilled_flags_cells_far_above_the_average():
+    helpers = coverage_helpers()
+    records = [coverage_record("Login", "Functional")] * 12 + [
+        coverage_record(feature, testing_type)
+        for feature in ("Login", "Search", "Cart") for testing_type in ("Negative", "Boundary")
+    ]
+    assert helpers["coverage_overfilled"](records) == [("Login", "Functional")]
+    # A single case per cell is never overfilled, however uneven the suite
+    assert helpers["coverage_overfilled"]([coverage_record("Login", "Functional")]) == []
+    assert helpers["coverage_overfilled"]([]) == []
+
+
+def test_token_bucket_refills_continuously_up_to_capacity():
+    bucket = app_definitions("TokenBucket")["TokenBucket"](60)
+    now = bucket.updated
+    assert bucket.wait_time(1, now) == 0.0
+    bucket.take(60, now)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 0.5) == pytest.approx(0.5)
+    # Refilling never overshoots the capacity, and oversized requests only wait for a full bucket
+    assert bucket.wait_time(600, now + 3600) == 0.0
+    assert bucket.level == 60
+    # Usage above the estimate drives the level negative, and later callers wait it off
+    bucket.take(90, now + 3600)
+    assert bucket.wait_time(1, now + 3600) == pytest.approx(31.0)
+    unmetered = app_definitions("TokenBucket")["TokenBucket"](None)
+    unmetered.take(10 ** 9, now)
+    assert unmetered.wait_time(10 ** 9, now) == 0.0
+
+
+def test_scheduler_serves_waiters_by_priority_then_arrival():
+    helpers = app_definitions(
+        "LLM_SCHEDULER_POLL_SECONDS", "LLM_WAIT_NOTICE_SECONDS", "PRIORITY_INTERACTIVE", "PRIORITY_NORMAL", "PRIORITY_BULK",
+        "TokenBucket", "percentile", "LLMScheduler",
+    )
+    # 1200 requests per minute: one slot every 50ms once the bucket is drained
+    scheduler = helpers["LLMScheduler"](requests_per_minute=1200)
+    scheduler._buckets_for("model")[0].take(1200, time.monotonic())
+    served = []
+
+    async def call(name: str, priority: int):
+        await scheduler.acquire("model", 10, priority)
+        served.append(name)
+
+    async def main():
+        waiters = []
+        for name, priority in [("bulk-1", helpers["PRIORITY_BULK"]), ("normal", helpers["PRIORITY_NORMAL"]),
+                               ("bulk-2", helpers["PRIORITY_BULK"]), ("edit", helpers["PRIORITY_INTERACTIVE"])]:
+            waiters.append(asyncio.ensure_future(call(name, priority)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
+    assert served == ["edit", "normal", "bulk-1", "bulk-2"]
+    snapshot = scheduler.snapshot()
+    assert snapshot["calls"] == 4 and snapshot["queue_depth"] == 0 and snapshot["max_queue_depth"] == 4